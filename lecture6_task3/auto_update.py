@@ -1,108 +1,388 @@
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
 import sys
 import os
 
 # プロジェクトルートをパスに追加
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'weather-forecast-app'))
 
-from services.jma_api import JmaApiService
+from services.jma_api import JmaApiService, DEFAULT_POOL_SIZE
 from services.db_service import DatabaseService
+from services.db_maintenance import DEFAULT_RETENTION_DAYS
+from services import area_priority, recorder, run_metrics
+from services.rate_limit import DEFAULT_BURST, DEFAULT_RATE, RetryPolicy
+from services.scheduler import DEFAULT_DELAY, DEFAULT_WINDOW, UpdateScheduler
+from services.sharded_update import ShardedUpdatePipeline
+from services.update_pipeline import (
+    DEFAULT_AREA_RETRIES, DEFAULT_AREA_RETRY_DELAY, DEFAULT_AREA_RETRY_MAX_DELAY,
+    DEFAULT_PARSE_WORKERS, DEFAULT_WRITE_BATCH, UpdatePipeline,
+)
+from services.update_run import UpdateRun
 
 
-def update_all_areas():
+DEFAULT_DB_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'weather-forecast-app', 'weather.db'
+)
+
+# 地域リストの取得に失敗したときに取り直すまでの時間（秒）
+CATALOG_RETRY_DELAY = 5 * 60
+
+
+def update_all_areas(concurrency=DEFAULT_POOL_SIZE, db_path=None, retention_days=DEFAULT_RETENTION_DAYS,
+                     archive_dir=None, parse_workers=DEFAULT_PARSE_WORKERS, write_batch=DEFAULT_WRITE_BATCH,
+                     budget=0, skip_cold=False, resume=False, area_retries=DEFAULT_AREA_RETRIES,
+                     metrics_dir=None, workers=1):
     print(f"\n{'='*60}")
     print(f" 全地域の天気情報を更新")
     print(f" 実行時刻: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     print(f"{'='*60}\n")
     
     # データベースパスを絶対パスで指定
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    db_path = os.path.join(script_dir, 'weather-forecast-app', 'weather.db')
+    if db_path is None:
+        db_path = DEFAULT_DB_PATH
     
     # データベースサービスを初期化
     db_service = DatabaseService(db_path=db_path)
+    db_service.init_database()
     
-    # 全地域リストを取得
-    areas_json = JmaApiService.get_area_list()
+    # 全地域リストを取得（officesだけを解析する）
+    catalog = JmaApiService.get_area_catalog()
     
-    if not areas_json:
+    if not catalog:
         print(" 地域リストの取得に失敗しました")
         return
     
-    offices = areas_json.get('offices', {})
-    total = len(offices)
-    success_count = 0
-    error_count = 0
+    offices = catalog.section('offices')
+    run, codes, skipped = _start_run(db_service, offices, budget, skip_cold, resume)
     
-    print(f" 対象地域数: {total}件\n")
+    print(f" 対象地域数: {len(codes)}件")
+    if workers > 1:
+        print(f" 取得・解析: {workers}プロセス × 同時{concurrency}件 / 保存: {write_batch}地域ずつ\n")
+    else:
+        print(f" 同時取得数: {concurrency} / 解析: {parse_workers}スレッド / 保存: {write_batch}地域ずつ\n")
     
-    # 各地域の天気情報を取得
-    for idx, (area_code, area_info) in enumerate(offices.items(), 1):
-        area_name = area_info['name']
-        
-        print(f"[{idx}/{total}] {area_name} (コード: {area_code})")
-        
-        try:
-            # エリアを登録
-            area_db_id = db_service.insert_area(area_name, area_code)
-            
-            if area_db_id:
-                # 天気予報を取得
-                weather_json = JmaApiService.get_weather_forecast(area_code)
-                
-                if weather_json:
-                    # 天気情報をDBに保存
-                    result = db_service.insert_or_update_weather_data(area_db_id, weather_json)
-                    if result > 0:
-                        print(f" {result}件保存")
-                        success_count += 1
-                    else:
-                        print(f"保存失敗")
-                        error_count += 1
-                else:
-                    print(f" 天気情報の取得に失敗")
-                    error_count += 1
-            else:
-                print(f" エリアの登録に失敗")
-                error_count += 1
-                
-        except Exception as e:
-            print(f" エラー: {e}")
-            error_count += 1
-        
-        time.sleep(0.5)
+    retries_before = JmaApiService.retry_policy.retries
+    start = time.perf_counter()
+    stats = _update_offices(db_service, offices, concurrency, parse_workers, write_batch, codes=codes,
+                            run=run, area_retries=area_retries, workers=workers)
+    stats['skipped'] = skipped
+    run.complete()
+    elapsed = time.perf_counter() - start
+    
+    _print_summary(stats, elapsed, JmaApiService.retry_policy.retries - retries_before)
+    stats['metrics'] = report_run_metrics(db_service, run, metrics_dir)
+    
+    _after_update(db_service, stats, retention_days, archive_dir)
+    return stats
+
+
+def update_slot(db_service, scheduler, slot, concurrency=DEFAULT_POOL_SIZE, retention_days=DEFAULT_RETENTION_DAYS,
+                archive_dir=None, parse_workers=DEFAULT_PARSE_WORKERS, write_batch=DEFAULT_WRITE_BATCH,
+                budget=0, skip_cold=False, resume=False, area_retries=DEFAULT_AREA_RETRIES, metrics_dir=None,
+                workers=1):
+    """1回の発表分の更新: 全地域を何回かに分け、時刻をずらして取得する（地域リストが取れなければ None）"""
+    catalog = JmaApiService.get_area_catalog()
+    if not catalog:
+        print(" 地域リストの取得に失敗しました")
+        return None
     
+    offices = catalog.section('offices')
+    print(f" 発表時刻: {slot.strftime('%Y-%m-%d %H:%M')}")
+    run, codes, skipped = _start_run(db_service, offices, budget, skip_cold, resume, slot)
+    # 優先度の高い地域から前の回に入れる
+    plan = scheduler.plan(codes, slot, ordered=True)
+    
+    if plan:
+        print(f" 対象地域数: {len(codes)}件を{len(plan)}回に分けて取得"
+              f"（{plan[0][0].strftime('%H:%M:%S')}〜{plan[-1][0].strftime('%H:%M:%S')}）\n")
+    
+    scheduler.start_slot(slot)
+    stats = _new_stats()
+    stats['skipped'] = skipped
+    retries_before = JmaApiService.retry_policy.retries
+    start = time.perf_counter()
+    for i, (due, wave) in enumerate(plan, 1):
+        scheduler.sleep_until(due)
+        print(f"\n--- {i}/{len(plan)}回目: {len(wave)}地域（{scheduler.now().strftime('%H:%M:%S')}）---")
+        _update_offices(db_service, offices, concurrency, parse_workers, write_batch, codes=wave, stats=stats,
+                        run=run, area_retries=area_retries, workers=workers)
+    elapsed = time.perf_counter() - start
+    
+    # 回ごとの段の統計は合計しても意味がないため、発表ごとの結果には含めない
+    stats.pop('pipeline', None)
+    _print_summary(stats, elapsed, JmaApiService.retry_policy.retries - retries_before)
+    run.complete()
+    scheduler.complete_slot(slot, len(codes), stats['error'])
+    stats['metrics'] = report_run_metrics(db_service, run, metrics_dir)
+    
+    _after_update(db_service, stats, retention_days, archive_dir)
+    return stats
+
+
+def _start_run(db_service, offices, budget=0, skip_cold=False, resume=False, slot=None):
+    #回の記録を始める。resume なら中断した回を、終わっていない地域から再開する
+    #(回, 取得する地域コード, 優先度で省略した地域数) を返す
+    run = UpdateRun.find_incomplete(db_service, slot) if resume else None
+    if run:
+        # 地域リストから消えた地域は取得しない
+        codes = [code for code in run.pending() if code in offices]
+        # 取得の後・保存の前に止まった地域が、検証子だけ残って304にならないよう全件取得し直す
+        for code in codes:
+            db_service.delete_forecast_validators(code)
+        print(f" 中断した更新（{run.started_at[:19]} 開始）を残りの{len(codes)}地域から再開します")
+        return run, codes, 0
+    
+    codes, skipped = _select_areas(db_service, offices.codes, budget, skip_cold)
+    return UpdateRun.start(db_service, codes, slot), codes, skipped
+
+
+def _select_areas(db_service, codes, budget=0, skip_cold=False):
+    #画面で開かれた回数から、取得する地域を優先順に選ぶ（(地域コード, 省略した地域数) を返す）
+    selected, counts, skipped = area_priority.prioritize(
+        codes, db_service.get_area_view_stats(), budget=budget, skip_cold=skip_cold,
+    )
+    print(f" 優先度: hot {counts['hot']}件 / warm {counts['warm']}件 / cold {counts['cold']}件"
+          + (f"（1回の上限 {budget}件）" if budget else ""))
+    if any(skipped.values()):
+        print(f" 今回は省略: hot {skipped['hot']}件 / warm {skipped['warm']}件 / cold {skipped['cold']}件"
+              f"（cold の地域は画面で開いたときに取得）")
+    return selected, sum(skipped.values())
+
+
+def _print_summary(stats, elapsed, retries):
     print(f"\n{'='*60}")
     print(f" 更新結果")
-    print(f" 成功: {success_count}件")
-    print(f" 失敗: {error_count}件")
+    print(f" 成功: {stats['success']}件")
+    print(f" 変更なし: {stats['not_modified']}件")
+    print(f" 失敗: {stats['error']}件")
+    if stats.get('skipped'):
+        print(f" 優先度が低く省略: {stats['skipped']}件")
+    if stats['retried']:
+        print(f" 失敗して取得し直した回数: {stats['retried']}回")
+    print(f" 省略した転送量: {stats['bytes_saved']:,}バイト")
+    print(f" 省略したDB書き込み: {stats['not_modified'] + stats['unchanged']}地域"
+          f"（うち内容が同じ予報: {stats['unchanged']}地域）")
+    print(f" 書き込んだ行: {stats['rows_written']:,}件 / 値が同じで省略した行: {stats['rows_unchanged']:,}件")
+    print(f" 再試行: {retries}回")
+    print(f" 所要時間: {elapsed:.1f}秒")
+    if stats.get('pipeline'):
+        _print_pipeline_report(stats['pipeline'])
     print(f"{'='*60}\n")
 
 
-def auto_update_loop(interval_hours=6):
+def report_run_metrics(db_service, run, metrics_dir=None):
+    """回の計測値を表示し、metrics_dir があれば Prometheus のテキストファイルと JSON に書き出す"""
+    try:
+        if metrics_dir:
+            summary, prom_path, json_path = run_metrics.export(db_service, run.id, metrics_dir)
+        else:
+            summary = run_metrics.run_summary(db_service, run.id)
+    except Exception as e:
+        # 計測値の書き出しに失敗しても更新結果はそのまま
+        print(f" 計測値の書き出しに失敗: {e}\n")
+        return None
+    
+    fetch = summary['fetch_seconds']
+    print(f" 計測（第{summary['run_id']}回）")
+    print(f"  取得: {fetch['count']}件 / 待ち時間 中央値 {fetch['p50'] * 1000:.0f}ms・95% {fetch['p95'] * 1000:.0f}ms"
+          f"・最大 {fetch['max'] * 1000:.0f}ms / 転送量 {summary['bytes']:,}バイト")
+    print(f"  解析: {summary['parse_seconds']:.2f}秒 / 保存: {summary['write_seconds']:.2f}秒"
+          f"（挿入 {summary['rows']['inserted']:,}行・更新 {summary['rows']['updated']:,}行）")
+    print(f"  再試行: リクエスト {summary['retries']['http']}回・地域 {summary['retries']['area']}回")
+    previous = [run['elapsed'] for run in summary['history'][1:]]
+    if previous:
+        print(f"  所要時間: {summary['elapsed']:.1f}秒（前回まで{len(previous)}回の中央値 "
+              f"{sorted(previous)[len(previous) // 2]:.1f}秒）")
+    if metrics_dir:
+        print(f"  書き出し: {prom_path}, {json_path}")
+    print()
+    return summary
+
+
+def _after_update(db_service, stats, retention_days, archive_dir):
+    # 古い行を削除する前に、過去の月をアーカイブに書き出しておく
+    if archive_dir:
+        stats['archive'] = export_archive(db_service, archive_dir)
+    stats['maintenance'] = run_maintenance(db_service, retention_days)
+
+
+def export_archive(db_service, archive_dir):
+    """まだ書き出していない過去の月を列ごとのバイナリファイルに書き出す"""
+    start = time.perf_counter()
+    try:
+        months, rows = db_service.export_archive(archive_dir)
+    except Exception as e:
+        print(f" アーカイブの書き出しに失敗: {e}\n")
+        return None
+    
+    print(f" アーカイブ: {len(months)}か月分・{rows:,}行を書き出し"
+          f"（{', '.join(months) or '新しい月なし'}、{time.perf_counter() - start:.2f}秒）\n")
+    return months, rows
+
+
+def run_maintenance(db_service, retention_days=DEFAULT_RETENTION_DAYS):
+    """更新後の保守: 古い行を集計に置き換えて削除し、空いた領域をDBファイルから返却する"""
+    try:
+        result = db_service.run_maintenance(retention_days)
+    except Exception as e:
+        # 保守に失敗しても更新結果はそのまま（次回また試す）
+        print(f" DBの保守に失敗: {e}\n")
+        return None
+    
+    print(f" DBの保守")
+    if retention_days:
+        print(f" 削除した{retention_days}日より前の行: {result['deleted_rows']:,}件"
+              f"（新たに集計した日: {result['rolled_up_days']:,}件）")
+    print(f" 返却した領域: {result['reclaimed_bytes']:,}バイト"
+          f"（ファイル {result['size_before']:,} → {result['size_after']:,}バイト）")
+    print(f" 所要時間: {result['elapsed']:.2f}秒\n")
+    return result
+
+
+def _new_stats():
+    return {
+        'success': 0, 'not_modified': 0, 'unchanged': 0, 'error': 0, 'bytes_saved': 0,
+        'rows_written': 0, 'rows_unchanged': 0, 'retried': 0,
+    }
+
+
+def _update_offices(db_service, offices, concurrency, parse_workers=DEFAULT_PARSE_WORKERS,
+                    write_batch=DEFAULT_WRITE_BATCH, codes=None, stats=None, run=None,
+                    area_retries=DEFAULT_AREA_RETRIES, workers=1):
+    #取得・解析・保存の段を並行して動かし、保存できた地域から順に結果を表示
+    #codes を指定するとその地域だけ更新し、stats を渡すとそこに足し込む
+    #workers が2以上なら取得・解析を workers 個のプロセスに分ける（保存はこのプロセスで行う）
+    #run（UpdateRun）を渡すと地域ごとの結果を記録する（中断しても再開できる）
+    codes = offices.codes if codes is None else codes
+    total = len(codes)
+    stats = _new_stats() if stats is None else stats
+    done = [0]
+    refreshed = []
+    
+    def on_result(area_code, status, detail):
+        # 保存用のスレッドから1地域ずつ呼ばれる
+        if run:
+            run.record(area_code, status, detail if status in ('error', 'retry') else None)
+        if status == 'retry':
+            # 失敗した地域は後で取得し直す（その間も他の地域は進める）
+            attempt, delay, error = detail
+            print(f"[再試行待ち] {offices.name_of(area_code)} (コード: {area_code}): {error}"
+                  f"（{delay:.1f}秒後に{attempt}回目の再試行）")
+            stats['retried'] += 1
+            return
+        done[0] += 1
+        if status != 'error':
+            refreshed.append(area_code)
+        print(f"[{done[0]}/{total}] {offices.name_of(area_code)} (コード: {area_code})")
+        
+        if status == 'error':
+            print(f" 天気情報の取得・保存に失敗: {detail}")
+            stats['error'] += 1
+        elif status == 'not_modified':
+            # 前回から変更のない予報は条件付きGETで304となり、解析もDB保存も行わない
+            validators = db_service.get_forecast_validators(area_code)
+            if validators and validators[2]:
+                stats['bytes_saved'] += validators[2]
+            print(f" 変更なし（保存を省略）")
+            stats['not_modified'] += 1
+        else:
+            # 前回と同じ内容の予報・値の変わらない行は書き込まない
+            inserted, updated, unchanged = detail
+            stats['rows_written'] += inserted + updated
+            stats['rows_unchanged'] += unchanged
+            stats['success'] += 1
+            if inserted + updated == 0:
+                print(f" 内容に変更なし（保存を省略）")
+                stats['unchanged'] += 1
+            else:
+                print(f" {inserted + updated}件保存")
+    
+    options = dict(
+        concurrency=concurrency,
+        parse_workers=parse_workers,
+        write_batch=write_batch,
+        on_result=on_result,
+        retry_policy=RetryPolicy(
+            max_retries=area_retries,
+            base_delay=DEFAULT_AREA_RETRY_DELAY,
+            max_delay=DEFAULT_AREA_RETRY_MAX_DELAY,
+        ),
+    )
+    if workers > 1:
+        pipeline = ShardedUpdatePipeline(db_service, workers=workers, **options)
+    else:
+        pipeline = UpdatePipeline(db_service, **options)
+    stats['pipeline'] = pipeline.run([(code, offices.name_of(code)) for code in codes])
+    if run:
+        run.record_metrics(stats['pipeline']['areas'], stats['pipeline']['elapsed'])
+    # 次回、優先度が同じ地域の中では取得が古い地域を先にする
+    db_service.mark_areas_refreshed(refreshed)
+    return stats
+
+
+def _print_pipeline_report(report):
+    #段ごとの処理速度とキューの占有率
+    labels = {'fetch': '取得', 'parse': '解析', 'write': '保存', 'shard': '取得・解析（子プロセス）'}
+    print(f" 段ごとの処理（{report['batches']}回のトランザクションで保存）")
+    for name, stage in report['stages'].items():
+        print(f"  {labels[name]}: {stage['items']}件 / {stage['throughput']:.1f}件/秒"
+              f"（{stage['workers']}スレッド、稼働率 {stage['utilization'] * 100:.0f}%）")
+    for name, occupancy in report['queues'].items():
+        print(f"  {labels[name]}待ちのキュー: 平均 {occupancy['avg']:.1f} / 最大 {occupancy['max']}"
+              f"（上限 {occupancy['capacity']}、満杯で待った時間 {occupancy['blocked']:.2f}秒）")
+
+
+def auto_update_loop(delay=DEFAULT_DELAY, window=DEFAULT_WINDOW, concurrency=DEFAULT_POOL_SIZE,
+                     retention_days=DEFAULT_RETENTION_DAYS, archive_dir=None, parse_workers=DEFAULT_PARSE_WORKERS,
+                     write_batch=DEFAULT_WRITE_BATCH, db_path=None, budget=0, skip_cold=False,
+                     resume=False, area_retries=DEFAULT_AREA_RETRIES, metrics_dir=None, workers=1):
     print(" 天気情報自動更新サービスを開始します")
-    print(f" 更新間隔: {interval_hours}時間ごと")
+    print(f" 発表時刻（5時・11時・17時）の{delay // 60}分後から{window // 60}分かけて全地域を更新します")
     print(f"停止するには Ctrl+C を押してください\n")
     
+    db_service = DatabaseService(db_path=db_path or DEFAULT_DB_PATH)
+    db_service.init_database()
+    scheduler = UpdateScheduler(db_service, delay=delay, window=window)
+    
     iteration = 0
     
     try:
         while True:
+            due = scheduler.due_slot()
+            if due is None:
+                # 次の発表まで待機（休止から復帰したら、過ぎた発表をすぐ取り直す）
+                wake = scheduler.next_wake()
+                print(f"次回更新予定: {wake.strftime('%Y-%m-%d %H:%M:%S')}")
+                scheduler.sleep_until(wake)
+                continue
+            
+            slot, skipped = due
             iteration += 1
             print(f"\n{'#'*60}")
             print(f"# 第{iteration}回 更新")
             print(f"{'#'*60}")
+            if skipped:
+                print(f" 停止中に過ぎた{skipped}回の発表は、最新の発表の取得にまとめます")
             
-            # 全地域を更新
-            update_all_areas()
-            
-            # 次回更新まで待機
-            next_update = datetime.fromtimestamp(time.time() + interval_hours * 3600)
-            print(f"次回更新予定: {next_update.strftime('%Y-%m-%d %H:%M:%S')}")
-            print(f" {interval_hours}時間待機中...\n")
-            
-            time.sleep(interval_hours * 3600)
+            stats = update_slot(
+                db_service,
+                scheduler,
+                slot,
+                concurrency=concurrency,
+                retention_days=retention_days,
+                archive_dir=archive_dir,
+                parse_workers=parse_workers,
+                write_batch=write_batch,
+                budget=budget,
+                skip_cold=skip_cold,
+                resume=resume,
+                area_retries=area_retries,
+                metrics_dir=metrics_dir,
+                workers=workers,
+            )
+            if stats is None:
+                print(f" {CATALOG_RETRY_DELAY // 60}分後に取り直します")
+                scheduler.sleep_until(scheduler.now() + timedelta(seconds=CATALOG_RETRY_DELAY))
             
     except KeyboardInterrupt:
         print("\n\n 自動更新サービスを停止しました")
@@ -114,22 +394,166 @@ if __name__ == "__main__":
     
     parser = argparse.ArgumentParser(description='天気情報自動更新サービス')
     parser.add_argument(
-        '--interval',
+        '--delay',
         type=int,
-        default=6,
-        help='更新間隔（時間）デフォルト: 6時間'
+        default=DEFAULT_DELAY // 60,
+        help=f'発表時刻から取得を始めるまでの時間（分）デフォルト: {DEFAULT_DELAY // 60}分'
+    )
+    parser.add_argument(
+        '--window',
+        type=int,
+        default=DEFAULT_WINDOW // 60,
+        help=f'全地域の取得をずらして行う時間の幅（分）デフォルト: {DEFAULT_WINDOW // 60}分'
     )
     parser.add_argument(
         '--once',
         action='store_true',
         help='1回だけ更新して終了'
     )
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=DEFAULT_POOL_SIZE,
+        help=f'天気予報の同時取得数 デフォルト: {DEFAULT_POOL_SIZE}'
+    )
+    parser.add_argument(
+        '--parse-workers',
+        type=int,
+        default=DEFAULT_PARSE_WORKERS,
+        help=f'天気予報を解析するスレッド数 デフォルト: {DEFAULT_PARSE_WORKERS}'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='天気予報の取得・解析を分けるプロセス数（保存はこのプロセスで行う。レート制限はプロセス間で分ける）デフォルト: 1'
+    )
+    parser.add_argument(
+        '--write-batch',
+        type=int,
+        default=DEFAULT_WRITE_BATCH,
+        help=f'1回のトランザクションで保存する地域の最大数 デフォルト: {DEFAULT_WRITE_BATCH}'
+    )
+    parser.add_argument(
+        '--budget',
+        type=int,
+        default=0,
+        help='1回の更新で天気予報を取得する地域の上限（画面でよく開かれる地域から取得）デフォルト: 0（上限なし）'
+    )
+    parser.add_argument(
+        '--skip-cold',
+        action='store_true',
+        help=f'{area_priority.WARM_DAYS}日以上画面で開かれていない地域は自動更新せず、開いたときに取得する'
+    )
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='前回中断した更新を、まだ終わっていない地域から再開する'
+    )
+    parser.add_argument(
+        '--area-retries',
+        type=int,
+        default=DEFAULT_AREA_RETRIES,
+        help=f'失敗した地域を、他の地域の取得を続けながら取得し直す回数 デフォルト: {DEFAULT_AREA_RETRIES}'
+    )
+    parser.add_argument(
+        '--metrics-dir',
+        metavar='DIR',
+        help='更新ごとの計測値を DIR に weather_update.prom（Prometheus のテキスト形式）と weather_update.json として書き出す'
+    )
+    parser.add_argument(
+        '--rate',
+        type=float,
+        default=DEFAULT_RATE,
+        help=f'1秒あたりの最大リクエスト数 デフォルト: {DEFAULT_RATE}'
+    )
+    parser.add_argument(
+        '--burst',
+        type=int,
+        default=DEFAULT_BURST,
+        help=f'まとめて送れる最大リクエスト数 デフォルト: {DEFAULT_BURST}'
+    )
+    parser.add_argument(
+        '--record',
+        metavar='DIR',
+        help='取得したレスポンスをフィクスチャとしてDIRに保存'
+    )
+    parser.add_argument(
+        '--replay',
+        metavar='DIR',
+        help='気象庁APIに接続せず、DIRのフィクスチャから応答する'
+    )
+    parser.add_argument(
+        '--replay-latency',
+        type=float,
+        default=0.0,
+        help='再生時に1リクエストごとに入れる遅延（秒）'
+    )
+    parser.add_argument(
+        '--replay-failure-rate',
+        type=float,
+        default=0.0,
+        help='再生時に503を返す割合（0〜1）'
+    )
+    parser.add_argument(
+        '--retention-days',
+        type=int,
+        default=DEFAULT_RETENTION_DAYS,
+        help=f'元の天気情報を残す日数（古い日は日別・月別の集計だけ残す。0で削除しない）デフォルト: {DEFAULT_RETENTION_DAYS}'
+    )
+    parser.add_argument(
+        '--archive',
+        metavar='DIR',
+        help='過去の月の天気情報を列ごとのバイナリファイルとしてDIRに書き出す（差分のみ）'
+    )
     
     args = parser.parse_args()
     
+    if args.workers > 1 and (args.replay or args.record):
+        # 記録・再生はこのプロセスの接続に組み込むため、子プロセスには効かない
+        parser.error('--record・--replay は --workers 1 でのみ使えます')
+    
+    # 更新にかかる時間は待機時間ではなくレート制限で決まる
+    JmaApiService.configure_rate_limit(args.rate, args.burst)
+    
+    if args.replay:
+        recorder.enable_replay(
+            args.replay,
+            latency=args.replay_latency,
+            failure_rate=args.replay_failure_rate,
+        )
+    elif args.record:
+        recorder.enable_recording(args.record, pool_size=args.concurrency)
+    
     if args.once:
         # 1回だけ更新
-        update_all_areas()
+        update_all_areas(
+            concurrency=args.concurrency,
+            retention_days=args.retention_days,
+            archive_dir=args.archive,
+            parse_workers=args.parse_workers,
+            write_batch=args.write_batch,
+            budget=args.budget,
+            skip_cold=args.skip_cold,
+            resume=args.resume,
+            area_retries=args.area_retries,
+            metrics_dir=args.metrics_dir,
+            workers=args.workers,
+        )
     else:
         # 定期的に更新
-        auto_update_loop(interval_hours=args.interval)
+        auto_update_loop(
+            delay=args.delay * 60,
+            window=args.window * 60,
+            concurrency=args.concurrency,
+            retention_days=args.retention_days,
+            archive_dir=args.archive,
+            parse_workers=args.parse_workers,
+            write_batch=args.write_batch,
+            budget=args.budget,
+            skip_cold=args.skip_cold,
+            resume=args.resume,
+            area_retries=args.area_retries,
+            metrics_dir=args.metrics_dir,
+            workers=args.workers,
+        )
@@ -0,0 +1,850 @@
+"""
+天気予報アプリのベンチマーク
+ローカルのスタブサーバー（jma_stub_server.py）に対して計測するため、ネットワークは不要
+"""
+
+import asyncio
+import contextlib
+import glob
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'weather-forecast-app'))
+
+import requests
+
+from jma_stub_server import (
+    StubJmaServer, make_area_json, make_forecast_json, point_service_at, restore_service,
+)
+from services import db_connection, jma_api, weather_rollup
+from services.area_catalog import AreaCatalog
+from services.db_service import DatabaseService
+from services.forecast_model import parse_forecast
+from services.jma_api import JmaApiService
+from services.weather_archive import WeatherArchive
+from services.sharded_update import ShardedUpdatePipeline
+from services.update_pipeline import UpdatePipeline
+from services.write_behind import WriteBehindQueue
+
+
+REPO_DB_PATH = os.path.join(os.path.dirname(__file__), 'weather-forecast-app', 'weather.db')
+
+# 計測対象はローカルのスタブサーバーなので、レート制限では待たせない
+JmaApiService.configure_rate_limit(10000, 10000)
+
+
+@contextlib.contextmanager
+def quiet():
+    #サービスの進捗表示を抑制
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def _open_db(db_path):
+    #auto_update と同じく、表の書き換えを含むマイグレーションまで済ませて開く
+    with quiet():
+        db_service = DatabaseService(db_path=db_path)
+        db_service.init_database()
+    return db_service
+
+
+def _report(label, latencies):
+    latencies_ms = [t * 1000 for t in latencies]
+    print(
+        f"  {label:24} 平均 {statistics.mean(latencies_ms):7.3f} ms"
+        f" / 中央値 {statistics.median(latencies_ms):7.3f} ms"
+        f" / 合計 {sum(latencies_ms):8.1f} ms"
+    )
+
+
+def bench_session(requests_count=200, latency=0.0):
+    """requests.get（毎回新規接続）と共有セッション（keep-alive）の比較"""
+    print("=" * 60)
+    print(f" 接続プールのベンチマーク（{requests_count}リクエスト）")
+    print("=" * 60)
+
+    with StubJmaServer(latency=latency) as stub:
+        original = point_service_at(stub.base_url)
+        try:
+            area_codes = list(stub.area_json['offices'])
+            codes = [area_codes[i % len(area_codes)] for i in range(requests_count)]
+
+            # 変更前: 毎回 requests.get で新しい接続を張る
+            before = []
+            connections_before = stub.connection_count
+            for code in codes:
+                url = JmaApiService.FORECAST_URL.format(area_code=code)
+                start = time.perf_counter()
+                requests.get(url, timeout=10).json()
+                before.append(time.perf_counter() - start)
+            connections_before = stub.connection_count - connections_before
+
+            # 変更後: 共有セッション経由（JmaApiService）
+            jma_api.configure_session()
+            after = []
+            connections_after = stub.connection_count
+            with quiet():
+                for code in codes:
+                    start = time.perf_counter()
+                    JmaApiService.get_weather_forecast(code)
+                    after.append(time.perf_counter() - start)
+            connections_after = stub.connection_count - connections_after
+        finally:
+            restore_service(original)
+
+    _report("変更前 requests.get", before)
+    _report("変更後 共有セッション", after)
+    print(f"  TCP接続数: {connections_before} -> {connections_after}")
+    print(f"  1リクエストあたり {statistics.mean(before) / statistics.mean(after):.2f}倍高速")
+    print()
+
+
+def bench_batch(latency=0.05, concurrency=10):
+    """逐次取得と並行取得（get_weather_forecasts）の比較"""
+    print("=" * 60)
+    print(f" 並行取得のベンチマーク（応答遅延 {latency * 1000:.0f} ms, 同時 {concurrency}件）")
+    print("=" * 60)
+
+    with StubJmaServer(latency=latency) as stub:
+        original = point_service_at(stub.base_url)
+        try:
+            codes = list(stub.area_json['offices'])
+            jma_api.configure_session(pool_size=concurrency)
+
+            # 変更前: 1件ずつ取得（旧実装はさらに1件ごとに0.5秒待機していた）
+            start = time.perf_counter()
+            with quiet():
+                for code in codes:
+                    JmaApiService.get_weather_forecast(code)
+            sequential = time.perf_counter() - start
+
+            # 変更後: 同時実行数を制限して並行取得
+            start = time.perf_counter()
+            results = JmaApiService.get_weather_forecasts(codes, concurrency=concurrency)
+            batch = time.perf_counter() - start
+        finally:
+            restore_service(original)
+
+    errors = sum(isinstance(result, Exception) for result in results.values())
+    print(f"  対象地域数: {len(codes)}件（失敗 {errors}件）")
+    print(f"  逐次取得:             {sequential:6.2f} 秒（旧実装の待機込み: {sequential + 0.5 * len(codes):6.2f} 秒）")
+    print(f"  並行取得:             {batch:6.2f} 秒")
+    print(f"  理論値 max遅延×ceil(N/同時数): {latency * -(-len(codes) // concurrency):6.2f} 秒")
+    print()
+
+
+def _legacy_rows(weather_json):
+    #変更前の insert_or_update_weather_data と同じ辞書の辿り方（比較用）
+    time_series = weather_json[0]['timeSeries']
+    weather_data = time_series[0]
+    time_defines = weather_data['timeDefines']
+    area_data = weather_data['areas'][0]
+
+    rain_dict = {}
+    if len(time_series) > 1 and 'pops' in time_series[1]['areas'][0]:
+        rain_area = time_series[1]['areas'][0]
+        for i, rain_time in enumerate(time_series[1].get('timeDefines', [])):
+            if i < len(rain_area['pops']) and rain_area['pops'][i] != '':
+                rain_dict[rain_time] = int(rain_area['pops'][i])
+
+    temp_dict = {}
+    if len(time_series) > 2 and 'temps' in time_series[2]['areas'][0]:
+        temp_area = time_series[2]['areas'][0]
+        for i, temp_time in enumerate(time_series[2].get('timeDefines', [])):
+            if i < len(temp_area['temps']) and temp_area['temps'][i] != '':
+                temp_dict.setdefault(temp_time.split('T')[0], []).append(float(temp_area['temps'][i]))
+
+    rows = []
+    for i, time_define in enumerate(time_defines):
+        weather = area_data['weathers'][i] if i < len(area_data.get('weathers', [])) else None
+        if not weather:
+            continue
+        temps = temp_dict.get(time_define.split('T')[0], [])
+        rows.append((
+            time_define,
+            min(temps) if temps else None,
+            max(temps) if temps else None,
+            area_data['winds'][i] if i < len(area_data.get('winds', [])) else None,
+            area_data['waves'][i] if i < len(area_data.get('waves', [])) else None,
+            rain_dict.get(time_define),
+            weather,
+        ))
+    return rows
+
+
+def load_forecast_files(directory=None, count=500):
+    """記録済みの天気予報JSONを読み込む（ディレクトリ未指定ならダミーを作成）"""
+    if directory:
+        documents = []
+        for path in sorted(glob.glob(os.path.join(directory, '**', '*.json'), recursive=True)):
+            with open(path, encoding='utf-8') as f:
+                document = json.load(f)
+            # forecast/{code}.json の形（リスト）のものだけ使う
+            if isinstance(document, list):
+                documents.append(document)
+        return documents
+
+    return [make_forecast_json(f"{10000 + i * 100:06d}", seed=i) for i in range(count)]
+
+
+def bench_parse_store(directory=None, repeat=5):
+    """天気予報JSONの解析と保存のスループット"""
+    documents = load_forecast_files(directory)
+    print("=" * 60)
+    print(f" 解析・保存のベンチマーク（{len(documents)}件）")
+    print("=" * 60)
+
+    if not documents:
+        print("  天気予報JSONが見つかりません")
+        return
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for document in documents:
+            _legacy_rows(document)
+    legacy = (time.perf_counter() - start) / repeat
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for document in documents:
+            parse_forecast(document).rows()
+    bundle = (time.perf_counter() - start) / repeat
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        db_path = os.path.join(temp_dir, 'weather.db')
+        shutil.copy(REPO_DB_PATH, db_path)
+        with quiet():
+            db_service = _open_db(db_path)
+        area_ids = [
+            db_service.insert_area(f"地域{i}", f"B{i:05d}") for i in range(len(documents))
+        ]
+
+        start = time.perf_counter()
+        rows = 0
+        for area_db_id, document in zip(area_ids, documents):
+            rows += db_service.insert_or_update_weather_data(area_db_id, parse_forecast(document))
+        store = time.perf_counter() - start
+    finally:
+        db_connection.close_all()
+        shutil.rmtree(temp_dir)
+
+    print(f"  解析（変更前の辞書走査）:  {len(documents) / legacy:10,.0f} 件/秒")
+    print(f"  解析（ForecastBundle）:   {len(documents) / bundle:10,.0f} 件/秒")
+    print(f"  解析＋保存:               {len(documents) / store:10,.0f} 件/秒（{rows:,}行）")
+    print()
+
+
+def _legacy_store(db_path, area_code, area_db_id, bundle):
+    #変更前と同じく、操作ごとに接続を開いて閉じる（ロールバックジャーナル）
+    for _ in range(2):
+        conn = sqlite3.connect(db_path)
+        try:
+            conn.execute("SELECT etag FROM forecast_validator WHERE area_id = ?", (area_code,)).fetchone()
+        finally:
+            conn.close()
+
+    conn = sqlite3.connect(db_path)
+    try:
+        _legacy_upsert(conn, area_db_id, bundle)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _legacy_upsert(conn, area_db_id, bundle):
+    #変更前の保存処理: 1行ごとに SELECT してから UPDATE / INSERT
+    for row in bundle.rows():
+        existing = conn.execute(
+            "SELECT id FROM weather_info WHERE area_id = ? AND time = ?", (area_db_id, row[0])
+        ).fetchone()
+        if existing:
+            conn.execute(
+                "UPDATE weather_info SET min_temperature = ?, max_temperature = ?, wind = ?, wave = ?,"
+                " rain_proba = ?, weather = ? WHERE id = ?", row[1:] + (existing[0],)
+            )
+        else:
+            conn.execute(
+                "INSERT INTO weather_info (time, min_temperature, max_temperature, wind, wave,"
+                " rain_proba, weather, area_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", row + (area_db_id,)
+            )
+
+
+def bench_db_connection(areas=200):
+    """自動更新1回分のDB操作: 操作ごとの接続（変更前）と ConnectionManager（WAL）の比較"""
+    print("=" * 60)
+    print(f" DB接続のベンチマーク（{areas}地域）")
+    print("=" * 60)
+
+    bundles = [parse_forecast(make_forecast_json(f"{i:06d}", seed=i)) for i in range(areas)]
+    temp_dir = tempfile.mkdtemp()
+    try:
+        legacy_path = os.path.join(temp_dir, 'legacy.db')
+        shutil.copy(REPO_DB_PATH, legacy_path)
+        db_path = os.path.join(temp_dir, 'weather.db')
+        shutil.copy(REPO_DB_PATH, db_path)
+
+        with quiet():
+            db_service = _open_db(db_path)
+        area_ids = [db_service.insert_area(f"地域{i}", f"{i:06d}") for i in range(areas)]
+
+        # 変更前のDBはロールバックジャーナルのまま
+        conn = sqlite3.connect(legacy_path)
+        conn.execute("CREATE TABLE IF NOT EXISTS forecast_validator (area_id TEXT PRIMARY KEY, etag TEXT)")
+        conn.close()
+
+        start = time.perf_counter()
+        for i, (area_db_id, bundle) in enumerate(zip(area_ids, bundles)):
+            _legacy_store(legacy_path, f"{i:06d}", area_db_id, bundle)
+        legacy = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for i, (area_db_id, bundle) in enumerate(zip(area_ids, bundles)):
+            db_service.get_forecast_validators(f"{i:06d}")
+            db_service.get_forecast_validators(f"{i:06d}")
+            db_service.insert_or_update_weather_data(area_db_id, bundle)
+        managed = time.perf_counter() - start
+    finally:
+        db_connection.close_all()
+        shutil.rmtree(temp_dir)
+
+    print(f"  操作ごとに接続（変更前）:  {legacy * 1000:8.1f} ms（{areas / legacy:8,.0f} 地域/秒）")
+    print(f"  ConnectionManager（WAL）:  {managed * 1000:8.1f} ms（{areas / managed:8,.0f} 地域/秒）")
+    print()
+
+
+def _fill_history(db_path, areas, rows):
+    #areas 地域分の過去の天気情報を rows 行ほど入れておく（3時間ごと）
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.executemany(
+            "INSERT OR IGNORE INTO area (area_name, area_id) VALUES (?, ?)",
+            ((f"地域{i}", f"{i:06d}") for i in range(areas)),
+        )
+        area_ids = [
+            conn.execute("SELECT id FROM area WHERE area_id = ?", (f"{i:06d}",)).fetchone()[0]
+            for i in range(areas)
+        ]
+        start = datetime(2015, 1, 1)
+        per_area = rows // areas
+        conn.executemany(
+            "INSERT INTO weather_info (time, min_temperature, max_temperature, weather, area_id)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (
+                ((start + timedelta(hours=3 * i)).strftime('%Y-%m-%dT%H:%M:%S+09:00'), 5.0, 15.0, '晴れ', area_id)
+                for area_id in area_ids for i in range(per_area)
+            ),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    return area_ids
+
+
+def bench_upsert(existing_rows=100_000, areas=200):
+    """天気情報の保存: 1行ずつ SELECT→UPDATE/INSERT（変更前）と executemany のupsert の比較"""
+    print("=" * 60)
+    print(f" 天気情報保存のベンチマーク（既存 {existing_rows:,}行、{areas}地域）")
+    print("=" * 60)
+
+    bundles = [parse_forecast(make_forecast_json(f"{i:06d}", seed=i)) for i in range(areas)]
+    temp_dir = tempfile.mkdtemp()
+    try:
+        legacy_path = os.path.join(temp_dir, 'legacy.db')
+        shutil.copy(REPO_DB_PATH, legacy_path)
+        area_ids = _fill_history(legacy_path, areas, existing_rows)
+        db_path = os.path.join(temp_dir, 'weather.db')
+        shutil.copy(legacy_path, db_path)
+
+        results = []
+        # 変更前: (area_id, time) のインデックスなし
+        conn = sqlite3.connect(legacy_path)
+        try:
+            for label in ('挿入', '更新'):
+                start = time.perf_counter()
+                rows = 0
+                for area_db_id, bundle in zip(area_ids, bundles):
+                    _legacy_upsert(conn, area_db_id, bundle)
+                    conn.commit()
+                    rows += len(bundle.rows())
+                results.append((f"1行ずつ（{label}）", rows, time.perf_counter() - start))
+
+            # 参考: インデックスだけ追加した場合（文の数は変わらない）
+            conn.execute("CREATE INDEX idx_legacy_area_time ON weather_info (area_id, time)")
+            start = time.perf_counter()
+            for area_db_id, bundle in zip(area_ids, bundles):
+                _legacy_upsert(conn, area_db_id, bundle)
+                conn.commit()
+            results.append(("1行ずつ・索引あり（更新）", rows, time.perf_counter() - start))
+        finally:
+            conn.close()
+
+        with quiet():
+            db_service = _open_db(db_path)
+        # 2回目は値の変わった予報、3回目は同じ予報（指紋が一致して書き込まない）
+        changed = [parse_forecast(make_forecast_json(f"{i:06d}", seed=i + 1)) for i in range(areas)]
+        for label, batch in (('挿入', bundles), ('更新', changed), ('変更なし', changed)):
+            start = time.perf_counter()
+            rows = 0
+            for area_db_id, bundle in zip(area_ids, batch):
+                rows += sum(db_service.upsert_weather_data([(area_db_id, bundle)]))
+            results.append((f"upsert 1予報ずつ（{label}）", rows, time.perf_counter() - start))
+
+        start = time.perf_counter()
+        rows = sum(db_service.upsert_weather_data(zip(area_ids, bundles)))
+        results.append(("upsert 全予報まとめて（更新）", rows, time.perf_counter() - start))
+    finally:
+        db_connection.close_all()
+        shutil.rmtree(temp_dir)
+
+    for label, rows, elapsed in results:
+        print(f"  {label:28} {rows / elapsed:10,.0f} 行/秒（{rows:,}行）")
+    print()
+
+
+def bench_history(existing_rows=100_000, areas=200, limit=50, repeat=20):
+    """履歴の取得: 変更前のクエリ（インデックスなし）と iter_weather_history の比較"""
+    print("=" * 60)
+    print(f" 履歴取得のベンチマーク（{existing_rows:,}行、{limit}件ずつ）")
+    print("=" * 60)
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        db_path = os.path.join(temp_dir, 'weather.db')
+        shutil.copy(REPO_DB_PATH, db_path)
+        _fill_history(db_path, areas, existing_rows)
+        area_code = f"{areas // 2:06d}"
+
+        conn = sqlite3.connect(db_path)
+        try:
+            def legacy(area_code):
+                where = "WHERE a.area_id = ?" if area_code else ""
+                params = (area_code, limit) if area_code else (limit,)
+                return conn.execute(f"""
+                    SELECT w.id, a.area_name, w.time, w.weather, w.min_temperature,
+                           w.max_temperature, w.wind, w.wave, w.rain_proba
+                    FROM weather_info w JOIN area a ON w.area_id = a.id
+                    {where} ORDER BY w.time DESC LIMIT ?
+                """, params).fetchall()
+
+            results = []
+            for label, code in (("地域ごと", area_code), ("全地域", None)):
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    legacy(code)
+                results.append((f"変更前（{label}）", (time.perf_counter() - start) / repeat))
+        finally:
+            conn.close()
+
+        with quiet():
+            db_service = _open_db(db_path)
+        for label, code in (("地域ごと", area_code), ("全地域", None)):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                db_service.get_weather_history(area_id=code, limit=limit)
+            results.append((f"インデックス（{label}）", (time.perf_counter() - start) / repeat))
+
+        # 全履歴を順に読む（キーセット方式なので後ろのページも遅くならない）
+        start = time.perf_counter()
+        total = sum(1 for _ in db_service.iter_weather_history(page_size=500))
+        scan = time.perf_counter() - start
+    finally:
+        db_connection.close_all()
+        shutil.rmtree(temp_dir)
+
+    for label, elapsed in results:
+        print(f"  {label:24} {elapsed * 1000:8.3f} ms")
+    print(f"  全履歴の読み出し:        {total / scan:10,.0f} 行/秒（{total:,}行）")
+    print()
+
+
+def bench_rollup(existing_rows=100_000, areas=20, repeat=20):
+    """長い期間の天気: 元の行を集計するクエリと日別・月別の集計表の比較"""
+    print("=" * 60)
+    print(f" 集計表のベンチマーク（{existing_rows:,}行、{areas}地域）")
+    print("=" * 60)
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        db_path = os.path.join(temp_dir, 'weather.db')
+        shutil.copy(REPO_DB_PATH, db_path)
+        # 既存の行の集計表はマイグレーションで作られないよう、先に最新にしてから行を入れる
+        with quiet():
+            _open_db(db_path)
+        db_connection.close_all()
+        _fill_history(db_path, areas, existing_rows)
+        area_code = f"{areas // 2:06d}"
+        first, last = datetime(2015, 1, 1), datetime(2015, 1, 1) + timedelta(hours=3 * (existing_rows // areas))
+
+        with quiet():
+            db_service = _open_db(db_path)
+        start = time.perf_counter()
+        with db_service.connections.write() as conn:
+            for (area_db_id,) in conn.execute("SELECT id FROM area").fetchall():
+                weather_rollup.refresh_area(conn, area_db_id)
+        build = time.perf_counter() - start
+
+        conn = sqlite3.connect(db_path)
+        try:
+            def legacy():
+                # 集計表がない場合は、期間中の元の行を毎回月ごとに集計する
+                return conn.execute("""
+                    SELECT substr(w.time, 1, 7), MIN(w.min_temperature), MAX(w.max_temperature),
+                           MAX(w.rain_proba), AVG(w.rain_proba)
+                    FROM weather_info w JOIN area a ON w.area_id = a.id
+                    WHERE a.area_id = ? AND w.time >= ? AND w.time < ?
+                    GROUP BY 1 ORDER BY 1
+                """, (area_code, first.date().isoformat(), last.date().isoformat())).fetchall()
+
+            results = []
+            start = time.perf_counter()
+            for _ in range(repeat):
+                legacy()
+            results.append(("元の行を集計", (time.perf_counter() - start) / repeat))
+        finally:
+            conn.close()
+
+        for resolution in ('raw', 'daily', 'monthly'):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                _, rows = db_service.get_weather_series(area_code, first, last, resolution=resolution)
+            results.append((f"{resolution}（{len(rows):,}行）", (time.perf_counter() - start) / repeat))
+        chosen, _ = db_service.get_weather_series(area_code, first, last)
+    finally:
+        db_connection.close_all()
+        shutil.rmtree(temp_dir)
+
+    print(f"  集計表の作成: {build:.2f} 秒（{areas}地域、{(last - first).days}日分）")
+    for label, elapsed in results:
+        print(f"  {label:24} {elapsed * 1000:8.3f} ms")
+    print(f"  自動で選ばれた粒度: {chosen}")
+    print()
+
+
+def bench_maintenance(existing_rows=100_000, areas=200, retention_days=365):
+    """保守: 保存期間より古い行を集計に置き換えて削除し、領域を返却する時間と返却したバイト数"""
+    print("=" * 60)
+    print(f" DB保守のベンチマーク（{existing_rows:,}行、{retention_days}日より前を削除）")
+    print("=" * 60)
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        db_path = os.path.join(temp_dir, 'weather.db')
+        shutil.copy(REPO_DB_PATH, db_path)
+        with quiet():
+            db_service = _open_db(db_path)
+        db_connection.close_all()
+        # 2015年から3時間ごと（集計表は保守のときに作られる）
+        _fill_history(db_path, areas, existing_rows)
+        result = db_service.run_maintenance(retention_days)
+    finally:
+        db_connection.close_all()
+        shutil.rmtree(temp_dir)
+
+    print(f"  削除した行:     {result['deleted_rows']:10,}件（集計した日: {result['rolled_up_days']:,}件）")
+    print(f"  返却した領域:   {result['reclaimed_bytes']:10,}バイト")
+    print(f"  ファイルサイズ: {result['size_before']:,} → {result['size_after']:,}バイト")
+    print(f"  所要時間:       {result['elapsed']:10.2f}秒（{result['deleted_rows'] / result['elapsed']:,.0f} 行/秒）")
+    print()
+
+
+def bench_archive(existing_rows=500_000, areas=50):
+    """分析用の読み込み: get_weather_history のリストと、列ごとのアーカイブ（numpy.memmap）の比較"""
+    print("=" * 60)
+    print(f" アーカイブのベンチマーク（{existing_rows:,}行、{areas}地域）")
+    print("=" * 60)
+
+    try:
+        import numpy
+    except ImportError:
+        print("  numpy がないため省略")
+        print()
+        return
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        db_path = os.path.join(temp_dir, 'weather.db')
+        archive_dir = os.path.join(temp_dir, 'archive')
+        shutil.copy(REPO_DB_PATH, db_path)
+        with quiet():
+            db_service = _open_db(db_path)
+        db_connection.close_all()
+        _fill_history(db_path, areas, existing_rows)
+
+        # 変更前: 全履歴をリストにして地域ごとの最高気温の平均を求める
+        tracemalloc.start()
+        start = time.perf_counter()
+        rows = db_service.get_weather_history(limit=existing_rows)
+        highs = {}
+        for row in rows:
+            if row[5] is not None:
+                highs.setdefault(row[1], []).append(row[5])
+        legacy = {name: sum(values) / len(values) for name, values in highs.items()}
+        legacy_time = time.perf_counter() - start
+        _, legacy_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del rows, highs
+
+        start = time.perf_counter()
+        months, exported = db_service.export_archive(archive_dir)
+        export_time = time.perf_counter() - start
+        size = sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, names in os.walk(archive_dir) for name in names
+        )
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        archive = WeatherArchive(archive_dir)
+        sums = numpy.zeros(len(archive.manifest['dictionaries']['area']))
+        counts = numpy.zeros_like(sums)
+        for _, columns in archive.iter_partitions(columns=('area', 'max_temperature')):
+            known = ~numpy.isnan(columns['max_temperature'])
+            area = columns['area'][known]
+            sums += numpy.bincount(area, weights=columns['max_temperature'][known], minlength=len(sums))
+            counts += numpy.bincount(area, minlength=len(sums))
+        means = sums[counts > 0] / counts[counts > 0]
+        archive_time = time.perf_counter() - start
+        _, archive_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        db_connection.close_all()
+        shutil.rmtree(temp_dir)
+
+    assert len(means) == len(legacy)
+    print(f"  書き出し:           {export_time:8.2f} 秒（{len(months)}か月、{exported:,}行、{size:,}バイト）")
+    print(f"  変更前（リスト）:   {legacy_time * 1000:8.1f} ms（メモリ {legacy_peak / 1024 / 1024:.1f} MiB）")
+    print(f"  アーカイブ（memmap）:{archive_time * 1000:8.1f} ms（メモリ {archive_peak / 1024 / 1024:.1f} MiB）")
+    print()
+
+
+def bench_write_behind(areas=200):
+    """画面からの保存: 同期で保存（変更前）と write-behind の submit の待ち時間の比較"""
+    print("=" * 60)
+    print(f" 画面からの保存のベンチマーク（{areas}地域）")
+    print("=" * 60)
+
+    bundles = [parse_forecast(make_forecast_json(f"{i:06d}", seed=i)) for i in range(areas)]
+    temp_dir = tempfile.mkdtemp()
+    try:
+        results = []
+        for label in ('同期（変更前）', 'write-behind'):
+            db_path = os.path.join(temp_dir, f"{len(results)}.db")
+            shutil.copy(REPO_DB_PATH, db_path)
+            with quiet():
+                db_service = _open_db(db_path)
+            writer = WriteBehindQueue(db_service)
+
+            latencies = []
+            start = time.perf_counter()
+            with quiet():
+                for i, bundle in enumerate(bundles):
+                    call_start = time.perf_counter()
+                    if label == 'write-behind':
+                        writer.submit(f"{i:06d}", f"地域{i}", bundle)
+                    else:
+                        area_db_id = db_service.insert_area(f"地域{i}", f"{i:06d}")
+                        db_service.insert_or_update_weather_data(area_db_id, bundle)
+                    latencies.append(time.perf_counter() - call_start)
+                writer.close()
+            results.append((label, latencies, time.perf_counter() - start, writer.stats()))
+    finally:
+        db_connection.close_all()
+        shutil.rmtree(temp_dir)
+
+    for label, latencies, total, stats in results:
+        _report(label, latencies)
+    stats = results[-1][3]
+    print(f"  write-behind: {stats['batches']}回のトランザクション、最大深さ {stats['max_depth']}、"
+          f"コミットまで 平均 {stats['latency_avg'] * 1000:.1f} ms / 最大 {stats['latency_max'] * 1000:.1f} ms")
+    print()
+
+
+def bench_update_pipeline(latency=0.05, concurrency=10, offices=300):
+    """全地域の更新: 取得できた順に1地域ずつ保存（変更前）と 取得→解析→保存 の段の比較"""
+    print("=" * 60)
+    print(f" 更新の段のベンチマーク（{offices}地域、応答遅延 {latency * 1000:.0f} ms, 同時 {concurrency}件）")
+    print("=" * 60)
+
+    area_json = make_area_json(office_count=offices)
+    temp_dir = tempfile.mkdtemp()
+    with StubJmaServer(latency=latency, area_json=area_json) as stub:
+        original = point_service_at(stub.base_url)
+        try:
+            jma_api.configure_session(pool_size=concurrency)
+            codes = list(stub.area_json['offices'])
+            names = {code: stub.area_json['offices'][code]['name'] for code in codes}
+            results = []
+
+            # 変更前: イベントループの中で保存するため、その間は次の取得を始められない
+            db_path = os.path.join(temp_dir, 'legacy.db')
+            shutil.copy(REPO_DB_PATH, db_path)
+            with quiet():
+                db_service = _open_db(db_path)
+
+            async def legacy():
+                forecasts = JmaApiService.iter_weather_forecasts(codes, concurrency, validator_store=db_service)
+                async for code, weather_json in forecasts:
+                    if isinstance(weather_json, Exception) or weather_json is jma_api.NOT_MODIFIED:
+                        continue
+                    area_db_id = db_service.insert_area(names[code], code)
+                    db_service.upsert_weather_data([(area_db_id, weather_json)])
+
+            start = time.perf_counter()
+            asyncio.run(legacy())
+            results.append(("1地域ずつ（変更前）", time.perf_counter() - start, None))
+
+            db_path = os.path.join(temp_dir, 'pipeline.db')
+            shutil.copy(REPO_DB_PATH, db_path)
+            with quiet():
+                db_service = _open_db(db_path)
+            pipeline = UpdatePipeline(db_service, concurrency=concurrency)
+            report = pipeline.run([(code, names[code]) for code in codes])
+            results.append(("段に分けて並行", report['elapsed'], report))
+        finally:
+            restore_service(original)
+            db_connection.close_all()
+            shutil.rmtree(temp_dir)
+
+    for label, elapsed, _ in results:
+        print(f"  {label:20} {elapsed:6.2f} 秒（{len(codes) / elapsed:6.1f} 地域/秒）")
+    print(f"  理論値 遅延×ceil(N/同時数): {latency * -(-len(codes) // concurrency):6.2f} 秒")
+    labels = {'fetch': '取得', 'parse': '解析', 'write': '保存'}
+    for name, stage in report['stages'].items():
+        print(f"  {labels[name]}: {stage['throughput']:7.1f} 件/秒（稼働率 {stage['utilization'] * 100:3.0f}%）")
+    for name, occupancy in report['queues'].items():
+        print(f"  {labels[name]}待ちのキュー: 平均 {occupancy['avg']:.1f} / 最大 {occupancy['max']}（上限 {occupancy['capacity']}）")
+    print(f"  保存のトランザクション: {report['batches']}回")
+    print()
+
+
+def _serve_stub(latency, offices, sub_areas, urls, stop):
+    #スタブサーバーを別のプロセスで動かす（応答を作る時間を計測するプロセスに含めない）
+    area_json = make_area_json(office_count=offices)
+    forecasts = {code: make_forecast_json(code, sub_areas=sub_areas) for code in area_json['offices']}
+    with StubJmaServer(latency=latency, area_json=area_json, forecasts=forecasts) as stub:
+        urls.put(stub.base_url)
+        stop.wait()
+
+
+def bench_workers(latency=0.02, concurrency=10, offices=300, sub_areas=30, worker_counts=(1, 2, 4, 8)):
+    """全地域の更新: 取得・解析を分けるプロセス数ごとの比較（保存はどれも1プロセス）"""
+    print("=" * 60)
+    print(f" 更新のプロセス数のベンチマーク（{offices}地域 × 細分区域{sub_areas}、"
+          f"応答遅延 {latency * 1000:.0f} ms, 1プロセスあたり同時 {concurrency}件、CPU {os.cpu_count()}コア）")
+    print("=" * 60)
+
+    context = multiprocessing.get_context('spawn')
+    urls = context.Queue()
+    stop = context.Event()
+    server = context.Process(target=_serve_stub, args=(latency, offices, sub_areas, urls, stop), daemon=True)
+    server.start()
+    temp_dir = tempfile.mkdtemp()
+    original = point_service_at(urls.get(timeout=60))
+    results = []
+    try:
+        jma_api.configure_session(pool_size=concurrency)
+        areas = [(code, office['name']) for code, office in make_area_json(office_count=offices)['offices'].items()]
+        for workers in worker_counts:
+            db_path = os.path.join(temp_dir, f'workers{workers}.db')
+            shutil.copy(REPO_DB_PATH, db_path)
+            with quiet():
+                db_service = _open_db(db_path)
+            if workers > 1:
+                pipeline = ShardedUpdatePipeline(db_service, workers=workers, concurrency=concurrency)
+            else:
+                pipeline = UpdatePipeline(db_service, concurrency=concurrency)
+            report = pipeline.run(areas)
+            saved = sum(1 for metrics in report['areas'].values() if metrics['inserted'] or metrics['updated'])
+            results.append((workers, report['elapsed'], saved, report))
+    finally:
+        restore_service(original)
+        db_connection.close_all()
+        shutil.rmtree(temp_dir)
+        stop.set()
+        server.join()
+
+    base = results[0][1]
+    for workers, elapsed, saved, report in results:
+        write = report['stages']['write']
+        print(f"  {workers}プロセス: {elapsed:6.2f} 秒（{len(areas) / elapsed:6.1f} 地域/秒、{base / elapsed:4.2f}倍）"
+              f" 保存 {saved}地域 / 保存の稼働率 {write['utilization'] * 100:3.0f}%")
+    print(f"  理論値 遅延×ceil(N/同時数)（1プロセス）: {latency * -(-len(areas) // concurrency):6.2f} 秒")
+    print("  ※ プロセスの起動（モジュールの読み込み）の時間を含む。コア数より多いプロセスは速くならない")
+    print()
+
+
+def _measure(func, repeat=20):
+    #実行時間（平均）と確保したメモリのピークを計測
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    elapsed = (time.perf_counter() - start) / repeat
+
+    tracemalloc.start()
+    result = func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, result
+
+
+def bench_area_catalog():
+    """area.json 全体の解析と AreaCatalog（officesのみ）の比較"""
+    # 実際の area.json に近い件数（class20sは約1900件）
+    raw = json.dumps(
+        make_area_json(class10_per_office=3, class20_per_class10=11), ensure_ascii=False
+    ).encode('utf-8')
+
+    print("=" * 60)
+    print(f" 地域リスト解析のベンチマーク（{len(raw):,}バイト）")
+    print("=" * 60)
+
+    full_time, full_peak, _ = _measure(lambda: json.loads(raw)['offices'])
+    catalog_time, catalog_peak, _ = _measure(lambda: AreaCatalog(raw).section('offices'))
+
+    print(f"  json.loads（全体）:       {full_time * 1000:7.2f} ms / ピーク {full_peak / 1024:8.0f} KiB")
+    print(f"  AreaCatalog（offices）:   {catalog_time * 1000:7.2f} ms / ピーク {catalog_peak / 1024:8.0f} KiB")
+    print()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='天気予報アプリのベンチマーク')
+    parser.add_argument(
+        '--requests',
+        type=int,
+        default=200,
+        help='リクエスト数 デフォルト: 200'
+    )
+    parser.add_argument(
+        '--forecast-dir',
+        default=None,
+        help='解析ベンチマークに使う天気予報JSONのディレクトリ（省略時はダミー）'
+    )
+
+    args = parser.parse_args()
+
+    bench_session(requests_count=args.requests)
+    bench_batch()
+    bench_parse_store(directory=args.forecast_dir)
+    bench_db_connection()
+    bench_upsert()
+    bench_history()
+    bench_rollup()
+    bench_maintenance()
+    bench_archive()
+    bench_write_behind()
+    bench_update_pipeline()
+    bench_workers()
+    bench_area_catalog()
@@ -0,0 +1,318 @@
+"""
+気象庁APIの代わりに使うローカルのスタブサーバー
+ベンチマークとテストでネットワークなしに JmaApiService を動かすために使う
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'weather-forecast-app'))
+
+from services.jma_api import JmaApiService
+
+
+JST = timezone(timedelta(hours=9))
+
+AREA_PATH = '/bosai/common/const/area.json'
+FORECAST_PREFIX = '/bosai/forecast/data/forecast/'
+
+WEATHERS = ['晴れ', 'くもり', '晴れ　時々　くもり', 'くもり　夜　雨', '雨', '雪']
+
+
+def make_area_json(office_count=58, class10_per_office=3, class20_per_class10=8):
+    #area.jsonと同じ形のダミーデータを作成
+    centers = {}
+    offices = {}
+    class10s = {}
+    class15s = {}
+    class20s = {}
+
+    center_count = 11
+    for c in range(center_count):
+        center_code = f"0{10100 + c * 100}"
+        centers[center_code] = {
+            'name': f"地方{c}",
+            'enName': f"Region{c}",
+            'officeName': f"気象台{c}",
+            'children': [],
+        }
+
+    center_codes = list(centers)
+    for o in range(office_count):
+        office_code = f"{10000 + o * 100 + 10000:06d}"
+        center_code = center_codes[o % center_count]
+        centers[center_code]['children'].append(office_code)
+        offices[office_code] = {
+            'name': f"地域{o}",
+            'enName': f"Office{o}",
+            'officeName': f"気象台{o}",
+            'parent': center_code,
+            'children': [],
+        }
+
+        for k in range(class10_per_office):
+            class10_code = f"{office_code[:4]}{k + 1:02d}"
+            offices[office_code]['children'].append(class10_code)
+            class10s[class10_code] = {
+                'name': f"{o}地方{k}",
+                'enName': f"Area{o}-{k}",
+                'parent': office_code,
+                'children': [],
+            }
+            class15_code = f"{class10_code}0"
+            class10s[class10_code]['children'].append(class15_code)
+            class15s[class15_code] = {
+                'name': f"{o}-{k}地区",
+                'enName': f"District{o}-{k}",
+                'parent': class10_code,
+                'children': [],
+            }
+
+            for m in range(class20_per_class10):
+                class20_code = f"{class15_code}{m:02d}0"
+                class15s[class15_code]['children'].append(class20_code)
+                class20s[class20_code] = {
+                    'name': f"{o}-{k}-{m}町",
+                    'enName': f"Town{o}-{k}-{m}",
+                    'kana': 'ちょう',
+                    'parent': class15_code,
+                }
+
+    return {
+        'centers': centers,
+        'offices': offices,
+        'class10s': class10s,
+        'class15s': class15s,
+        'class20s': class20s,
+    }
+
+
+def make_forecast_json(area_code, report_time=None, sub_areas=3, seed=0):
+    #forecast/{area_code}.jsonと同じ形のダミーデータを作成
+    if report_time is None:
+        report_time = datetime(2026, 10, 18, 11, 0, tzinfo=JST)
+
+    def fmt(dt):
+        return dt.isoformat()
+
+    day0 = report_time.replace(hour=0, minute=0)
+    weather_times = [fmt(day0 + timedelta(days=d)) for d in range(3)]
+    pop_times = [fmt(day0 + timedelta(hours=h)) for h in range(12, 60, 6)]
+    temp_times = [
+        fmt(day0 + timedelta(days=d, hours=h))
+        for d in range(2) for h in (0, 9)
+    ]
+
+    base = int(area_code) + seed
+    weather_areas = []
+    pop_areas = []
+    temp_areas = []
+    for k in range(sub_areas):
+        weather_areas.append({
+            'area': {'name': f"{area_code}地方{k}", 'code': f"{area_code[:4]}{k + 1:02d}"},
+            'weatherCodes': ['100', '200', '300'],
+            'weathers': [WEATHERS[(base + k + d) % len(WEATHERS)] for d in range(3)],
+            'winds': ['北の風', '南の風　やや強く', '西の風'],
+            'waves': ['０．５メートル', '１メートル', '１．５メートル'],
+        })
+        pop_areas.append({
+            'area': {'name': f"{area_code}地方{k}", 'code': f"{area_code[:4]}{k + 1:02d}"},
+            'pops': [str((base + k * 10 + i * 10) % 100) for i in range(len(pop_times))],
+        })
+        temp_areas.append({
+            'area': {'name': f"観測点{k}", 'code': f"{base % 90000 + k:05d}"},
+            'temps': [str(10 + (base + k + i) % 15) for i in range(len(temp_times))],
+        })
+
+    return [
+        {
+            'publishingOffice': f"{area_code}気象台",
+            'reportDatetime': fmt(report_time),
+            'timeSeries': [
+                {'timeDefines': weather_times, 'areas': weather_areas},
+                {'timeDefines': pop_times, 'areas': pop_areas},
+                {'timeDefines': temp_times, 'areas': temp_areas},
+            ],
+        },
+        {
+            'publishingOffice': f"{area_code}気象台",
+            'reportDatetime': fmt(report_time),
+            'timeSeries': [
+                {
+                    'timeDefines': [fmt(day0 + timedelta(days=d)) for d in range(1, 8)],
+                    'areas': [{
+                        'area': {'name': f"{area_code}地方", 'code': area_code},
+                        'weatherCodes': ['101'] * 7,
+                        'pops': ['', '20', '30', '40', '30', '20', '10'],
+                        'reliabilities': ['', '', 'A', 'B', 'B', 'C', 'C'],
+                    }],
+                },
+            ],
+        },
+    ]
+
+
+class StubJmaHandler(BaseHTTPRequestHandler):
+    #keep-aliveを有効にするためHTTP/1.1で応答
+    protocol_version = 'HTTP/1.1'
+    # ヘッダーと本文を別々に送るため、Nagleによる遅延を避ける
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.count_request()
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        # 失敗を注入する場合は (ステータス, Retry-After) を順に返す
+        failure = server.next_failure()
+        if failure is not None:
+            status, retry_after = failure
+            self.send_response(status)
+            if retry_after is not None:
+                self.send_header('Retry-After', retry_after)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        path = self.path.split('?')[0]
+        if path == AREA_PATH:
+            body = server.area_body
+        elif path.startswith(FORECAST_PREFIX) and path.endswith('.json'):
+            area_code = path[len(FORECAST_PREFIX):-len('.json')]
+            body = server.forecast_body(area_code)
+        else:
+            body = None
+
+        if body is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        if self.headers.get('If-None-Match') == etag:
+            server.count_not_modified()
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', server.last_modified)
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StubJmaServer(ThreadingHTTPServer):
+    """area.json と forecast/{code}.json を返すローカルサーバー"""
+
+    daemon_threads = True
+
+    def __init__(self, latency=0.0, area_json=None, forecasts=None):
+        super().__init__(('127.0.0.1', 0), StubJmaHandler)
+        self.latency = latency
+        self.area_json = area_json or make_area_json()
+        self.area_body = json.dumps(self.area_json, ensure_ascii=False).encode('utf-8')
+        # 地域コード -> 予報JSON（未指定の地域はその場で作成）
+        self.forecasts = forecasts or {}
+        self.last_modified = 'Sun, 18 Oct 2026 02:00:00 GMT'
+        self.failures = deque()
+        self.request_count = 0
+        self.not_modified_count = 0
+        self.connection_count = 0
+        self._count_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count_request(self):
+        with self._count_lock:
+            self.request_count += 1
+
+    def next_failure(self):
+        with self._count_lock:
+            if self.failures:
+                return self.failures.popleft()
+        return None
+
+    def count_not_modified(self):
+        with self._count_lock:
+            self.not_modified_count += 1
+
+    def process_request(self, request, client_address):
+        with self._count_lock:
+            self.connection_count += 1
+        super().process_request(request, client_address)
+
+    def forecast_body(self, area_code):
+        forecast = self.forecasts.get(area_code)
+        if forecast is None:
+            if area_code not in self.area_json['offices']:
+                return None
+            forecast = make_forecast_json(area_code)
+            self.forecasts[area_code] = forecast
+        return json.dumps(forecast, ensure_ascii=False).encode('utf-8')
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def point_service_at(base_url):
+    """JmaApiService の接続先をスタブサーバーに切り替え、元のURLを返す"""
+    original = (JmaApiService.AREA_LIST_URL, JmaApiService.FORECAST_URL)
+    JmaApiService.AREA_LIST_URL = base_url + AREA_PATH
+    JmaApiService.FORECAST_URL = base_url + FORECAST_PREFIX + '{area_code}.json'
+    return original
+
+
+def restore_service(original):
+    """point_service_at で変更したURLを元に戻す"""
+    JmaApiService.AREA_LIST_URL, JmaApiService.FORECAST_URL = original
+
+
+if __name__ == "__main__":
+    with StubJmaServer() as stub:
+        print(f"スタブサーバー起動: {stub.base_url}")
+        print("停止するには Ctrl+C を押してください")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
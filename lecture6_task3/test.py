@@ -0,0 +1,2510 @@
+"""
+天気予報アプリケーションのテストスイート
+ローカルのスタブサーバーを使うため、ネットワークなしで実行できます
+"""
+
+import asyncio
+import contextlib
+import copy
+import io
+import pickle
+import itertools
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from datetime import date, datetime, timedelta
+
+import requests
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'weather-forecast-app'))
+
+import auto_update
+from jma_stub_server import (
+    StubJmaServer, make_area_json, make_forecast_json, point_service_at, restore_service,
+)
+from services import (
+    area_priority, db_connection, db_maintenance, db_migrations, jma_api, recorder, run_metrics, write_behind,
+)
+from services.area_cache import AreaCache
+from services.area_catalog import AreaCatalog
+from services.db_service import DatabaseService
+from services.forecast_cache import ForecastCache
+from services.forecast_model import ForecastBundle, parse_forecast
+from services.jma_api import JmaApiService, NOT_MODIFIED
+from services.publication import JST, next_publication, previous_publication
+from services.scheduler import UpdateScheduler
+from services.sharded_update import ShardedUpdatePipeline
+from services.rate_limit import (
+    DEFAULT_BURST, DEFAULT_RATE, RetryPolicy, TokenBucket, parse_retry_after,
+)
+from services.single_flight import SingleFlight
+from services.weather_archive import WeatherArchive
+from services.update_pipeline import UpdatePipeline
+from services.update_run import UpdateRun
+from services.weather_rollup import choose_resolution
+from services.write_behind import WriteBehindQueue
+
+
+# リポジトリに含まれる既存のDB（テストではコピーして使う）
+REPO_DB_PATH = auto_update.DEFAULT_DB_PATH
+
+
+@contextlib.contextmanager
+def quiet():
+    """サービスの進捗表示を抑制"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+class StubServerTestCase(unittest.TestCase):
+    """スタブサーバーに接続するテストの基底クラス"""
+
+    latency = 0.0
+
+    def setUp(self):
+        self.stub = StubJmaServer(latency=self.latency).start()
+        self.original_urls = point_service_at(self.stub.base_url)
+        jma_api.configure_session()
+
+        # テストではレート制限で待たず、再試行もすぐ行う
+        JmaApiService.configure_rate_limit(10000, 10000)
+        self.original_policy = JmaApiService.retry_policy
+        JmaApiService.retry_policy = RetryPolicy(base_delay=0.01)
+
+    def tearDown(self):
+        JmaApiService.retry_policy = self.original_policy
+        JmaApiService.configure_rate_limit(DEFAULT_RATE, DEFAULT_BURST)
+        restore_service(self.original_urls)
+        self.stub.stop()
+
+
+class TestJmaApiSession(StubServerTestCase):
+    """共有セッション（接続プール）のテストケース"""
+
+    def test_session_is_shared(self):
+        """get_session が同じセッションを返すかテスト"""
+        self.assertIs(jma_api.get_session(), jma_api.get_session())
+
+    def test_connection_reused(self):
+        """連続したリクエストで接続が再利用されるかテスト"""
+        with quiet():
+            areas = JmaApiService.get_area_list()
+            for code in list(areas['offices'])[:10]:
+                self.assertIsNotNone(JmaApiService.get_weather_forecast(code))
+
+        self.assertEqual(self.stub.request_count, 11)
+        self.assertEqual(self.stub.connection_count, 1)
+
+    def test_gzip_negotiated(self):
+        """gzip圧縮を要求しているかテスト"""
+        session = jma_api.get_session()
+        self.assertIn('gzip', session.headers['Accept-Encoding'])
+
+    def test_shared_across_threads(self):
+        """複数スレッドから同時に使えるかテスト"""
+        codes = list(self.stub.area_json['offices'])[:20]
+        results = {}
+
+        def worker(code):
+            results[code] = JmaApiService.get_weather_forecast(code)
+
+        with quiet():
+            threads = [threading.Thread(target=worker, args=(code,)) for code in codes]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertTrue(all(results[code] for code in codes))
+        # ホストごとの接続数はプールサイズを超えない
+        self.assertLessEqual(self.stub.connection_count, jma_api.DEFAULT_POOL_SIZE)
+
+    def test_not_found(self):
+        """存在しない地域コードでNoneが返るかテスト"""
+        with quiet():
+            self.assertIsNone(JmaApiService.get_weather_forecast("999999"))
+
+
+class TestBatchForecast(StubServerTestCase):
+    """複数地域の並行取得のテストケース"""
+
+    latency = 0.05
+
+    def test_get_weather_forecasts(self):
+        """全地域の結果が辞書で返り、失敗は例外になるかテスト"""
+        codes = list(self.stub.area_json['offices'])[:20] + ["999999"]
+
+        start = time.perf_counter()
+        results = JmaApiService.get_weather_forecasts(codes, concurrency=10)
+        elapsed = time.perf_counter() - start
+
+        self.assertEqual(set(results), set(codes))
+        self.assertIsInstance(results["999999"], Exception)
+        for code in codes[:-1]:
+            self.assertEqual(results[code][0]['timeSeries'][0]['areas'][0]['area']['code'][:4], code[:4])
+        # 21件 / 同時10件 = 3回分の待ち時間程度で終わる（逐次なら21回分）
+        self.assertLess(elapsed, 21 * self.latency)
+
+    def test_iter_weather_forecasts(self):
+        """非同期イテレータで取得できた順に返るかテスト"""
+        codes = list(self.stub.area_json['offices'])[:5]
+
+        async def collect():
+            received = []
+            async for code, result in JmaApiService.iter_weather_forecasts(codes, concurrency=2):
+                received.append((code, result))
+            return received
+
+        received = asyncio.run(collect())
+
+        self.assertEqual(sorted(code for code, _ in received), sorted(codes))
+        self.assertTrue(all(isinstance(result, list) for _, result in received))
+
+
+class TestConditionalGet(StubServerTestCase):
+    """ETag / Last-Modified による条件付きGETのテストケース"""
+
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, 'weather.db')
+        shutil.copy(REPO_DB_PATH, self.db_path)
+        self.db = DatabaseService(db_path=self.db_path)
+        with quiet():
+            self.db.init_database()
+
+    def tearDown(self):
+        super().tearDown()
+        db_connection.close_all()
+        shutil.rmtree(self.temp_dir)
+
+    def test_validators_returned(self):
+        """検証子は保存せずに info で返し、呼び出し側が保存するかテスト"""
+        code = list(self.stub.area_json['offices'])[0]
+        info = {}
+        with quiet():
+            JmaApiService.get_weather_forecast(code, validator_store=self.db, info=info)
+
+        # 予報を保存する前に検証子だけ残ると、次回は304になって予報が保存されない
+        self.assertIsNone(self.db.get_forecast_validators(code))
+        self.db.save_forecast_validators(code, *info['validators'])
+        etag, last_modified, content_length = self.db.get_forecast_validators(code)
+        self.assertTrue(etag.startswith('"'))
+        self.assertEqual(last_modified, self.stub.last_modified)
+        self.assertGreater(content_length, 0)
+
+    def test_not_modified(self):
+        """2回目の取得で304（NOT_MODIFIED）になるかテスト"""
+        code = list(self.stub.area_json['offices'])[0]
+        info = {}
+        with quiet():
+            first = JmaApiService.get_weather_forecast(code, validator_store=self.db, info=info)
+            self.db.save_forecast_validators(code, *info['validators'])
+            second = JmaApiService.get_weather_forecast(code, validator_store=self.db)
+
+        self.assertIsInstance(first, list)
+        self.assertIs(second, NOT_MODIFIED)
+        self.assertEqual(self.stub.not_modified_count, 1)
+
+    def test_without_store(self):
+        """検証子を渡さなければ毎回全件取得するかテスト"""
+        code = list(self.stub.area_json['offices'])[0]
+        with quiet():
+            JmaApiService.get_weather_forecast(code, validator_store=self.db)
+            self.assertIsInstance(JmaApiService.get_weather_forecast(code), list)
+
+    def test_update_all_areas_skips_unchanged(self):
+        """2回目の一括更新で変更のない地域の保存が省略されるかテスト"""
+        with quiet():
+            first = auto_update.update_all_areas(db_path=self.db_path, retention_days=0)
+            second = auto_update.update_all_areas(db_path=self.db_path, retention_days=0)
+
+        total = len(self.stub.area_json['offices'])
+        self.assertEqual(first['success'], total)
+        self.assertEqual(second['not_modified'], total)
+        self.assertEqual(second['success'], 0)
+        self.assertGreater(second['bytes_saved'], 0)
+
+
+    def test_update_all_areas_skips_identical_documents(self):
+        """304にならなくても、内容が同じ予報は書き込まないかテスト"""
+        with quiet():
+            auto_update.update_all_areas(db_path=self.db_path, retention_days=0)
+            # 検証子を消して全件を取り直す
+            with self.db.connections.write() as conn:
+                conn.execute("DELETE FROM forecast_validator")
+            second = auto_update.update_all_areas(db_path=self.db_path, retention_days=0)
+
+        total = len(self.stub.area_json['offices'])
+        self.assertEqual(second['success'], total)
+        self.assertEqual(second['unchanged'], total)
+        self.assertEqual(second['rows_written'], 0)
+        self.assertGreater(second['rows_unchanged'], 0)
+
+class TestAreaCache(StubServerTestCase):
+    """地域リストのディスクキャッシュのテストケース"""
+
+    def setUp(self):
+        super().setUp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = AreaCache(cache_dir=self.cache_dir)
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.cache_dir)
+
+    def test_cold_start_fetches_and_saves(self):
+        """キャッシュがなければ取得して保存するかテスト"""
+        areas = self.cache.get()
+
+        self.assertEqual(areas['offices'], self.stub.area_json['offices'])
+        self.assertTrue(self.cache.is_fresh())
+        self.assertEqual(self.stub.request_count, 1)
+
+    def test_offline_start(self):
+        """キャッシュがあればネットワークなしで読み込めるかテスト"""
+        self.cache.get()
+        # 接続できないURLに切り替えてオフラインを再現
+        point_service_at('http://127.0.0.1:9')
+
+        # TTL切れでも裏の再検証が失敗するだけで、キャッシュは返る
+        offline = AreaCache(cache_dir=self.cache_dir, ttl=0)
+        with quiet():
+            areas = offline.get()
+            offline.revalidate_in_background().join()
+
+        self.assertEqual(areas['offices'], self.stub.area_json['offices'])
+
+    def test_fresh_cache_skips_network(self):
+        """TTL以内ならリクエストしないかテスト"""
+        self.cache.get()
+        self.cache.get()
+        self.assertEqual(self.stub.request_count, 1)
+
+    def test_stale_cache_revalidates(self):
+        """TTL切れなら裏で条件付きGETするかテスト"""
+        self.cache.get()
+        stale = AreaCache(cache_dir=self.cache_dir, ttl=0)
+
+        updated = []
+        stale.get(on_updated=updated.append)
+        stale.revalidate_in_background().join()
+
+        self.assertEqual(self.stub.request_count, 2)
+        self.assertEqual(self.stub.not_modified_count, 1)
+        self.assertEqual(updated, [])
+
+    def test_old_version_ignored(self):
+        """形式の異なるキャッシュは使わないかテスト"""
+        self.cache.get()
+        with open(self.cache.meta_path, 'w') as f:
+            f.write('{"version": 0, "fetched_at": 0}')
+
+        self.assertIsNone(self.cache.load_meta())
+        self.cache.get()
+        self.assertEqual(self.stub.request_count, 2)
+
+
+class FakeClock:
+    """テスト用に進められる時計"""
+
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def wait_until(condition, timeout=2.0):
+    """条件を満たすまで待つ（裏のスレッドの完了待ち用）"""
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError("タイムアウトしました")
+        time.sleep(0.01)
+
+
+class TestForecastCache(unittest.TestCase):
+    """天気予報のメモリキャッシュのテストケース"""
+
+    def setUp(self):
+        # 10時に取得 -> 11時10分まで新鮮、12時10分まで古い値を返す
+        self.clock = FakeClock(datetime(2026, 10, 18, 10, 0, tzinfo=JST).timestamp())
+        self.cache = ForecastCache(stale_seconds=3600, clock=self.clock)
+        self.loads = 0
+
+    def loader(self):
+        self.loads += 1
+        return [{'load': self.loads}]
+
+    def test_publication_times(self):
+        """発表時刻（5時・11時・17時）の計算をテスト"""
+        now = datetime(2026, 10, 18, 18, 0, tzinfo=JST)
+        self.assertEqual(previous_publication(now), datetime(2026, 10, 18, 17, 0, tzinfo=JST))
+        self.assertEqual(next_publication(now), datetime(2026, 10, 19, 5, 0, tzinfo=JST))
+
+    def test_hit_until_next_publication(self):
+        """次の発表時刻までは再取得しないかテスト"""
+        self.cache.get('130000', self.loader)
+        self.clock.now += 60 * 60
+        value = self.cache.get('130000', self.loader)
+
+        self.assertEqual(value, [{'load': 1}])
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+    def test_fetched_just_after_publication(self):
+        """発表直後（発表の10分後まで）に取得した値は、その発表の10分後に鮮度切れになるかテスト"""
+        self.clock.now = datetime(2026, 10, 18, 11, 5, tzinfo=JST).timestamp()
+        self.cache.get('130000', self.loader)
+
+        self.clock.now = datetime(2026, 10, 18, 11, 9, tzinfo=JST).timestamp()
+        self.cache.get('130000', self.loader)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+        # 11時10分を過ぎたら17時10分まで待たずに取り直す
+        self.clock.now = datetime(2026, 10, 18, 11, 11, tzinfo=JST).timestamp()
+        self.cache.get('130000', self.loader)
+        self.assertEqual(self.cache.stats()['stale_hits'], 1)
+        wait_until(lambda: self.cache.stats()['refreshes'] == 1)
+
+        # 11時10分ちょうどに取得した値は17時10分まで新鮮
+        self.assertEqual(
+            self.cache._fresh_until(datetime(2026, 10, 18, 11, 10, tzinfo=JST).timestamp()),
+            datetime(2026, 10, 18, 17, 10, tzinfo=JST).timestamp(),
+        )
+
+    def test_stale_while_revalidate(self):
+        """鮮度切れ後は古い値を返しつつ裏で取り直すかテスト"""
+        self.cache.get('130000', self.loader)
+        self.clock.now += 80 * 60
+
+        self.assertEqual(self.cache.get('130000', self.loader), [{'load': 1}])
+        wait_until(lambda: self.cache.stats()['refreshes'] == 1)
+        self.assertEqual(self.cache.get('130000', self.loader), [{'load': 2}])
+        self.assertEqual(self.cache.stats()['stale_hits'], 1)
+
+    def test_expired(self):
+        """古い値を返す期間も過ぎたら取り直すかテスト"""
+        self.cache.get('130000', self.loader)
+        self.clock.now += 3 * 60 * 60
+
+        self.assertEqual(self.cache.get('130000', self.loader), [{'load': 2}])
+        self.assertEqual(self.cache.stats()['misses'], 2)
+
+    def test_lru_eviction(self):
+        """件数の上限を超えたら最も使われていないものを捨てるかテスト"""
+        cache = ForecastCache(max_entries=2, clock=self.clock)
+        cache.get('a', self.loader)
+        cache.get('b', self.loader)
+        cache.get('a', self.loader)
+        cache.get('c', self.loader)
+
+        self.assertEqual(cache.stats()['evictions'], 1)
+        cache.get('a', self.loader)
+        cache.get('b', self.loader)
+        self.assertEqual(self.loads, 4)
+
+    def test_memory_bound(self):
+        """合計サイズの上限を超えないかテスト"""
+        cache = ForecastCache(max_bytes=100, clock=self.clock)
+        for i in range(10):
+            cache.put(str(i), ['x' * 30])
+
+        self.assertLessEqual(cache.stats()['bytes'], 100)
+        self.assertGreater(cache.stats()['evictions'], 0)
+
+    def test_loader_error_not_cached(self):
+        """取得に失敗した場合はキャッシュしないかテスト"""
+        def failing():
+            raise ValueError("失敗")
+
+        with self.assertRaises(ValueError):
+            self.cache.get('130000', failing)
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+
+class TestCachedForecast(StubServerTestCase):
+    """JmaApiService のキャッシュ経由の取得のテストケース"""
+
+    def setUp(self):
+        super().setUp()
+        JmaApiService.forecast_cache.invalidate()
+
+    def tearDown(self):
+        JmaApiService.forecast_cache.invalidate()
+        super().tearDown()
+
+    def test_second_call_served_from_cache(self):
+        """同じ地域の2回目は通信しないかテスト"""
+        code = list(self.stub.area_json['offices'])[0]
+        first = JmaApiService.get_cached_weather_forecast(code)
+        second = JmaApiService.get_cached_weather_forecast(code)
+
+        self.assertEqual(first, second)
+        self.assertEqual(self.stub.request_count, 1)
+
+    def test_error_returns_none(self):
+        """取得に失敗したらNoneを返すかテスト"""
+        with quiet():
+            self.assertIsNone(JmaApiService.get_cached_weather_forecast("999999"))
+
+    def test_refresh_bypasses_cache(self):
+        """更新ボタン（refresh）ではキャッシュを使わずに取得し直すかテスト"""
+        code = list(self.stub.area_json['offices'])[0]
+        JmaApiService.get_cached_weather_forecast(code)
+        self.stub.forecasts[code] = make_forecast_json(code, seed=1)
+
+        refreshed = JmaApiService.get_cached_weather_forecast(code, refresh=True)
+        self.assertEqual(refreshed, self.stub.forecasts[code])
+        self.assertEqual(self.stub.request_count, 2)
+        # 取り直した値をキャッシュに入れる
+        self.assertEqual(JmaApiService.get_cached_weather_forecast(code), refreshed)
+        self.assertEqual(self.stub.request_count, 2)
+
+
+class TestForecastModel(unittest.TestCase):
+    """天気予報JSONの解析（ForecastBundle）のテストケース"""
+
+    def setUp(self):
+        self.weather_json = make_forecast_json("130000")
+        self.forecast = parse_forecast(self.weather_json)
+
+    def test_parse(self):
+        """各項目が解析されるかテスト"""
+        first = self.weather_json[0]
+        self.assertEqual(self.forecast.publishing_office, first['publishingOffice'])
+        self.assertEqual(self.forecast.report_datetime, first['reportDatetime'])
+        self.assertEqual(len(self.forecast.areas), 3)
+        self.assertEqual(self.forecast.area_name, first['timeSeries'][0]['areas'][0]['area']['name'])
+        self.assertEqual(
+            list(self.forecast.areas[1].weathers),
+            first['timeSeries'][0]['areas'][1]['weathers'],
+        )
+        self.assertEqual(self.forecast.pop_at(0, 0), int(first['timeSeries'][1]['areas'][0]['pops'][0]))
+        self.assertIsNone(self.forecast.pop_at(0, 100))
+
+    def test_empty_values(self):
+        """空欄の降水確率・気温がNoneになるかテスト"""
+        self.weather_json[0]['timeSeries'][1]['areas'][0]['pops'][0] = ''
+        self.weather_json[0]['timeSeries'][2]['areas'][0]['temps'][0] = ''
+        forecast = parse_forecast(self.weather_json)
+
+        self.assertIsNone(forecast.pop_at(0, 0))
+        self.assertIsNone(forecast.temp_at(0, 0))
+        self.assertIsNone(forecast.temp_pairs()[0][0])
+
+    def test_rows(self):
+        """DBに保存する行が時刻・日付で結び付くかテスト"""
+        temps = [float(t) for t in self.weather_json[0]['timeSeries'][2]['areas'][0]['temps']]
+        rows = self.forecast.rows()
+
+        self.assertEqual(len(rows), 3)
+        time_define, min_temp, max_temp, wind, wave, rain_proba, weather = rows[0]
+        self.assertEqual(time_define, self.forecast.time_defines[0])
+        self.assertEqual((min_temp, max_temp), (min(temps[:2]), max(temps[:2])))
+        self.assertEqual(weather, self.forecast.areas[0].weathers[0])
+        # 3日目は気温予報がない
+        self.assertEqual(rows[2][1:3], (None, None))
+
+    def test_store_bundle(self):
+        """ForecastBundle をそのままDBに保存できるかテスト"""
+        temp_dir = tempfile.mkdtemp()
+        try:
+            db_path = os.path.join(temp_dir, 'weather.db')
+            shutil.copy(REPO_DB_PATH, db_path)
+            db = DatabaseService(db_path=db_path)
+            with quiet():
+                db.init_database()
+
+            area_db_id = db.insert_area("テスト地域", "999990")
+            self.assertIsInstance(self.forecast, ForecastBundle)
+            self.assertEqual(db.insert_or_update_weather_data(area_db_id, self.forecast), 3)
+            # 同じ内容のJSONを渡しても書き込まない
+            self.assertEqual(db.insert_or_update_weather_data(area_db_id, self.weather_json), 0)
+
+            history = db.get_weather_history(area_id="999990")
+            self.assertEqual(len(history), 3)
+        finally:
+            db_connection.close_all()
+            shutil.rmtree(temp_dir)
+
+
+class TestAreaCatalog(unittest.TestCase):
+    """地域カタログ（階層ごとの遅延解析）のテストケース"""
+
+    def setUp(self):
+        self.area_json = make_area_json()
+        self.catalog = AreaCatalog(json.dumps(self.area_json, ensure_ascii=False, indent=2).encode('utf-8'))
+
+    def test_decodes_only_requested_sections(self):
+        """要求した階層（と親）だけを解析するかテスト"""
+        offices = self.catalog.section('offices')
+
+        self.assertEqual(self.catalog.loaded_sections(), ('centers', 'offices'))
+        self.assertEqual(list(offices.codes), list(self.area_json['offices']))
+        self.assertEqual(
+            list(offices.names),
+            [info['name'] for info in self.area_json['offices'].values()],
+        )
+
+    def test_parent_and_children(self):
+        """親子関係が元の area.json と一致するかテスト"""
+        for center_code, center_info in self.area_json['centers'].items():
+            children = [code for code, _ in self.catalog.children('centers', center_code)]
+            self.assertEqual(children, center_info['children'])
+
+        class10s = self.catalog.section('class10s')
+        offices = self.catalog.section('offices')
+        for i, code in enumerate(class10s.codes):
+            parent_code = self.area_json['class10s'][code]['parent']
+            self.assertEqual(offices.codes[class10s.parents[i]], parent_code)
+
+    def test_name_of(self):
+        """地域コードから名前を引けるかテスト"""
+        offices = self.catalog.section('offices')
+        code = list(self.area_json['offices'])[3]
+
+        self.assertEqual(offices.name_of(code), self.area_json['offices'][code]['name'])
+        self.assertIsNone(offices.name_of("000000"))
+        self.assertIn(code, offices)
+
+    def test_unknown_section(self):
+        """存在しない階層を指定するとKeyErrorになるかテスト"""
+        with self.assertRaises(KeyError):
+            self.catalog.section('prefectures')
+
+
+class TestSingleFlight(unittest.TestCase):
+    """同時リクエストのまとめ（single-flight）のテストケース"""
+
+    def run_concurrently(self, flight, key, func, count):
+        results = []
+        errors = []
+
+        def worker():
+            try:
+                results.append(flight.do(key, func))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, errors
+
+    def test_concurrent_calls_share_result(self):
+        """同時の呼び出しが1回の実行にまとまるかテスト"""
+        flight = SingleFlight()
+        calls = []
+
+        def slow():
+            calls.append(1)
+            time.sleep(0.1)
+            return {'value': 1}
+
+        results, errors = self.run_concurrently(flight, 'a', slow, 10)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(errors, [])
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertEqual(flight.stats(), {'executed': 1, 'coalesced': 9, 'in_flight': 0})
+
+    def test_error_shared(self):
+        """例外も全員に伝わるかテスト"""
+        flight = SingleFlight()
+
+        def failing():
+            time.sleep(0.1)
+            raise ValueError("失敗")
+
+        results, errors = self.run_concurrently(flight, 'a', failing, 5)
+
+        self.assertEqual(results, [])
+        self.assertEqual(len(errors), 5)
+        self.assertTrue(all(isinstance(e, ValueError) for e in errors))
+
+    def test_sequential_calls_not_coalesced(self):
+        """完了後の呼び出しは新たに実行するかテスト"""
+        flight = SingleFlight()
+        flight.do('a', lambda: 1)
+        flight.do('a', lambda: 2)
+        self.assertEqual(flight.stats()['executed'], 2)
+
+    def test_do_async(self):
+        """asyncioからの同時呼び出しもまとまるかテスト"""
+        flight = SingleFlight()
+
+        def slow():
+            time.sleep(0.1)
+            return 42
+
+        async def main():
+            return await asyncio.gather(*(flight.do_async('a', slow) for _ in range(5)))
+
+        self.assertEqual(asyncio.run(main()), [42] * 5)
+        self.assertEqual(flight.stats()['executed'], 1)
+
+
+class TestForecastCoalescing(StubServerTestCase):
+    """JmaApiService の同時リクエストのまとめのテストケース"""
+
+    latency = 0.1
+
+    def test_same_area_fetched_once(self):
+        """同じ地域を同時に要求しても通信は1回かテスト"""
+        code = list(self.stub.area_json['offices'])[0]
+        before = JmaApiService.forecast_flight.stats()['coalesced']
+        results = []
+
+        def worker():
+            results.append(JmaApiService._fetch_forecast(code))
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(results), 8)
+        self.assertEqual(self.stub.request_count, 1)
+        self.assertEqual(JmaApiService.forecast_flight.stats()['coalesced'] - before, 7)
+
+
+    def test_coalesced_calls_get_info(self):
+        """相乗りした呼び出しにも、共有した取得の状態コード・転送量が入るかテスト"""
+        code = list(self.stub.area_json['offices'])[0]
+        infos = [{} for _ in range(4)]
+
+        def worker(info):
+            JmaApiService._fetch_forecast(code, None, info)
+
+        threads = [threading.Thread(target=worker, args=(info,)) for info in infos]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.stub.request_count, 1)
+        self.assertEqual([info['status_code'] for info in infos], [200] * 4)
+        self.assertEqual(len({info['bytes'] for info in infos}), 1)
+        self.assertGreater(infos[0]['bytes'], 0)
+        self.assertEqual(sorted(info['coalesced'] for info in infos), [False, True, True, True])
+
+class TestRateLimit(unittest.TestCase):
+    """レート制限（トークンバケット）と再試行の方針のテストケース"""
+
+    def setUp(self):
+        self.clock = FakeClock(0.0)
+        self.slept = []
+
+        def sleep(seconds):
+            self.slept.append(seconds)
+            self.clock.now += seconds
+
+        self.bucket = TokenBucket(rate=2, burst=3, clock=self.clock, sleep=sleep)
+
+    def test_burst_then_rate(self):
+        """バースト分はすぐ通り、その後はレートに従って待つかテスト"""
+        for _ in range(3):
+            self.bucket.acquire()
+        self.assertEqual(self.slept, [])
+
+        self.bucket.acquire()
+        self.assertAlmostEqual(self.slept[-1], 0.5)
+
+    def test_refill(self):
+        """時間が経てばトークンが補充されるかテスト"""
+        for _ in range(3):
+            self.bucket.acquire()
+        self.clock.now += 10
+        for _ in range(3):
+            self.bucket.acquire()
+        self.assertEqual(self.slept, [])
+
+    def test_pause(self):
+        """pause の間は待たされるかテスト"""
+        self.bucket.pause(5)
+        self.bucket.acquire()
+        self.assertAlmostEqual(self.slept[-1], 5)
+
+    def test_invalid_config(self):
+        """不正な設定はValueErrorになるかテスト"""
+        with self.assertRaises(ValueError):
+            TokenBucket(rate=0, burst=1)
+
+    def test_backoff_with_jitter(self):
+        """待ち時間が指数的な上限の範囲に収まるかテスト"""
+        policy = RetryPolicy(base_delay=0.5, max_delay=4, random_func=lambda: 1.0)
+        self.assertEqual([policy.delay(i) for i in range(5)], [0.5, 1.0, 2.0, 4, 4])
+
+        policy = RetryPolicy(base_delay=0.5, random_func=lambda: 0.0)
+        self.assertEqual(policy.delay(3), 0.0)
+        self.assertEqual(policy.delay(0, retry_after=7), 7)
+        # 長すぎる Retry-After でも max_delay より長くは待たない
+        self.assertEqual(policy.delay(0, retry_after=7200), 30.0)
+        self.assertFalse(policy.accepts_retry_after(7200))
+
+    def test_parse_retry_after(self):
+        """Retry-After の秒数とHTTP日付を解釈できるかテスト"""
+        self.assertEqual(parse_retry_after('120'), 120)
+        now = datetime(2026, 10, 18, 0, 0, 0, tzinfo=JST).astimezone()
+        self.assertAlmostEqual(
+            parse_retry_after('Sat, 17 Oct 2026 15:00:30 GMT', now=now), 30
+        )
+        self.assertIsNone(parse_retry_after('soon'))
+        self.assertIsNone(parse_retry_after(None))
+
+
+class TestRetry(StubServerTestCase):
+    """JmaApiService の再試行のテストケース"""
+
+    def test_retry_on_5xx_and_429(self):
+        """5xx・429のあと再試行して成功するかテスト"""
+        self.stub.failures.extend([(503, None), (429, '0')])
+        code = list(self.stub.area_json['offices'])[0]
+
+        with quiet():
+            result = JmaApiService.get_weather_forecast(code)
+
+        self.assertIsInstance(result, list)
+        self.assertEqual(self.stub.request_count, 3)
+        self.assertEqual(JmaApiService.retry_policy.retries, 2)
+
+    def test_retry_after_honoured(self):
+        """Retry-After で指定された時間は再送しないかテスト"""
+        self.stub.failures.append((503, '1'))
+        code = list(self.stub.area_json['offices'])[0]
+
+        start = time.perf_counter()
+        with quiet():
+            JmaApiService.get_weather_forecast(code)
+        self.assertGreaterEqual(time.perf_counter() - start, 1.0)
+
+    def test_long_retry_after_not_waited(self):
+        """max_delay より長い Retry-After（HTTP日付）は待たずに失敗を返すかテスト"""
+        self.stub.failures.append((429, 'Thu, 01 Jan 2099 00:00:00 GMT'))
+        code = list(self.stub.area_json['offices'])[0]
+
+        start = time.perf_counter()
+        with self.assertRaises(requests.exceptions.HTTPError):
+            JmaApiService._fetch_forecast(code)
+        self.assertLess(time.perf_counter() - start, 1.0)
+        self.assertEqual(self.stub.request_count, 1)
+        # 他のリクエストも止めない
+        self.assertIsInstance(JmaApiService._fetch_forecast(code), list)
+
+    def test_gives_up(self):
+        """再試行の上限を超えたら失敗を返すかテスト"""
+        self.stub.failures.extend([(500, None)] * 10)
+        code = list(self.stub.area_json['offices'])[0]
+
+        with quiet():
+            self.assertIsNone(JmaApiService.get_weather_forecast(code))
+        self.assertEqual(self.stub.request_count, JmaApiService.retry_policy.max_retries + 1)
+
+    def test_not_found_not_retried(self):
+        """404は再試行しないかテスト"""
+        with quiet():
+            JmaApiService.get_weather_forecast("999999")
+        self.assertEqual(self.stub.request_count, 1)
+
+
+class TestRecordReplay(StubServerTestCase):
+    """フィクスチャの記録・再生モードのテストケース"""
+
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = tempfile.mkdtemp()
+        self.fixture_dir = os.path.join(self.temp_dir, 'fixtures')
+        self.codes = list(self.stub.area_json['offices'])
+
+    def tearDown(self):
+        recorder.disable()
+        super().tearDown()
+        db_connection.close_all()
+        shutil.rmtree(self.temp_dir)
+
+    def record(self):
+        adapter = recorder.enable_recording(self.fixture_dir)
+        with quiet():
+            JmaApiService.get_area_list()
+            for code in self.codes:
+                JmaApiService.get_weather_forecast(code)
+        return adapter
+
+    def test_record(self):
+        """area.json と forecast/{code}.json がヘッダー付きで保存されるかテスト"""
+        adapter = self.record()
+
+        names = recorder.FixtureStore(self.fixture_dir).names()
+        self.assertEqual(names, sorted(['area.json'] + [f"forecast/{code}.json" for code in self.codes]))
+        self.assertEqual(adapter.recorded, len(names))
+
+        with open(os.path.join(self.fixture_dir, 'forecast', f"{self.codes[0]}.json.headers.json")) as f:
+            meta = json.load(f)
+        self.assertEqual(meta['status'], 200)
+        self.assertIn('ETag', meta['headers'])
+
+    def test_replay_without_network(self):
+        """再生モードでは通信せず、記録と同じ内容を返すかテスト"""
+        with quiet():
+            expected = JmaApiService.get_weather_forecast(self.codes[0])
+        self.record()
+        request_count = self.stub.request_count
+
+        adapter = recorder.enable_replay(self.fixture_dir)
+        with quiet():
+            area_list = JmaApiService.get_area_list()
+            forecast = JmaApiService.get_weather_forecast(self.codes[0])
+
+        self.assertEqual(self.stub.request_count, request_count)
+        self.assertEqual(forecast, expected)
+        self.assertEqual(set(area_list['offices']), set(self.codes))
+        self.assertEqual(adapter.stats()['requests'], 2)
+
+    def test_replay_conditional_get(self):
+        """再生モードでも検証子が一致すれば304になるかテスト"""
+        self.record()
+        recorder.enable_replay(self.fixture_dir)
+
+        db_path = os.path.join(self.temp_dir, 'weather.db')
+        shutil.copy(REPO_DB_PATH, db_path)
+        with quiet():
+            first = auto_update.update_all_areas(db_path=db_path, retention_days=0)
+            second = auto_update.update_all_areas(db_path=db_path, retention_days=0)
+
+        self.assertEqual(first['success'], len(self.codes))
+        self.assertEqual(second['not_modified'], len(self.codes))
+
+    def test_injected_failures(self):
+        """失敗率1では再試行の後に失敗し、記録のない地域は404になるかテスト"""
+        self.record()
+
+        adapter = recorder.enable_replay(self.fixture_dir, failure_rate=1.0, seed=0)
+        with quiet():
+            self.assertIsNone(JmaApiService.get_weather_forecast(self.codes[0]))
+        self.assertEqual(adapter.stats()['failures'], JmaApiService.retry_policy.max_retries + 1)
+
+        adapter = recorder.enable_replay(self.fixture_dir, timeout_rate=1.0, seed=0)
+        with quiet():
+            self.assertIsNone(JmaApiService.get_weather_forecast(self.codes[0]))
+        self.assertEqual(adapter.stats()['failures'], JmaApiService.retry_policy.max_retries + 1)
+
+        adapter = recorder.enable_replay(self.fixture_dir)
+        with quiet():
+            self.assertIsNone(JmaApiService.get_weather_forecast('999999'))
+        self.assertEqual(adapter.stats()['missing'], 1)
+
+    def test_injected_latency(self):
+        """遅延とseedが再生に反映されるかテスト"""
+        self.record()
+        delays = []
+        for _ in range(2):
+            adapter = recorder.ReplayAdapter(self.fixture_dir, latency=0.1, jitter=0.05, seed=1, sleep=delays.append)
+            recorder.configure_session(adapter=adapter)
+            with quiet():
+                JmaApiService.get_weather_forecast(self.codes[0])
+
+        self.assertEqual(len(delays), 2)
+        self.assertEqual(delays[0], delays[1])
+        self.assertTrue(0.1 <= delays[0] <= 0.15)
+
+
+class TestConnectionManager(unittest.TestCase):
+    """DB接続の管理（WAL・書き込み1本・スレッドごとの読み込み）のテストケース"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, 'weather.db')
+        shutil.copy(REPO_DB_PATH, self.db_path)
+        self.db = DatabaseService(db_path=self.db_path)
+        with quiet():
+            self.db.init_database()
+        self.area_db_id = self.db.insert_area("テスト地域", "999990")
+        self.forecast = parse_forecast(make_forecast_json("999990"))
+
+    def tearDown(self):
+        db_connection.close_all()
+        shutil.rmtree(self.temp_dir)
+
+    def test_pragmas(self):
+        """WAL・synchronous・busy_timeout・mmap_size が設定されるかテスト"""
+        with self.db.connections.write() as conn:
+            self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], 'wal')
+            self.assertEqual(conn.execute("PRAGMA synchronous").fetchone()[0], 1)
+            self.assertEqual(conn.execute("PRAGMA busy_timeout").fetchone()[0], db_connection.DEFAULT_BUSY_TIMEOUT)
+            self.assertEqual(conn.execute("PRAGMA mmap_size").fetchone()[0], db_connection.DEFAULT_MMAP_SIZE)
+
+    def test_shared_between_services(self):
+        """同じDBファイルのサービスは接続を共有するかテスト"""
+        other = DatabaseService(db_path=self.db_path)
+        self.assertIs(other.connections, self.db.connections)
+
+    def test_read_during_write(self):
+        """書き込みのトランザクション中でも他のスレッドから待たずに読めるかテスト"""
+        results = []
+
+        def read():
+            start = time.perf_counter()
+            results.append((len(self.db.get_weather_history(area_id="999990")), time.perf_counter() - start))
+
+        with self.db.connections.write() as conn:
+            conn.execute(
+                "INSERT INTO weather_info (time, weather, area_id) VALUES (?, ?, ?)",
+                ('2024-01-01T00:00:00+09:00', '晴れ', self.area_db_id),
+            )
+            thread = threading.Thread(target=read)
+            thread.start()
+            thread.join()
+
+        # コミット前の行は見えず、ロック待ちもしない
+        count, elapsed = results[0]
+        self.assertEqual(count, 0)
+        self.assertLess(elapsed, 1.0)
+        self.assertEqual(len(self.db.get_weather_history(area_id="999990")), 1)
+
+    def test_concurrent_writers(self):
+        """複数スレッドからの書き込みが "database is locked" にならないかテスト"""
+        errors = []
+
+        def write(i):
+            with contextlib.redirect_stdout(io.StringIO()) as out:
+                area_db_id = self.db.insert_area(f"地域{i}", f"99{i:04d}")
+                saved = self.db.insert_or_update_weather_data(area_db_id, self.forecast)
+                self.db.get_weather_history(area_id=f"99{i:04d}")
+            if saved != 3 or out.getvalue():
+                errors.append((i, saved, out.getvalue()))
+
+        threads = [threading.Thread(target=write, args=(i,)) for i in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertLessEqual(self.db.connections.reader_count(), len(threads) + 1)
+
+    def test_rollback_on_error(self):
+        """ブロック内で例外が起きたらロールバックされるかテスト"""
+        with self.assertRaises(RuntimeError):
+            with self.db.connections.write() as conn:
+                conn.execute(
+                    "INSERT INTO weather_info (time, weather, area_id) VALUES (?, ?, ?)",
+                    ('2024-01-01T00:00:00+09:00', '晴れ', self.area_db_id),
+                )
+                raise RuntimeError
+        self.assertEqual(self.db.get_weather_history(area_id="999990"), [])
+
+    def test_close_and_reopen(self):
+        """close() 後も次の操作で開き直すかテスト"""
+        self.db.insert_or_update_weather_data(self.area_db_id, self.forecast)
+        self.db.close()
+        self.assertEqual(self.db.connections.reader_count(), 0)
+        self.assertEqual(len(self.db.get_weather_history(area_id="999990")), 3)
+
+
+class TestWeatherUpsert(unittest.TestCase):
+    """天気情報のまとめての保存（upsert）のテストケース"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, 'weather.db')
+        shutil.copy(REPO_DB_PATH, self.db_path)
+        self.db = DatabaseService(db_path=self.db_path)
+        with quiet():
+            self.db.init_database()
+        self.forecasts = [parse_forecast(make_forecast_json(f"99{i:04d}", seed=i)) for i in range(3)]
+        self.area_ids = [self.db.insert_area(f"地域{i}", f"99{i:04d}") for i in range(3)]
+
+    def tearDown(self):
+        db_connection.close_all()
+        shutil.rmtree(self.temp_dir)
+
+    def count_rows(self, area_db_id):
+        with self.db.connections.read() as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM weather_info WHERE area_id = ?", (area_db_id,)
+            ).fetchone()[0]
+
+    def test_inserted_and_updated_counts(self):
+        """挿入件数と更新件数が返るかテスト"""
+        batch = list(zip(self.area_ids, self.forecasts))
+        self.assertEqual(self.db.upsert_weather_data(batch), (9, 0, 0))
+        # 前回と同じ予報は書き込まない
+        self.assertEqual(self.db.upsert_weather_data(batch), (0, 0, 9))
+        self.assertEqual(self.db.upsert_weather_data(batch[:1] + batch[:1]), (0, 0, 6))
+        for area_db_id in self.area_ids:
+            self.assertEqual(self.count_rows(area_db_id), 3)
+
+    def test_updates_values(self):
+        """同じ地域・時刻の行が新しい値で上書きされるかテスト"""
+        self.db.insert_or_update_weather_data(self.area_ids[0], self.forecasts[0])
+        newer = parse_forecast(make_forecast_json("990000", seed=99))
+        self.assertEqual(self.db.insert_or_update_weather_data(self.area_ids[0], newer), 3)
+
+        history = self.db.get_weather_history(area_id="990000")
+        self.assertEqual(
+            sorted(row[3] for row in history),
+            sorted(row[6] for row in newer.rows()),
+        )
+
+    def test_duplicates_removed_before_unique_index(self):
+        """既存DBの重複行は最後の行だけ残して一意インデックスを作るかテスト"""
+        with self.db.connections.write() as conn:
+            # v3（一意インデックス）より前のDBに戻す
+            conn.execute("DROP INDEX IF EXISTS idx_weather_info_area_time")
+            conn.execute("PRAGMA user_version = 2")
+            for weather in ('晴れ', '雨'):
+                conn.execute(
+                    "INSERT INTO weather_info (time, weather, area_id) VALUES (?, ?, ?)",
+                    ('2024-01-01T00:00:00+09:00', weather, self.area_ids[0]),
+                )
+
+        with quiet():
+            DatabaseService(db_path=self.db_path).init_database()
+
+        history = self.db.get_weather_history(area_id="990000")
+        self.assertEqual([row[3] for row in history], ['雨'])
+
+    def test_batch_is_atomic(self):
+        """バッチの途中で失敗したら何も保存しないかテスト"""
+        batch = [(self.area_ids[0], self.forecasts[0]), (None, self.forecasts[1])]
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.db.upsert_weather_data(batch)
+        self.assertEqual(self.count_rows(self.area_ids[0]), 0)
+
+
+class TestForecastFingerprint(unittest.TestCase):
+    """同じ内容の予報の保存を省略するテストケース"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db = DatabaseService(db_path=os.path.join(self.temp_dir, 'weather.db'))
+        self.area_db_id = self.db.insert_area("テスト地域", "990000")
+        self.weather_json = make_forecast_json("990000")
+        self.assertEqual(self.db.upsert_weather_data([(self.area_db_id, self.weather_json)]), (3, 0, 0))
+
+    def tearDown(self):
+        db_connection.close_all()
+        shutil.rmtree(self.temp_dir)
+
+    def changes(self, forecast):
+        #保存結果と、書き込んだ行数（SQLiteの変更数）
+        with self.db.connections.write() as conn:
+            before = conn.total_changes
+        result = self.db.upsert_weather_data([(self.area_db_id, forecast)])
+        with self.db.connections.write() as conn:
+            return result, conn.total_changes - before
+
+    def fingerprint(self):
+        with self.db.connections.read() as conn:
+            return conn.execute(
+                "SELECT report_datetime, content_hash FROM forecast_fingerprint WHERE area_id = ?",
+                (self.area_db_id,),
+            ).fetchone()
+
+    def test_identical_document_skipped(self):
+        """reportDatetime も内容も同じ予報は何も書き込まないかテスト"""
+        self.assertEqual(self.changes(copy.deepcopy(self.weather_json)), ((0, 0, 3), 0))
+
+    def test_new_report_same_values(self):
+        """発表時刻だけ変わった予報は指紋だけ更新するかテスト"""
+        report_time = datetime(2026, 10, 18, 17, 0, tzinfo=JST)
+        newer = make_forecast_json("990000", report_time=report_time)
+        self.assertEqual(self.changes(newer), ((0, 0, 3), 1))
+        self.assertEqual(self.fingerprint()[0], report_time.isoformat())
+
+    def test_only_changed_rows_written(self):
+        """値が変わった行だけを更新するかテスト"""
+        changed = copy.deepcopy(self.weather_json)
+        changed[0]['timeSeries'][0]['areas'][0]['weathers'][1] = '雪'
+        before = self.fingerprint()
+
+        # 変更した1行と指紋の1行、変更した行の日の日別と月の月別の集計
+        self.assertEqual(self.changes(changed), ((0, 1, 2), 4))
+        self.assertNotEqual(self.fingerprint(), before)
+        self.assertIn('雪', [row[3] for row in self.db.get_weather_history(area_id="990000")])
+
+    def test_failed_write_keeps_old_fingerprint(self):
+        """保存に失敗したら指紋も更新しない（次回は書き込む）かテスト"""
+        changed = copy.deepcopy(self.weather_json)
+        changed[0]['timeSeries'][0]['areas'][0]['weathers'][1] = '雪'
+        before = self.fingerprint()
+
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.db.upsert_weather_data([(self.area_db_id, changed), (None, self.weather_json)])
+        self.assertEqual(self.fingerprint(), before)
+        self.assertEqual(self.db.upsert_weather_data([(self.area_db_id, changed)]), (0, 1, 2))
+
+
+class TestWeatherRollup(unittest.TestCase):
+    """日別・月別の集計表のテストケース"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, 'weather.db')
+        self.db = DatabaseService(db_path=self.db_path)
+        self.area_db_id = self.db.insert_area("テスト地域", "990000")
+
+    def tearDown(self):
+        db_connection.close_all()
+        shutil.rmtree(self.temp_dir)
+
+    def save_days(self, first, days):
+        #first から days 日分、毎日発表された予報を保存する（各予報は3日分）
+        for d in range(days):
+            report_time = datetime(first.year, first.month, first.day, 11, 0, tzinfo=JST) + timedelta(days=d)
+            self.db.upsert_weather_data([(self.area_db_id, make_forecast_json("990000", report_time=report_time, seed=d))])
+
+    def test_daily_matches_raw_rows(self):
+        """日別の集計が元の行と一致するかテスト"""
+        self.save_days(datetime(2026, 10, 1), 10)
+        _, raw = self.db.get_weather_series("990000", "2026-10-01", "2026-10-12", resolution='raw')
+        _, daily = self.db.get_weather_series("990000", "2026-10-01", "2026-10-12", resolution='daily')
+
+        # 同じ地域・時刻は1行なので、1日1行（最後の予報の値）
+        self.assertEqual(len(raw), 12)
+        self.assertEqual(
+            daily,
+            [(time[:10], weather, low, high, pop, float(pop) if pop is not None else None)
+             for time, weather, low, high, pop, _ in raw],
+        )
+
+    def test_monthly_aggregates_days(self):
+        """月別の集計が日別の最小・最大・平均になるかテスト"""
+        self.save_days(datetime(2026, 9, 25), 10)
+        _, daily = self.db.get_weather_series("990000", "2026-09-01", "2026-10-31", resolution='daily')
+        _, monthly = self.db.get_weather_series("990000", "2026-09-01", "2026-10-31", resolution='monthly')
+
+        self.assertEqual([row[0] for row in monthly], ['2026-09', '2026-10'])
+        for month, weather, low, high, pop_max, pop_mean in monthly:
+            days = [row for row in daily if row[0].startswith(month)]
+            lows = [row[2] for row in days if row[2] is not None]
+            highs = [row[3] for row in days if row[3] is not None]
+            pops = [row[4] for row in days if row[4] is not None]
+            self.assertEqual(low, min(lows) if lows else None)
+            self.assertEqual(high, max(highs) if highs else None)
+            self.assertEqual(pop_max, max(pops) if pops else None)
+            if pops:
+                self.assertAlmostEqual(pop_mean, sum(pops) / len(pops))
+            else:
+                self.assertIsNone(pop_mean)
+            self.assertIn(weather, [row[1] for row in days])
+
+    def test_update_refreshes_rollup(self):
+        """予報が更新されたら同じトランザクションで集計も更新されるかテスト"""
+        weather_json = make_forecast_json("990000")
+        self.db.upsert_weather_data([(self.area_db_id, weather_json)])
+
+        changed = copy.deepcopy(weather_json)
+        changed[0]['timeSeries'][0]['areas'][0]['weathers'][1] = '雪'
+        self.assertEqual(self.db.upsert_weather_data([(self.area_db_id, changed)]), (0, 1, 2))
+
+        _, daily = self.db.get_weather_series("990000", "2026-10-18", "2026-10-20", resolution='daily')
+        self.assertEqual(daily[1][:2], ('2026-10-19', '雪'))
+        _, monthly = self.db.get_weather_series("990000", "2026-10-01", "2026-10-31", resolution='monthly')
+        self.assertEqual(len(monthly), 1)
+
+    def test_failed_write_keeps_rollup(self):
+        """保存に失敗したら集計も元のままかテスト"""
+        weather_json = make_forecast_json("990000")
+        self.db.upsert_weather_data([(self.area_db_id, weather_json)])
+        _, before = self.db.get_weather_series("990000", "2026-10-18", "2026-10-20", resolution='daily')
+
+        changed = copy.deepcopy(weather_json)
+        changed[0]['timeSeries'][0]['areas'][0]['weathers'][1] = '雪'
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.db.upsert_weather_data([(self.area_db_id, changed), (None, weather_json)])
+        self.assertEqual(self.db.get_weather_series("990000", "2026-10-18", "2026-10-20", resolution='daily')[1], before)
+
+    def test_resolution_from_span(self):
+        """期間の長さから raw / daily / monthly を選ぶかテスト"""
+        self.save_days(datetime(2026, 10, 1), 3)
+        self.assertEqual(choose_resolution("2026-10-01", "2026-10-14"), 'raw')
+        self.assertEqual(choose_resolution(date(2026, 10, 1), date(2026, 10, 15)), 'daily')
+        self.assertEqual(choose_resolution(datetime(2025, 1, 1), datetime(2026, 12, 31)), 'monthly')
+
+        self.assertEqual(self.db.get_weather_series("990000", "2026-10-01", "2026-10-07")[0], 'raw')
+        resolution, rows = self.db.get_weather_series("990000", "2024-01-01", "2026-12-31")
+        self.assertEqual((resolution, [row[0] for row in rows]), ('monthly', ['2026-10']))
+        self.assertEqual(self.db.get_weather_series("999999", "2026-10-01", "2026-10-07"), ('raw', []))
+        with self.assertRaises(ValueError):
+            self.db.get_weather_series("990000", "2026-10-01", "2026-10-07", resolution='hourly')
+
+    def test_migration_builds_rollup_from_existing_rows(self):
+        """集計表のない既存のDBでは、マイグレーションで既存の行から集計するかテスト"""
+        self.save_days(datetime(2026, 10, 1), 5)
+        _, expected = self.db.get_weather_series("990000", "2026-10-01", "2026-10-31", resolution='daily')
+        with self.db.connections.write() as conn:
+            conn.execute("DROP TABLE weather_daily")
+            conn.execute("DROP TABLE weather_monthly")
+            conn.execute("PRAGMA user_version = 5")
+        db_connection.close_all()
+        self.db.connections.schema_version = None
+
+        with quiet():
+            db = DatabaseService(db_path=self.db_path)
+            db.init_database()
+        self.assertEqual(db.get_weather_series("990000", "2026-10-01", "2026-10-31", resolution='daily')[1], expected)
+        self.assertEqual(len(db.get_weather_series("990000", "2026-10-01", "2026-10-31", resolution='monthly')[1]), 1)
+
+
+class TestDbMaintenance(unittest.TestCase):
+    """古い行の削除と空き領域の返却のテストケース"""
+
+    NOW = datetime(2026, 10, 18, 12, 0, tzinfo=JST)
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, 'weather.db')
+        self.db = DatabaseService(db_path=self.db_path)
+        self.area_db_id = self.db.insert_area("テスト地域", "990000")
+
+    def tearDown(self):
+        db_connection.close_all()
+        shutil.rmtree(self.temp_dir)
+
+    def save_days(self, first, days):
+        #first から days 日分、毎日発表された予報を保存する（各予報は3日分）
+        for d in range(days):
+            report_time = first + timedelta(days=d)
+            self.db.upsert_weather_data([(self.area_db_id, make_forecast_json("990000", report_time=report_time, seed=d))])
+
+    def read(self, sql):
+        with self.db.connections.read() as conn:
+            return conn.execute(sql).fetchall()
+
+    def test_old_rows_replaced_by_rollup(self):
+        """保存期間より古い行だけを削除し、集計は削除前と同じ値で残るかテスト"""
+        self.save_days(datetime(2026, 8, 1, 11, 0, tzinfo=JST), 60)
+        _, daily = self.db.get_weather_series("990000", "2026-08-01", "2026-10-01", resolution='daily')
+        _, monthly = self.db.get_weather_series("990000", "2026-08-01", "2026-10-01", resolution='monthly')
+
+        result = self.db.run_maintenance(30, batch_size=7, now=self.NOW)
+
+        # 9/18 より前の日（8/1〜9/17）の行を削除
+        self.assertEqual(result['deleted_rows'], 48)
+        self.assertEqual(result['rolled_up_days'], 0)
+        self.assertEqual(self.read("SELECT MIN(time) FROM weather_info")[0][0][:10], '2026-09-18')
+        self.assertEqual(self.db.get_weather_series("990000", "2026-08-01", "2026-10-01", resolution='daily')[1], daily)
+        self.assertEqual(self.db.get_weather_series("990000", "2026-08-01", "2026-10-01", resolution='monthly')[1], monthly)
+
+    def test_rows_without_rollup_are_rolled_up_first(self):
+        """集計のない古い行は、削除する前に日別・月別に集計するかテスト"""
+        with self.db.connections.write() as conn:
+            conn.executemany(
+                "INSERT INTO weather_info (time, min_temperature, max_temperature, rain_proba, weather, area_id)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                [(f"2026-01-{day:02d}T{hour:02d}:00:00+09:00", day, day + hour, hour * 4, '晴れ', self.area_db_id)
+                 for day in range(1, 11) for hour in (0, 12)],
+            )
+
+        result = self.db.run_maintenance(30, batch_size=3, now=self.NOW)
+        self.assertEqual((result['deleted_rows'], result['rolled_up_days']), (20, 10))
+        self.assertEqual(self.read("SELECT COUNT(*) FROM weather_info"), [(0,)])
+
+        _, daily = self.db.get_weather_series("990000", "2026-01-01", "2026-01-10", resolution='daily')
+        self.assertEqual(daily[0], ('2026-01-01', '晴れ', 1.0, 13.0, 48, 24.0))
+        _, monthly = self.db.get_weather_series("990000", "2026-01-01", "2026-01-31", resolution='monthly')
+        self.assertEqual(monthly, [('2026-01', '晴れ', 1.0, 22.0, 48, 24.0)])
+
+    def test_old_update_slots_cleared(self):
+        """古い発表時刻の記録を消し、最後に終えた発表は残すかテスト"""
+        old = datetime(2025, 1, 1, 5, 0, tzinfo=JST)
+        self.db.complete_update_slot(old, old, 10, 0)
+        self.db.complete_update_slot(old + timedelta(hours=6), old, 10, 0)
+        self.db.run_maintenance(30, now=self.NOW)
+        self.assertEqual(self.db.get_last_update_slot(), old + timedelta(hours=6))
+        self.assertEqual(self.read("SELECT COUNT(*) FROM update_slot"), [(1,)])
+
+    def test_old_fingerprints_cleared(self):
+        """削除した予報の指紋・検証子も消し、同じ予報を受け取れば保存し直すかテスト"""
+        old = make_forecast_json("990000", report_time=datetime(2026, 1, 1, 11, 0, tzinfo=JST))
+        self.db.upsert_weather_data([(self.area_db_id, old)])
+        self.db.save_forecast_validators("990000", '"etag"', None, 100)
+        with self.db.connections.write() as conn:
+            conn.execute("UPDATE forecast_validator SET updated_at = '2026-01-01T11:00:00'")
+
+        result = self.db.run_maintenance(30, now=self.NOW)
+        self.assertEqual(result['cleared_fingerprints'], 2)
+        self.assertIsNone(self.db.get_forecast_validators("990000"))
+        self.assertEqual(self.db.upsert_weather_data([(self.area_db_id, old)]), (3, 0, 0))
+
+    def test_space_reclaimed(self):
+        """auto_vacuum=INCREMENTAL で、削除した行の領域がDBファイルから返却されるかテスト"""
+        self.assertEqual(self.read("PRAGMA auto_vacuum"), [(2,)])
+        with self.db.connections.write() as conn:
+            conn.executemany(
+                "INSERT INTO weather_info (time, wind, weather, area_id) VALUES (?, ?, '晴れ', ?)",
+                [(f"2025-{i // 28 % 12 + 1:02d}-{i % 28 + 1:02d}T{i:08d}", 'x' * 200, self.area_db_id)
+                 for i in range(5000)],
+            )
+        with self.db.connections.read() as conn:
+            page_size, pages_before = conn.execute("PRAGMA page_size").fetchone()[0], conn.execute("PRAGMA page_count").fetchone()[0]
+
+        result = self.db.run_maintenance(30, now=self.NOW)
+        pages_after = self.read("PRAGMA page_count")[0][0]
+        self.assertEqual(result['deleted_rows'], 5000)
+        self.assertGreater(result['reclaimed_bytes'], 0)
+        self.assertEqual(result['reclaimed_bytes'], (pages_before - pages_after) * page_size)
+        self.assertEqual(self.read("PRAGMA freelist_count"), [(0,)])
+        self.assertLess(result['size_after'], result['size_before'])
+
+    def test_retention_disabled(self):
+        """保存期間を指定しなければ行を削除しないかテスト"""
+        self.save_days(datetime(2026, 1, 1, 11, 0, tzinfo=JST), 3)
+        result = self.db.run_maintenance(None, now=self.NOW)
+        self.assertEqual(result['deleted_rows'], 0)
+        self.assertEqual(self.read("SELECT COUNT(*) FROM weather_info"), [(5,)])
+        with self.assertRaises(ValueError):
+            db_maintenance.purge_old_rows(self.db.connections, 0)
+
+
+@unittest.skipUnless(numpy, "numpy がインストールされていない")
+class TestWeatherArchive(unittest.TestCase):
+    """列ごとのバイナリへの書き出しと memmap での読み込みのテストケース"""
+
+    NOW = datetime(2026, 10, 18, 12, 0, tzinfo=JST)
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.archive_dir = os.path.join(self.temp_dir, 'archive')
+        self.db = DatabaseService(db_path=os.path.join(self.temp_dir, 'weather.db'))
+        self.area_ids = {
+            code: self.db.insert_area(f"地域{code}", code) for code in ("990000", "991000")
+        }
+
+    def tearDown(self):
+        db_connection.close_all()
+        shutil.rmtree(self.temp_dir)
+
+    def save_days(self, first, days):
+        #first から days 日分、2地域の予報を毎日保存する
+        for d in range(days):
+            report_time = first + timedelta(days=d)
+            self.db.upsert_weather_data([
+                (area_db_id, make_forecast_json(code, report_time=report_time, seed=d))
+                for code, area_db_id in self.area_ids.items()
+            ])
+
+    def test_export_past_months_only(self):
+        """今月より前の月だけを書き出し、2回目は何も書き出さないかテスト"""
+        self.save_days(datetime(2026, 8, 20, 11, 0, tzinfo=JST), 60)
+        months, rows = self.db.export_archive(self.archive_dir, now=self.NOW)
+        self.assertEqual(months, ['2026-08', '2026-09'])
+        # 8/20〜9/30 の42日 × 2地域
+        self.assertEqual(rows, 84)
+        self.assertEqual(self.db.export_archive(self.archive_dir, now=self.NOW), ([], 0))
+
+        # 月が変われば、その前の月だけを追加する
+        before = os.path.getmtime(os.path.join(self.archive_dir, '2026-08', 'time.bin'))
+        months, rows = self.db.export_archive(self.archive_dir, now=datetime(2026, 11, 2, tzinfo=JST))
+        self.assertEqual(months, ['2026-10'])
+        self.assertEqual(os.path.getmtime(os.path.join(self.archive_dir, '2026-08', 'time.bin')), before)
+        self.assertEqual(WeatherArchive(self.archive_dir).months(), ['2026-08', '2026-09', '2026-10'])
+
+    def test_columns_match_database(self):
+        """読み込んだ配列がDBの行と一致するかテスト（欠損は NaN と -1）"""
+        self.save_days(datetime(2026, 9, 1, 11, 0, tzinfo=JST), 10)
+        self.db.export_archive(self.archive_dir, now=self.NOW)
+        archive = WeatherArchive(self.archive_dir)
+        columns = archive.partition('2026-09')
+
+        with self.db.connections.read() as conn:
+            expected = conn.execute("""
+                SELECT w.time, w.min_temperature, w.max_temperature, w.rain_proba, a.area_id, w.weather, w.wind
+                FROM weather_info w JOIN area a ON w.area_id = a.id
+                WHERE w.time < '2026-10' ORDER BY w.time, w.id
+            """).fetchall()
+
+        self.assertIsInstance(columns['time'], numpy.memmap)
+        self.assertEqual(columns['time'].dtype, numpy.dtype('<i8'))
+        self.assertEqual(columns['rain_proba'].dtype, numpy.dtype('i1'))
+        self.assertEqual(
+            columns['time'].tolist(),
+            [int(datetime.fromisoformat(row[0]).timestamp()) for row in expected],
+        )
+        self.assertEqual(
+            [None if numpy.isnan(value) else value for value in columns['max_temperature'].tolist()],
+            [row[2] for row in expected],
+        )
+        self.assertEqual(
+            [None if value < 0 else value for value in columns['rain_proba'].tolist()],
+            [row[3] for row in expected],
+        )
+        self.assertEqual(archive.decode('area', columns['area']), [row[4] for row in expected])
+        self.assertEqual(archive.decode('weather', columns['weather']), [row[5] for row in expected])
+        self.assertEqual(archive.decode('wind', columns['wind']), [row[6] for row in expected])
+
+    def test_dictionary_codes_are_stable(self):
+        """後から書き出した月でも、既存の値の番号が変わらないかテスト"""
+        self.save_days(datetime(2026, 8, 25, 11, 0, tzinfo=JST), 40)
+        self.db.export_archive(self.archive_dir, now=datetime(2026, 9, 15, tzinfo=JST))
+        first = WeatherArchive(self.archive_dir).manifest['dictionaries']
+
+        self.db.export_archive(self.archive_dir, now=self.NOW)
+        second = WeatherArchive(self.archive_dir).manifest['dictionaries']
+        for name, values in first.items():
+            self.assertEqual(second[name][:len(values)], values)
+
+    def test_slice_and_aggregate(self):
+        """期間の切り出しと地域ごとの集計を配列のまま行えるかテスト"""
+        self.save_days(datetime(2026, 7, 1, 11, 0, tzinfo=JST), 90)
+        self.db.export_archive(self.archive_dir, now=self.NOW)
+        archive = WeatherArchive(self.archive_dir)
+
+        start = datetime(2026, 8, 10, tzinfo=JST)
+        end = datetime(2026, 9, 5, tzinfo=JST)
+        area = archive.code_of('area', "990000")
+        parts = list(archive.iter_partitions(start, end, columns=('area', 'max_temperature')))
+        self.assertEqual([month for month, _ in parts], ['2026-08', '2026-09'])
+
+        highs = numpy.concatenate([
+            columns['max_temperature'][columns['area'] == area] for _, columns in parts
+        ])
+        with self.db.connections.read() as conn:
+            expected = conn.execute("""
+                SELECT COUNT(*), MAX(max_temperature) FROM weather_info
+                WHERE area_id = ? AND time >= '2026-08-10' AND time < '2026-09-05'
+            """, (self.area_ids["990000"],)).fetchone()
+        self.assertEqual(len(highs), expected[0])
+        self.assertEqual(float(numpy.nanmax(highs)), expected[1])
+
+        # 期間を指定しなければ全行
+        total = sum(len(columns['area']) for _, columns in archive.iter_partitions(columns=('area',)))
+        self.assertEqual(total, sum(part['rows'] for part in archive.manifest['partitions'].values()))
+
+
+class TestWriteBehind(unittest.TestCase):
+    """画面からの保存を裏のスレッドでまとめて書き込むテストケース"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db = DatabaseService(db_path=os.path.join(self.temp_dir, 'weather.db'))
+        self.writer = WriteBehindQueue(self.db)
+
+    def tearDown(self):
+        self.writer.close()
+        db_connection.close_all()
+        shutil.rmtree(self.temp_dir)
+
+    def forecast(self, i):
+        return parse_forecast(make_forecast_json(f"{990000 + i * 10:06d}"))
+
+    def row_count(self):
+        with self.db.connections.read() as conn:
+            return conn.execute("SELECT COUNT(*) FROM weather_info").fetchone()[0]
+
+    def test_pending_writes_batched(self):
+        """書き込み中に溜まった予報を1つのトランザクションにまとめるかテスト"""
+        # 書き込み用の接続をふさいで、その間に予報を溜める
+        with quiet():
+            with self.db.connections.write():
+                start = time.perf_counter()
+                for i in range(10):
+                    self.assertTrue(self.writer.submit(f"{990000 + i * 10:06d}", f"地域{i}", self.forecast(i)))
+                elapsed = time.perf_counter() - start
+                self.assertEqual(self.row_count(), 0)
+            self.assertTrue(self.writer.flush(timeout=5))
+
+        # submit はDBを待たない
+        self.assertLess(elapsed, 0.5)
+        stats = self.writer.stats()
+        self.assertEqual((stats['written'], stats['depth'], stats['pending']), (10, 0, 0))
+        self.assertLessEqual(stats['batches'], 2)
+        self.assertEqual(stats['rows_written'], 30)
+        self.assertGreater(stats['latency_max'], 0)
+        self.assertEqual(self.row_count(), 30)
+
+    def test_full_queue_drops_without_waiting(self):
+        """保存待ちが上限に達したら待たずに False を返すかテスト"""
+        writer = WriteBehindQueue(self.db, max_pending=2)
+        with quiet():
+            with self.db.connections.write():
+                results = [writer.submit(f"{990000 + i * 10:06d}", f"地域{i}", self.forecast(i)) for i in range(5)]
+            writer.close()
+
+        self.assertIn(False, results)
+        stats = writer.stats()
+        self.assertEqual(stats['dropped'], results.count(False))
+        self.assertEqual(stats['written'], results.count(True))
+        self.assertGreaterEqual(stats['max_depth'], 2)
+
+    def test_failed_item_does_not_lose_batch(self):
+        """1件の保存に失敗しても、同じまとまりの他の予報は保存するかテスト"""
+        with quiet():
+            with self.db.connections.write():
+                self.writer.submit("990000", "地域0", self.forecast(0))
+                self.writer.submit("990010", "地域1", [])
+                self.writer.submit("990020", "地域2", self.forecast(2))
+            self.writer.flush(timeout=5)
+
+        stats = self.writer.stats()
+        self.assertEqual((stats['written'], stats['errors']), (2, 1))
+        self.assertEqual(self.row_count(), 6)
+
+    def test_close_flushes_pending(self):
+        """close() で保存待ちを書き込んでからスレッドを止めるかテスト"""
+        with quiet():
+            for i in range(3):
+                self.writer.submit(f"{990000 + i * 10:06d}", f"地域{i}", self.forecast(i))
+            self.assertTrue(self.writer.close())
+
+        self.assertEqual(self.row_count(), 9)
+        self.assertFalse(self.writer._thread.is_alive())
+        with self.assertRaises(RuntimeError):
+            self.writer.submit("990000", "地域0", self.forecast(0))
+
+    def test_shared_per_database(self):
+        """同じDBファイルでは同じキューを使い、閉じた後は作り直すかテスト"""
+        writer = write_behind.get_queue(self.db)
+        self.assertIs(write_behind.get_queue(DatabaseService(db_path=self.db.db_path)), writer)
+        write_behind.close_all()
+        self.assertIsNot(write_behind.get_queue(self.db), writer)
+        write_behind.close_all()
+
+
+class TestUpdatePipeline(unittest.TestCase):
+    """取得・解析・保存の段を分けた更新のテストケース"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db = DatabaseService(db_path=os.path.join(self.temp_dir, 'weather.db'))
+        self.areas = [(f"{990000 + i * 10:06d}", f"地域{i}") for i in range(20)]
+        self.results = {}
+
+    def tearDown(self):
+        db_connection.close_all()
+        shutil.rmtree(self.temp_dir)
+
+    def run_pipeline(self, fetch, areas=None, **options):
+        pipeline = UpdatePipeline(
+            self.db, fetch=fetch,
+            on_result=lambda code, status, detail: self.results.__setitem__(code, (status, detail)),
+            **options,
+        )
+        with quiet():
+            return pipeline.run(areas or self.areas)
+
+    def test_all_areas_saved_in_batches(self):
+        """すべての地域を保存し、複数の地域を1つのトランザクションにまとめるかテスト"""
+        def fetch(code):
+            time.sleep(0.005)
+            return make_forecast_json(code)
+
+        report = self.run_pipeline(fetch, concurrency=4, write_batch=8)
+        self.assertEqual(len(self.results), 20)
+        self.assertTrue(all(status == 'saved' and detail == (3, 0, 0) for status, detail in self.results.values()))
+        self.assertLess(report['batches'], 20)
+        self.assertEqual([report['stages'][name]['items'] for name in ('fetch', 'parse', 'write')], [20, 20, 20])
+        self.assertGreater(report['stages']['fetch']['throughput'], 0)
+        with self.db.connections.read() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM weather_info").fetchone()[0], 60)
+
+    def test_failures_do_not_lose_batch(self):
+        """取得・解析・保存の失敗はその地域だけにとどまり、検証子を消すかテスト"""
+        def fetch(code):
+            if code == "990000":
+                raise requests.exceptions.ConnectionError("接続できません")
+            if code == "990010":
+                return []
+            if code == "990020":
+                return NOT_MODIFIED
+            return make_forecast_json(code)
+
+        for code in ("990010", "990030"):
+            self.db.save_forecast_validators(code, '"etag"', None, 100)
+        # 地域名がないと area の登録に失敗する
+        areas = self.areas[:3] + [("990030", None)] + self.areas[4:]
+        self.run_pipeline(fetch, areas=areas, write_batch=32, batch_wait=0.2)
+
+        statuses = {code: status for code, (status, _) in self.results.items()}
+        self.assertEqual(
+            [statuses[code] for code in ("990000", "990010", "990020", "990030")],
+            ['error', 'error', 'not_modified', 'error'],
+        )
+        self.assertEqual(list(statuses.values()).count('saved'), 16)
+        self.assertIsNone(self.db.get_forecast_validators("990010"))
+        self.assertIsNone(self.db.get_forecast_validators("990030"))
+        with self.db.connections.read() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM weather_info").fetchone()[0], 48)
+
+    def test_bounded_queues(self):
+        """保存が遅いと取得が待たされ、キューが上限を超えないかテスト"""
+        original = self.db.upsert_weather_data
+
+        def slow_upsert(forecasts):
+            time.sleep(0.01)
+            return original(forecasts)
+
+        self.db.upsert_weather_data = slow_upsert
+        report = self.run_pipeline(make_forecast_json, queue_size=2, write_batch=1)
+        self.assertEqual(len(self.results), 20)
+        for occupancy in report['queues'].values():
+            self.assertLessEqual(occupancy['max'], 2)
+        self.assertGreater(report['queues']['write']['blocked'], 0)
+
+    def test_failed_areas_retried_without_blocking(self):
+        """失敗した地域はバックオフの後に取得し直し、その間も他の地域を保存するかテスト"""
+        attempts = {}
+        saved_order = []
+
+        def fetch(code):
+            attempts[code] = attempts.get(code, 0) + 1
+            if code == "990000" and attempts[code] < 3:
+                raise requests.exceptions.ConnectionError("接続できません")
+            if code == "990010":
+                raise requests.exceptions.ConnectionError("ずっと接続できません")
+            return make_forecast_json(code)
+
+        def on_result(code, status, detail):
+            self.results.setdefault(code, []).append(status)
+            if status == 'saved':
+                saved_order.append(code)
+
+        policy = RetryPolicy(max_retries=2, base_delay=0.05, random_func=lambda: 1.0)
+        pipeline = UpdatePipeline(self.db, fetch=fetch, on_result=on_result, retry_policy=policy, write_batch=4)
+        with quiet():
+            report = pipeline.run(self.areas)
+
+        self.assertEqual(self.results["990000"], ['retry', 'retry', 'saved'])
+        self.assertEqual(self.results["990010"], ['retry', 'retry', 'error'])
+        self.assertEqual(attempts["990010"], 3)
+        self.assertEqual(report['retries'], 4)
+        # 再試行を待っている間に他の地域を先に保存する
+        self.assertEqual(saved_order[-1], "990000")
+        self.assertEqual(len(saved_order), 19)
+
+
+def _exit_on_second_area(code):
+    #取得のプロセスが途中で落ちた場合のテスト用（別のプロセスに送るためモジュールの関数にする）
+    if code.endswith('1'):
+        # 先に送った結果を親に届けてから終了する
+        time.sleep(0.2)
+        os._exit(3)
+    return make_forecast_json(code)
+
+
+class TestShardedUpdate(StubServerTestCase):
+    """取得・解析を複数のプロセスに分けた更新のテストケース"""
+
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = tempfile.mkdtemp()
+        self.db = DatabaseService(db_path=os.path.join(self.temp_dir, 'weather.db'))
+        offices = self.stub.area_json['offices']
+        self.areas = [(code, offices[code]['name']) for code in offices]
+        self.results = {}
+
+    def tearDown(self):
+        super().tearDown()
+        db_connection.close_all()
+        shutil.rmtree(self.temp_dir)
+
+    def run_pipeline(self, areas=None, **options):
+        pipeline = ShardedUpdatePipeline(
+            self.db,
+            on_result=lambda code, status, detail: self.results.__setitem__(code, (status, detail)),
+            **options,
+        )
+        with quiet():
+            return pipeline.run(areas or self.areas)
+
+    def test_not_modified_survives_pickle(self):
+        """NOT_MODIFIED と解析済みの予報を別のプロセスへ送れるかテスト"""
+        self.assertIs(pickle.loads(pickle.dumps(NOT_MODIFIED)), NOT_MODIFIED)
+        bundle = parse_forecast(make_forecast_json("130000"))
+        self.assertEqual(list(pickle.loads(pickle.dumps(bundle)).rows()), list(bundle.rows()))
+
+    def test_workers_save_all_areas(self):
+        """複数のプロセスで取得・解析し、このプロセスですべての地域を保存するかテスト"""
+        report = self.run_pipeline(workers=2, concurrency=4)
+        self.assertEqual(len(self.results), len(self.areas))
+        self.assertTrue(all(status == 'saved' for status, _ in self.results.values()))
+        self.assertEqual(report['stages']['shard']['items'], len(self.areas))
+        self.assertEqual(report['areas'][self.areas[0][0]]['status_code'], 200)
+        with self.db.connections.read() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM weather_info").fetchone()[0], 3 * len(self.areas))
+
+        # 子プロセスが受け取った検証子をこのプロセスで保存し、次回は条件付きGETになる
+        self.assertIsNotNone(self.db.get_forecast_validators(self.areas[0][0]))
+        self.results.clear()
+        self.run_pipeline(workers=2, concurrency=4)
+        self.assertTrue(all(status == 'not_modified' for status, _ in self.results.values()))
+        self.assertEqual(self.stub.not_modified_count, len(self.areas))
+
+    def test_exited_worker_areas_fail(self):
+        """途中で終了したプロセスの残りの地域を失敗にし、他のプロセスの地域は保存するかテスト"""
+        areas = [(f"{990000 + i:06d}", f"地域{i}") for i in range(6)]
+        self.run_pipeline(areas=areas, workers=2, concurrency=1, fetch=_exit_on_second_area)
+
+        statuses = {code: status for code, (status, _) in self.results.items()}
+        # 2つ目のプロセスは 990001・990003・990005 を受け持ち、最初の地域で終了する
+        self.assertEqual(statuses, {
+            "990000": 'saved', "990002": 'saved', "990004": 'saved',
+            "990001": 'error', "990003": 'error', "990005": 'error',
+        })
+
+
+    def test_rate_shared_with_parent(self):
+        """再試行を行うこのプロセスにもレート制限を分け、終わったら元に戻すかテスト"""
+        limiter = JmaApiService.rate_limiter
+        before = (limiter.rate, limiter.burst)
+        during = []
+        pipeline = ShardedUpdatePipeline(
+            self.db, workers=2, concurrency=2,
+            on_result=lambda code, status, detail: during.append((limiter.rate, limiter.burst)),
+        )
+        with quiet():
+            pipeline.run(self.areas[:4])
+        self.assertEqual(set(during), {(before[0] / 3, max(1, before[1] / 3))})
+        self.assertEqual((limiter.rate, limiter.burst), before)
+
+class TestUpdateScheduler(StubServerTestCase):
+    """発表時刻に合わせた自動更新のスケジュールのテストケース"""
+
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = tempfile.mkdtemp()
+        self.db = DatabaseService(db_path=os.path.join(self.temp_dir, 'weather.db'))
+        # 2026-10-18 11:05（発表の5分後）
+        self.clock = FakeClock(datetime(2026, 10, 18, 11, 5, tzinfo=JST).timestamp())
+        self.sleeps = []
+
+    def tearDown(self):
+        super().tearDown()
+        db_connection.close_all()
+        shutil.rmtree(self.temp_dir)
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.clock.now += seconds
+
+    def make_scheduler(self, **options):
+        options.setdefault('rng', random.Random(0))
+        return UpdateScheduler(self.db, clock=self.clock, sleep=self.sleep, **options)
+
+    def test_wakes_after_publication(self):
+        """発表時刻 + delay になるまで取得せず、終えた発表は取り直さないかテスト"""
+        scheduler = self.make_scheduler(delay=600)
+        # 11:05 は 11時の発表の delay 前なので、5時の発表が対象
+        slot, skipped = scheduler.due_slot()
+        self.assertEqual(slot, datetime(2026, 10, 18, 5, 0, tzinfo=JST))
+        self.assertEqual(skipped, 0)
+
+        scheduler.complete_slot(slot, 10, 0)
+        self.assertIsNone(scheduler.due_slot())
+        self.assertEqual(scheduler.next_wake(), datetime(2026, 10, 18, 11, 10, tzinfo=JST))
+
+        scheduler.sleep_until(scheduler.next_wake())
+        self.assertEqual(scheduler.due_slot(), (datetime(2026, 10, 18, 11, 0, tzinfo=JST), 0))
+
+    def test_catches_up_missed_slots(self):
+        """止まっていた間に過ぎた発表は、直近の1回だけ取り直すかテスト"""
+        scheduler = self.make_scheduler(delay=600)
+        scheduler.complete_slot(datetime(2026, 10, 17, 5, 0, tzinfo=JST), 10, 0)
+
+        # 10/17 11時・17時、10/18 5時を飛ばし、10/18 11時を取り直す
+        self.clock.now += 3600
+        self.assertEqual(scheduler.due_slot(), (datetime(2026, 10, 18, 11, 0, tzinfo=JST), 3))
+
+    def test_unfinished_slot_is_retried(self):
+        """始めたが終えていない発表は、次の起動でまた取得するかテスト"""
+        scheduler = self.make_scheduler(delay=0)
+        slot, _ = scheduler.due_slot()
+        scheduler.start_slot(slot)
+        self.assertEqual(scheduler.due_slot(), (slot, 0))
+        scheduler.complete_slot(slot, 10, 1)
+        self.assertIsNone(scheduler.due_slot())
+        self.assertEqual(self.db.get_last_update_slot(), slot)
+
+    def test_sleep_survives_suspend(self):
+        """少しずつ眠り、休止で時計が進んだらすぐ起きるかテスト"""
+        scheduler = self.make_scheduler(sleep_chunk=60)
+        target = datetime.fromtimestamp(self.clock.now + 600, JST)
+
+        def suspend_once(seconds):
+            self.sleep(seconds)
+            if len(self.sleeps) == 2:
+                # 休止から3時間後に復帰
+                self.clock.now += 3 * 3600
+
+        scheduler.sleep = suspend_once
+        scheduler.sleep_until(target)
+        self.assertEqual(self.sleeps, [60, 60])
+
+    def test_plan_spreads_areas(self):
+        """全地域を window の間に1回ずつ、時刻順に振り分けるかテスト"""
+        scheduler = self.make_scheduler(delay=600, window=1800, wave_interval=60)
+        codes = [f"{i:06d}" for i in range(100)]
+        slot = datetime(2026, 10, 18, 11, 0, tzinfo=JST)
+        start = datetime(2026, 10, 18, 11, 10, tzinfo=JST)
+        plan = scheduler.plan(codes, slot, now=datetime(2026, 10, 18, 11, 5, tzinfo=JST))
+
+        self.assertEqual(len(plan), 30)
+        self.assertEqual(sorted(code for _, wave in plan for code in wave), codes)
+        times = [due for due, _ in plan]
+        self.assertEqual(times, sorted(times))
+        self.assertGreaterEqual(times[0], start)
+        self.assertLess(times[-1], start + timedelta(seconds=1800))
+        self.assertLessEqual(max(len(wave) for _, wave in plan), 4)
+
+        # 取り直しの場合は今から始める
+        late = datetime(2026, 10, 18, 14, 0, tzinfo=JST)
+        self.assertGreaterEqual(scheduler.plan(codes, slot, now=late)[0][0], late)
+
+    def test_invalid_options(self):
+        """不正な設定で ValueError になるかテスト"""
+        with self.assertRaises(ValueError):
+            self.make_scheduler(window=-1)
+        with self.assertRaises(ValueError):
+            self.make_scheduler(jitter=2)
+
+    def test_update_slot(self):
+        """1回の発表分の更新で全地域を分けて取得し、終えたことを記録するかテスト"""
+        scheduler = self.make_scheduler(delay=0, window=300, wave_interval=60)
+        slot, _ = scheduler.due_slot()
+        with quiet():
+            stats = auto_update.update_slot(self.db, scheduler, slot, retention_days=0)
+
+        total = len(self.stub.area_json['offices'])
+        self.assertEqual(stats['success'], total)
+        # 5回に分けて、回の間は眠る
+        self.assertGreater(sum(self.sleeps), 0)
+        self.assertLess(sum(self.sleeps), 300)
+        self.assertIsNone(scheduler.due_slot())
+        with self.db.connections.read() as conn:
+            self.assertEqual(
+                conn.execute("SELECT areas, errors FROM update_slot").fetchall(), [(total, 0)]
+            )
+
+
+class TestAreaPriority(StubServerTestCase):
+    """画面で開かれた回数に応じた自動更新の優先順位のテストケース"""
+
+    NOW = datetime(2026, 10, 18, 12, 0, tzinfo=JST)
+
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, 'weather.db')
+        self.db = DatabaseService(db_path=self.db_path)
+
+    def tearDown(self):
+        super().tearDown()
+        db_connection.close_all()
+        shutil.rmtree(self.temp_dir)
+
+    def test_tiers_and_order(self):
+        """hot は回数の多い順、warm・cold は取得が古い順に並ぶかテスト"""
+        stats = {
+            'a': (1, self.NOW - timedelta(days=1), None),
+            'b': (5, self.NOW - timedelta(days=2), self.NOW),
+            'c': (9, self.NOW - timedelta(days=20), self.NOW),
+            'd': (1, self.NOW - timedelta(days=10), self.NOW - timedelta(days=1)),
+            'e': (0, None, self.NOW),
+        }
+        selected, counts, skipped = area_priority.prioritize(list('abcdef'), stats, now=self.NOW)
+        self.assertEqual(selected, ['b', 'a', 'd', 'c', 'f', 'e'])
+        self.assertEqual(counts, {'hot': 2, 'warm': 2, 'cold': 2})
+        self.assertEqual(sum(skipped.values()), 0)
+
+    def test_budget_and_skip_cold(self):
+        """予算を超えた分は優先度の低い方から省略し、cold は省略できるかテスト"""
+        stats = {'a': (3, self.NOW, None), 'b': (1, self.NOW - timedelta(days=10), None)}
+        selected, _, skipped = area_priority.prioritize(list('abcd'), stats, now=self.NOW, budget=3)
+        self.assertEqual(selected, ['a', 'b', 'c'])
+        self.assertEqual(skipped, {'hot': 0, 'warm': 0, 'cold': 1})
+
+        selected, _, skipped = area_priority.prioritize(list('abcd'), stats, now=self.NOW, skip_cold=True)
+        self.assertEqual(selected, ['a', 'b'])
+        self.assertEqual(skipped['cold'], 2)
+
+    def test_views_recorded_through_write_behind(self):
+        """画面で開いた回数が裏のスレッドでまとめて記録されるかテスト"""
+        writer = WriteBehindQueue(self.db)
+        try:
+            with quiet():
+                for code in ("990000", "990000", "990010"):
+                    self.assertTrue(writer.record_view(code))
+                writer.submit("990010", "テスト地域", make_forecast_json("990010"))
+                self.assertTrue(writer.flush(timeout=2.0))
+        finally:
+            writer.close()
+
+        stats = self.db.get_area_view_stats()
+        self.assertEqual(stats["990000"][0], 2)
+        self.assertEqual(stats["990010"][0], 1)
+        self.assertEqual(area_priority.tier_of(stats["990000"][1], datetime.now(JST)), 'hot')
+        self.assertEqual(writer.stats()['written'], 1)
+
+    def test_update_within_budget(self):
+        """自動更新が予算内で、よく開かれる地域から取得し、次回は取得の古い地域を先にするかテスト"""
+        codes = list(self.stub.area_json['offices'])
+        hot = codes[-3:]
+        self.db.record_area_views({code: 2 for code in hot})
+
+        with quiet():
+            first = auto_update.update_all_areas(db_path=self.db_path, retention_days=0, budget=10)
+        self.assertEqual(first['success'], 10)
+        self.assertEqual(first['skipped'], len(codes) - 10)
+        stats = self.db.get_area_view_stats()
+        refreshed = {code for code, (_, _, refreshed_at) in stats.items() if refreshed_at}
+        self.assertTrue(set(hot) <= refreshed)
+        self.assertEqual(len(refreshed), 10)
+
+        # 2回目は hot の地域と、まだ取得していない地域を取得する
+        with quiet():
+            second = auto_update.update_all_areas(db_path=self.db_path, retention_days=0, budget=10)
+        self.assertEqual(second['not_modified'], 3)
+        self.assertEqual(second['success'], 7)
+
+        with quiet():
+            lazy = auto_update.update_all_areas(db_path=self.db_path, retention_days=0, skip_cold=True)
+        self.assertEqual(lazy['not_modified'] + lazy['success'], 3)
+
+
+class TestUpdateRun(StubServerTestCase):
+    """中断した自動更新の再開のテストケース"""
+
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, 'weather.db')
+        self.db = DatabaseService(db_path=self.db_path)
+
+    def tearDown(self):
+        super().tearDown()
+        db_connection.close_all()
+        shutil.rmtree(self.temp_dir)
+
+    def test_record_and_pending(self):
+        """地域ごとの状態を記録し、終わっていない地域を最初の順番で返すかテスト"""
+        run = UpdateRun.start(self.db, ["c", "a", "b", "d"])
+        run.record("c", 'saved')
+        run.record("b", 'retry', RuntimeError("失敗"))
+        run.record("d", 'not_modified')
+
+        found = UpdateRun.find_incomplete(self.db)
+        self.assertEqual(found.id, run.id)
+        self.assertEqual(found.pending(), ["a", "b"])
+        self.assertEqual(found.summary(), {'saved': 1, 'pending': 1, 'retry': 1, 'not_modified': 1})
+
+        run.complete()
+        self.assertIsNone(UpdateRun.find_incomplete(self.db))
+
+    def test_new_run_supersedes_unfinished(self):
+        """再開せずに新しい回を始めると、前の中断した回は再開しないかテスト"""
+        slot = datetime(2026, 10, 18, 11, 0, tzinfo=JST)
+        UpdateRun.start(self.db, ["a"], slot)
+        self.assertIsNotNone(UpdateRun.find_incomplete(self.db, slot))
+        self.assertIsNone(UpdateRun.find_incomplete(self.db, slot + timedelta(hours=6)))
+
+        second = UpdateRun.start(self.db, ["b"])
+        self.assertEqual(UpdateRun.find_incomplete(self.db).id, second.id)
+        self.assertIsNone(UpdateRun.find_incomplete(self.db, slot))
+
+    def test_resume_interrupted_update(self):
+        """中断した更新を --resume で残りの地域から再開するかテスト"""
+        codes = list(self.stub.area_json['offices'])
+        # 10地域を保存したところで止まった回
+        run = UpdateRun.start(self.db, codes)
+        for code in codes[:10]:
+            run.record(code, 'saved')
+
+        with quiet():
+            stats = auto_update.update_all_areas(db_path=self.db_path, retention_days=0, resume=True)
+        self.assertEqual(stats['success'], len(codes) - 10)
+        self.assertEqual(self.stub.request_count, len(codes) - 10 + 1)
+        self.assertEqual(run.summary(), {'saved': len(codes)})
+        self.assertIsNone(UpdateRun.find_incomplete(self.db))
+
+        # 終わっていれば新しい回を始める
+        with quiet():
+            stats = auto_update.update_all_areas(db_path=self.db_path, retention_days=0, resume=True)
+        self.assertEqual(stats['not_modified'], len(codes) - 10)
+        self.assertEqual(stats['success'], 10)
+
+
+    def test_resume_after_fetch_without_write(self):
+        """取得した後・保存する前に止まった地域を、再開したときに304にせず保存するかテスト"""
+        codes = list(self.stub.area_json['offices'])
+        UpdateRun.start(self.db, codes)
+        # 検証子だけ保存された（行は保存されていない）5地域（取得した時点で検証子を保存していたDB）
+        for code in codes[:5]:
+            info = {}
+            JmaApiService._fetch_forecast(code, self.db, info)
+            self.db.save_forecast_validators(code, *info['validators'])
+
+        with quiet():
+            stats = auto_update.update_all_areas(db_path=self.db_path, retention_days=0, resume=True)
+        self.assertEqual(stats['success'], len(codes))
+        self.assertEqual(stats['not_modified'], 0)
+        with self.db.connections.read() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(DISTINCT area_id) FROM weather_info").fetchone()[0], len(codes))
+
+    def test_validators_saved_with_rows(self):
+        """取得した検証子は、地域の行と同じトランザクションで保存されるかテスト"""
+        offices = self.stub.area_json['offices']
+        areas = [(code, offices[code]['name']) for code in offices]
+        seen = []
+        original = self.db.insert_area
+
+        def insert_area(area_name, area_code):
+            # 保存の途中では、まだコミットされていない
+            seen.append(self.db.get_forecast_validators(area_code))
+            return original(area_name, area_code)
+
+        self.db.insert_area = insert_area
+        with quiet():
+            UpdatePipeline(self.db).run(areas)
+        self.assertEqual(seen, [None] * len(areas))
+        for code, _ in areas:
+            self.assertIsNotNone(self.db.get_forecast_validators(code))
+
+class TestRunMetrics(StubServerTestCase):
+    """自動更新の計測値の記録と書き出しのテストケース"""
+
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, 'weather.db')
+        self.metrics_dir = os.path.join(self.temp_dir, 'metrics')
+        self.db = DatabaseService(db_path=self.db_path)
+
+    def tearDown(self):
+        super().tearDown()
+        db_connection.close_all()
+        shutil.rmtree(self.temp_dir)
+
+    def test_fetch_info(self):
+        """取得時に状態コード・転送量・再試行回数を返すかテスト"""
+        code = list(self.stub.area_json['offices'])[0]
+        first, second = {}, {}
+        JmaApiService._fetch_forecast(code, self.db, first)
+        self.db.save_forecast_validators(code, *first['validators'])
+        JmaApiService._fetch_forecast(code, self.db, second)
+        self.assertEqual((first['status_code'], first['retries']), (200, 0))
+        self.assertGreater(first['bytes'], 0)
+        self.assertEqual(second['status_code'], 304)
+
+    def test_metrics_written(self):
+        """更新ごとに地域ごとの計測値を記録し、テキストファイルと JSON に書き出すかテスト"""
+        total = len(self.stub.area_json['offices'])
+        with quiet():
+            first = auto_update.update_all_areas(db_path=self.db_path, retention_days=0, metrics_dir=self.metrics_dir)
+            second = auto_update.update_all_areas(db_path=self.db_path, retention_days=0, metrics_dir=self.metrics_dir)
+
+        summary = first['metrics']
+        self.assertEqual(summary['statuses'], {'saved': total})
+        self.assertEqual(summary['fetch_seconds']['count'], total)
+        self.assertLessEqual(summary['fetch_seconds']['p50'], summary['fetch_seconds']['p95'])
+        self.assertGreater(summary['bytes'], 0)
+        self.assertEqual(summary['rows']['inserted'], total * 3)
+        self.assertGreater(summary['parse_seconds'], 0)
+        self.assertGreater(summary['write_seconds'], 0)
+        self.assertGreater(summary['elapsed'], 0)
+
+        # 2回目は304のため行を書かず、最近の回の推移に前回が入る
+        self.assertEqual(second['metrics']['statuses'], {'not_modified': total})
+        self.assertEqual(second['metrics']['rows']['inserted'], 0)
+        self.assertEqual([run['run_id'] for run in second['metrics']['history']],
+                         [second['metrics']['run_id'], summary['run_id']])
+
+        with open(os.path.join(self.metrics_dir, run_metrics.PROM_FILE), encoding='utf-8') as f:
+            prom = f.read()
+        self.assertIn(f'weather_update_areas{{status="not_modified"}} {total}', prom)
+        self.assertIn(f"weather_update_fetch_seconds_count {total}", prom)
+        self.assertIn('weather_update_rows{op="inserted"} 0', prom)
+        self.assertIn("# TYPE weather_update_duration_seconds gauge", prom)
+        with open(os.path.join(self.metrics_dir, run_metrics.JSON_FILE), encoding='utf-8') as f:
+            exported = json.load(f)
+        self.assertEqual(exported['run_id'], second['metrics']['run_id'])
+        self.assertEqual(len(exported['areas']), total)
+
+    def test_resumed_run_adds_metrics(self):
+        """再開した回は前の実行の計測値に足すかテスト"""
+        run = UpdateRun.start(self.db, ["990000", "990010"])
+        metrics = {'990000': dict(
+            attempts=1, fetch_seconds=0.5, bytes=100, http_retries=1, status_code=200,
+            parse_seconds=0.01, write_seconds=0.02, inserted=3, updated=0, unchanged=0,
+        )}
+        run.record_metrics(metrics, 1.0)
+        run.record_metrics(metrics, 2.0)
+        run.complete()
+
+        summary = run_metrics.run_summary(self.db, run.id)
+        self.assertEqual(summary['elapsed'], 3.0)
+        self.assertEqual(summary['bytes'], 200)
+        self.assertEqual(summary['retries']['http'], 2)
+        self.assertEqual(summary['fetch_seconds']['count'], 1)
+        self.assertIsNone(run_metrics.run_summary(self.db, run.id + 1))
+
+
+class TestWeatherHistory(unittest.TestCase):
+    """履歴のキーセット方式のページ取得とインデックスのテストケース"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, 'weather.db')
+        self.db = DatabaseService(db_path=self.db_path)
+        with quiet():
+            self.db.init_database()
+
+        # 3地域 × 3日分（6時間ごと）の行を入れる。地域をまたいで同じ時刻が並ぶ
+        self.codes = [f"99{i:04d}" for i in range(3)]
+        area_ids = [self.db.insert_area(f"地域{i}", code) for i, code in enumerate(self.codes)]
+        with self.db.connections.write() as conn:
+            conn.executemany(
+                "INSERT INTO weather_info (time, weather, area_id) VALUES (?, ?, ?)",
+                [
+                    (f"2024-01-{day:02d}T{hour:02d}:00:00+09:00", '晴れ', area_db_id)
+                    for area_db_id in area_ids for day in range(1, 4) for hour in (0, 6, 12, 18)
+                ],
+            )
+
+    def tearDown(self):
+        db_connection.close_all()
+        shutil.rmtree(self.temp_dir)
+
+    def explain(self, sql):
+        with self.db.connections.read() as conn:
+            return ' / '.join(row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql))
+
+    def test_fresh_database(self):
+        """新しいDBファイルでも保存と履歴の取得ができるかテスト"""
+        forecast = parse_forecast(make_forecast_json("990100"))
+        area_db_id = self.db.insert_area("新規地域", "990100")
+        self.assertEqual(self.db.insert_or_update_weather_data(area_db_id, forecast), 3)
+        self.assertEqual(len(self.db.get_weather_history(area_id="990100")), 3)
+
+    def test_pages_cover_all_rows_in_order(self):
+        """小さいページでも全行を重複なく新しい順に返すかテスト"""
+        for area_id, total in ((None, 36), (self.codes[1], 12)):
+            rows = list(self.db.iter_weather_history(area_id, page_size=5))
+            self.assertEqual(len(rows), total)
+            self.assertEqual(len({row[0] for row in rows}), total)
+            keys = [(row[2], row[0]) for row in rows]
+            self.assertEqual(keys, sorted(keys, reverse=True))
+
+        self.assertTrue(all(row[1] == "地域1" for row in self.db.iter_weather_history(self.codes[1])))
+        self.assertEqual(list(self.db.iter_weather_history("000000")), [])
+
+    def test_after(self):
+        """after=(time, id) で続きから取得できるかテスト"""
+        first_page = self.db.get_weather_history(limit=7)
+        rest = list(self.db.iter_weather_history(after=(first_page[-1][2], first_page[-1][0])))
+        self.assertEqual(first_page + rest, list(self.db.iter_weather_history(page_size=4)))
+
+    def test_limits(self):
+        """limit が0なら空、負なら上限なし（変更前の LIMIT -1 と同じ）、page_size が0以下なら ValueError かテスト"""
+        self.assertEqual(self.db.get_weather_history(limit=0), [])
+        self.assertEqual(len(self.db.get_weather_history(limit=-1)), 36)
+        self.assertEqual(len(self.db.get_weather_history(area_id=self.codes[0], limit=-1)), 12)
+        for page_size in (0, -1):
+            with self.assertRaises(ValueError):
+                self.db.iter_weather_history(page_size=page_size)
+
+    def test_streams_lazily(self):
+        """必要な分のページだけを取得するかテスト"""
+        statements = []
+        with self.db.connections.read() as conn:
+            conn.set_trace_callback(statements.append)
+        try:
+            rows = self.db.iter_weather_history(page_size=5)
+            self.assertEqual(len(list(itertools.islice(rows, 6))), 6)
+        finally:
+            with self.db.connections.read() as conn:
+                conn.set_trace_callback(None)
+        self.assertEqual(len([sql for sql in statements if 'weather_info' in sql]), 2)
+
+    def test_query_plans_use_indexes(self):
+        """履歴のクエリがインデックス（全地域はカバリングインデックス）を使い、並べ替えをしないかテスト"""
+        with self.db.connections.read() as conn:
+            area = conn.execute("SELECT id, area_name FROM area WHERE area_id = ?", (self.codes[0],)).fetchone()
+
+        # 実際に実行したSQL（パラメーター展開済み）の実行計画を確認する
+        traced = []
+        with self.db.connections.read() as conn:
+            conn.set_trace_callback(traced.append)
+            try:
+                for key in (None, ('2024-01-02T00:00:00+09:00', 10)):
+                    self.db._area_history_page(conn, area, key, 5)
+                    self.db._history_page(conn, key, 5)
+            finally:
+                conn.set_trace_callback(None)
+
+        self.assertEqual(len(traced), 4)
+        for i, sql in enumerate(traced):
+            plan = self.explain(sql)
+            if i % 2 == 0:
+                self.assertIn('USING INDEX idx_weather_info_area_time', plan)
+            else:
+                self.assertIn('COVERING INDEX idx_weather_info_history', plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+            self.assertNotIn('SCAN a', plan)
+
+
+class TestDbMigrations(unittest.TestCase):
+    """スキーマのマイグレーション（PRAGMA user_version）のテストケース"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, 'weather.db')
+
+    def tearDown(self):
+        db_connection.close_all()
+        shutil.rmtree(self.temp_dir)
+
+    def create_legacy_db(self, rows):
+        #変更前の init_database が作っていた temperature 列だけの表
+        conn = sqlite3.connect(self.db_path)
+        conn.executescript("""
+            CREATE TABLE area (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                area_name TEXT NOT NULL,
+                area_id TEXT NOT NULL UNIQUE
+            );
+            CREATE TABLE weather_info (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                time TEXT NOT NULL,
+                temperature REAL,
+                wind TEXT,
+                wave TEXT,
+                rain_proba INTEGER,
+                weather TEXT NOT NULL,
+                area_id INTEGER NOT NULL,
+                FOREIGN KEY (area_id) REFERENCES area(id)
+            );
+            INSERT INTO area (area_name, area_id) VALUES ('テスト地域', '990000');
+        """)
+        conn.executemany(
+            "INSERT INTO weather_info (time, temperature, weather, area_id) VALUES (?, ?, '晴れ', 1)",
+            ((f"2020-01-01T00:00:00+09:00#{i:06d}", float(i % 30)) for i in range(rows)),
+        )
+        conn.commit()
+        conn.close()
+
+    def read(self, sql, params=()):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    def test_fresh_database(self):
+        """新しいDBが最新のスキーマで作られるかテスト"""
+        with quiet():
+            DatabaseService(db_path=self.db_path)
+        db_connection.close_all()
+
+        self.assertEqual(self.read("PRAGMA user_version")[0][0], db_migrations.LATEST_VERSION)
+        names = {row[0] for row in self.read("SELECT name FROM sqlite_master")}
+        self.assertTrue({
+            'area', 'weather_info', 'forecast_validator', 'idx_weather_info_area_time', 'idx_weather_info_history',
+        } <= names)
+        self.assertNotIn('idx_weather_info_area_history', names)
+
+    def test_existing_repo_database(self):
+        """リポジトリのDB（user_version 0）の行を保ったまま最新になるかテスト"""
+        shutil.copy(REPO_DB_PATH, self.db_path)
+        before = self.read("SELECT COUNT(*) FROM weather_info")[0][0]
+        # 画面と同じく init_database を呼ばずに開く（行が少ないため集計・VACUUM もその場で行う）
+        with quiet():
+            db = DatabaseService(db_path=self.db_path)
+        self.assertTrue(db.schema_current)
+        db_connection.close_all()
+
+        self.assertEqual(self.read("PRAGMA user_version")[0][0], db_migrations.LATEST_VERSION)
+        self.assertEqual(self.read("PRAGMA auto_vacuum")[0][0], 2)
+        self.assertEqual(self.read("SELECT COUNT(*) FROM weather_info")[0][0], before)
+
+    def test_view_stops_before_large_rewrite(self):
+        """画面からは行数の多い表の書き換えの手前で止め、別のプロセスで済めば最新と判断するかテスト"""
+        self.create_legacy_db(db_migrations.QUICK_BACKFILL_ROWS + 1)
+        with quiet():
+            db = DatabaseService(db_path=self.db_path)
+        self.assertFalse(db.schema_current)
+        self.assertEqual(self.read("PRAGMA user_version")[0][0], 1)
+
+        # auto_update.py（別のプロセス）がマイグレーションを行う
+        other = db_connection.ConnectionManager(self.db_path)
+        with quiet():
+            db_migrations.migrate(other)
+        other.close()
+        self.assertTrue(db.schema_current)
+
+    def test_view_does_not_vacuum(self):
+        """画面から開いただけでは、行数の多いDBの auto_vacuum の変更（v7 の VACUUM）を行わないかテスト"""
+        self.create_legacy_db(db_migrations.QUICK_BACKFILL_ROWS + 1)
+        manager = db_connection.get_manager(self.db_path)
+        with quiet():
+            db_migrations.migrate(manager, [m for m in db_migrations.MIGRATIONS if m.version <= 6])
+        manager.close()
+
+        with quiet():
+            db = DatabaseService(db_path=self.db_path)
+        self.assertFalse(db.schema_current)
+        self.assertEqual(self.read("PRAGMA user_version")[0][0], 6)
+        self.assertEqual(self.read("PRAGMA auto_vacuum")[0][0], 0)
+
+        with quiet():
+            db.init_database()
+        db_connection.close_all()
+        self.assertEqual(self.read("PRAGMA auto_vacuum")[0][0], 2)
+
+    def test_locked_database(self):
+        """更新中でDBがロックされていても、例外を出さずにスキーマが古い扱いになるかテスト"""
+        shutil.copy(REPO_DB_PATH, self.db_path)
+        db_connection.get_manager(self.db_path).busy_timeout = 100
+        locker = sqlite3.connect(self.db_path, isolation_level=None)
+        locker.execute("BEGIN EXCLUSIVE")
+        try:
+            with quiet():
+                db = DatabaseService(db_path=self.db_path)
+            self.assertFalse(db.schema_current)
+        finally:
+            locker.rollback()
+            locker.close()
+        self.assertEqual(self.read("PRAGMA user_version")[0][0], 0)
+
+        # ロックが外れたあとに開けば、マイグレーションを行う
+        with quiet():
+            db = DatabaseService(db_path=self.db_path)
+        self.assertTrue(db.schema_current)
+
+    def test_batched_rewrite_of_legacy_table(self):
+        """temperature 列の表が小分けにコピーされ、min/max の表に置き換わるかテスト"""
+        self.create_legacy_db(2500)
+        manager = db_connection.get_manager(self.db_path)
+        calls = []
+        with quiet():
+            version = db_migrations.migrate(
+                manager, batch_size=1000,
+                progress=lambda migration, copied, total: calls.append((migration.version, copied, total)),
+            )
+        manager.close()
+
+        self.assertEqual(version, db_migrations.LATEST_VERSION)
+        # v6 は地域ごとの集計（地域は1つ）
+        self.assertEqual(calls, [(2, 1000, 2500), (2, 2000, 2500), (2, 2500, 2500), (6, 1, 1)])
+        columns = [row[1] for row in self.read("PRAGMA table_info(weather_info)")]
+        self.assertIn('min_temperature', columns)
+        self.assertNotIn('temperature', columns)
+        self.assertEqual(
+            self.read("SELECT id, min_temperature, max_temperature FROM weather_info WHERE id = 45"),
+            [(45, 14.0, 14.0)],
+        )
+        self.assertEqual(self.read("SELECT COUNT(*) FROM weather_info")[0][0], 2500)
+        self.assertEqual(self.read("SELECT COUNT(*) FROM schema_backfill")[0][0], 0)
+
+        # AUTOINCREMENT の続きから採番される
+        db = DatabaseService(db_path=self.db_path)
+        db.upsert_weather_data([(1, parse_forecast(make_forecast_json("990000")))])
+        self.assertGreater(self.read("SELECT MIN(id) FROM weather_info WHERE time LIKE '2%+09:00'")[0][0], 2500)
+
+    def test_resume_after_interruption(self):
+        """書き換えが途中で止まっても、次回は続きから再開するかテスト"""
+        self.create_legacy_db(2500)
+        manager = db_connection.get_manager(self.db_path)
+
+        def interrupt(migration, copied, total):
+            if copied >= 2000:
+                raise KeyboardInterrupt
+
+        with quiet(), self.assertRaises(KeyboardInterrupt):
+            db_migrations.migrate(manager, batch_size=1000, progress=interrupt)
+        self.assertEqual(self.read("PRAGMA user_version")[0][0], 1)
+        self.assertEqual(self.read("SELECT last_id, copied FROM schema_backfill"), [(2000, 2000)])
+
+        calls = []
+        with quiet():
+            db_migrations.migrate(
+                manager, batch_size=1000,
+                progress=lambda migration, copied, total: calls.append((migration.version, copied)),
+            )
+        self.assertEqual(calls, [(2, 2500), (6, 1)])
+        self.assertEqual(self.read("SELECT COUNT(*), COUNT(DISTINCT id) FROM weather_info"), [(2500, 2500)])
+
+    def test_writes_during_rewrite_are_kept(self):
+        """書き換え中に古い表へ書き込まれた内容も反映されるかテスト"""
+        self.create_legacy_db(2500)
+        manager = db_connection.get_manager(self.db_path)
+
+        def write_between_batches(migration, copied, total):
+            if copied != 1000:
+                return
+            with manager.write() as conn:
+                # コピー済みの行の更新・削除と、新しい行の追加
+                conn.execute("UPDATE weather_info SET weather = '雨' WHERE id = 10")
+                conn.execute("DELETE FROM weather_info WHERE id = 20")
+                conn.execute("DELETE FROM weather_info WHERE id = 2000")
+                conn.execute(
+                    "INSERT INTO weather_info (time, temperature, weather, area_id) VALUES ('new', 5, '雪', 1)"
+                )
+
+        with quiet():
+            db_migrations.migrate(manager, batch_size=1000, progress=write_between_batches)
+
+        self.assertEqual(self.read("SELECT weather FROM weather_info WHERE id = 10"), [('雨',)])
+        self.assertEqual(self.read("SELECT COUNT(*) FROM weather_info WHERE id IN (20, 2000)"), [(0,)])
+        self.assertEqual(self.read("SELECT max_temperature, weather FROM weather_info WHERE time = 'new'"), [(5.0, '雪')])
+        self.assertEqual(self.read("SELECT COUNT(*) FROM weather_info")[0][0], 2499)
+
+    def test_custom_migration_adds_column(self):
+        """列を追加するマイグレーションが1回だけ適用されるかテスト"""
+        manager = db_connection.get_manager(self.db_path)
+        migrations = db_migrations.MIGRATIONS + (
+            db_migrations.Migration(
+                db_migrations.LATEST_VERSION + 1, "テスト用の列を追加",
+                apply=lambda conn: db_migrations.add_column(conn, 'area', 'note', 'TEXT'),
+            ),
+        )
+        with quiet():
+            self.assertEqual(db_migrations.migrate(manager, migrations), db_migrations.LATEST_VERSION + 1)
+            self.assertEqual(db_migrations.migrate(manager, migrations), db_migrations.LATEST_VERSION + 1)
+
+        with manager.read() as conn:
+            self.assertIn('note', db_migrations.table_columns(conn, 'area'))
+
+        # このアプリより新しいDBはそのまま使う
+        with quiet():
+            self.assertEqual(db_migrations.migrate(manager), db_migrations.LATEST_VERSION + 1)
+
+
+def run_all_tests():
+    """全テストを実行する関数"""
+    loader = unittest.TestLoader()
+    suite = loader.loadTestsFromModule(sys.modules[__name__])
+
+    runner = unittest.TextTestRunner(verbosity=2)
+    result = runner.run(suite)
+
+    print("\n" + "=" * 70)
+    print(f"実行: {result.testsRun}")
+    print(f"成功: {result.testsRun - len(result.failures) - len(result.errors)}")
+    print(f"失敗: {len(result.failures)}")
+    print(f"エラー: {len(result.errors)}")
+    print("=" * 70)
+
+    return result.wasSuccessful()
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    exit(0 if success else 1)
@@ -1,4 +1,5 @@
 import flet as ft
+from services import recorder
 from views.area_list import AreaListView
 from views.weather_detail import WeatherDetailView
 
@@ -78,4 +79,6 @@ def main(page: ft.Page):
 
 
 if __name__ == "__main__":
+    # JMA_RECORD_DIR / JMA_REPLAY_DIR が設定されていれば記録・再生モードで起動
+    recorder.configure_from_env()
     ft.app(main)
\ No newline at end of file
@@ -1,5 +1,11 @@
 #気象庁APIを利用するサービスを提供するパッケージ
 
-from .jma_api import JmaApiService
-
 __all__ = ['JmaApiService']
+
+
+def __getattr__(name):
+    # jma_api は使うときに読み込む（python -m services.jma_api で二重に読み込まないように）
+    if name == 'JmaApiService':
+        from .jma_api import JmaApiService
+        return JmaApiService
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
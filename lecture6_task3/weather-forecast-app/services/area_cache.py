@@ -0,0 +1,165 @@
+# 地域リスト（area.json）のディスクキャッシュ
+
+import json
+import os
+import threading
+import time
+
+from .area_catalog import AreaCatalog
+from .jma_api import JmaApiService, NOT_MODIFIED
+
+
+# キャッシュ形式のバージョン（形式を変えたら上げる。古いキャッシュは読まない）
+CACHE_VERSION = 1
+
+# area.jsonは年に数回しか変わらないため、既定では1日で再検証する
+DEFAULT_TTL = 24 * 60 * 60
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(__file__), '..', 'cache')
+
+
+class AreaCache:
+    """
+    area.json をディスクに保存し、起動時はネットワークを待たずにそこから読み込む
+    TTLを過ぎていれば表示はキャッシュのまま、裏で条件付きGETにより再検証する
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, ttl=DEFAULT_TTL):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.body_path = os.path.join(cache_dir, 'area.json')
+        self.meta_path = os.path.join(cache_dir, 'area.meta.json')
+        self._revalidate_lock = threading.Lock()
+        self._revalidate_thread = None
+
+    def load_meta(self):
+        """キャッシュのメタ情報を読み込む（ないか形式が古ければNone）"""
+        try:
+            with open(self.meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if meta.get('version') != CACHE_VERSION or not os.path.exists(self.body_path):
+            return None
+        return meta
+
+    def load_raw(self):
+        """キャッシュ済みの area.json をバイト列のまま読み込む（なければNone）"""
+        if self.load_meta() is None:
+            return None
+
+        try:
+            with open(self.body_path, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def is_fresh(self, meta=None):
+        """TTL以内に取得（または再検証）されたか"""
+        if meta is None:
+            meta = self.load_meta()
+        return meta is not None and time.time() - meta['fetched_at'] < self.ttl
+
+    def save(self, body, etag=None, last_modified=None):
+        """本文とメタ情報を保存（一時ファイル経由で置き換え、途中で壊れないようにする）"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self._write_atomic(self.body_path, body)
+        self._save_meta(etag, last_modified)
+
+    def _save_meta(self, etag, last_modified):
+        meta = {
+            'version': CACHE_VERSION,
+            'fetched_at': time.time(),
+            'etag': etag,
+            'last_modified': last_modified,
+        }
+        self._write_atomic(self.meta_path, json.dumps(meta).encode('utf-8'))
+
+    def _write_atomic(self, path, data):
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    def revalidate(self):
+        """
+        キャッシュを気象庁APIと照合し、変更があれば保存する
+        新しい本文を保存したときはそれを返し、変更なし・失敗時はNoneを返す
+        """
+        meta = self.load_meta() or {}
+
+        try:
+            result = JmaApiService.fetch_area_list_raw(
+                etag=meta.get('etag'),
+                last_modified=meta.get('last_modified'),
+            )
+        except Exception as e:
+            print(f"地域リストの再検証に失敗: {e}")
+            return None
+
+        if result is NOT_MODIFIED:
+            # 取得時刻だけ更新して次のTTLまで再検証しない
+            self._save_meta(meta.get('etag'), meta.get('last_modified'))
+            return None
+
+        body, etag, last_modified = result
+        self.save(body, etag, last_modified)
+        return body
+
+    def revalidate_in_background(self, on_updated=None):
+        """
+        別スレッドで再検証する（実行中なら何もしない）
+        内容が変わったときは on_updated(本文のバイト列) を呼ぶ
+        """
+        with self._revalidate_lock:
+            if self._revalidate_thread is not None and self._revalidate_thread.is_alive():
+                return self._revalidate_thread
+
+            def run():
+                body = self.revalidate()
+                if body is not None and on_updated:
+                    on_updated(body)
+
+            self._revalidate_thread = threading.Thread(target=run, daemon=True)
+            self._revalidate_thread.start()
+            return self._revalidate_thread
+
+    def get_raw(self, on_updated=None):
+        """
+        area.json をバイト列で取得
+        キャッシュがあれば即座に返し（TTL切れなら裏で再検証）、なければネットワークから取得する
+        """
+        meta = self.load_meta()
+        body = self.load_raw() if meta else None
+
+        if body is None:
+            # 初回起動: キャッシュがないので同期的に取得
+            return self.revalidate()
+
+        if not self.is_fresh(meta):
+            self.revalidate_in_background(on_updated)
+        return body
+
+    def get_catalog(self, on_updated=None):
+        """get_raw の結果を AreaCatalog にして返す（取得できなければNone）"""
+        callback = None
+        if on_updated:
+            callback = lambda body: on_updated(AreaCatalog(body))
+
+        body = self.get_raw(callback)
+        if body is None:
+            return None
+        return AreaCatalog(body)
+
+    def get(self, on_updated=None):
+        """get_raw の結果を辞書に変換して返す（取得できなければNone）"""
+        callback = None
+        if on_updated:
+            callback = lambda body: on_updated(json.loads(body))
+
+        body = self.get_raw(callback)
+        if body is None:
+            return None
+        return json.loads(body)
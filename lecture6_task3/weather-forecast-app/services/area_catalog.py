@@ -0,0 +1,158 @@
+# 地域リスト（area.json）の必要な部分だけを解析するカタログ
+
+import json
+from array import array
+
+
+# area.jsonの階層（上位から順）
+SECTIONS = ('centers', 'offices', 'class10s', 'class15s', 'class20s')
+
+PARENT_SECTION = {
+    'offices': 'centers',
+    'class10s': 'offices',
+    'class15s': 'class10s',
+    'class20s': 'class15s',
+}
+
+_decoder = json.JSONDecoder()
+
+
+class AreaSection:
+    """
+    1つの階層の地域一覧（辞書の入れ子ではなく並列の配列で持つ）
+    - codes / names: 地域コードと名前
+    - parents: 親階層での位置（array('i')、親がなければ -1）
+    """
+
+    __slots__ = ('name', 'codes', 'names', 'parents', 'index', '_children')
+
+    def __init__(self, name, codes, names, parents):
+        self.name = name
+        self.codes = codes
+        self.names = names
+        self.parents = parents
+        # 地域コード -> 位置
+        self.index = {code: i for i, code in enumerate(codes)}
+        self._children = None
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __contains__(self, code):
+        return code in self.index
+
+    def name_of(self, code, default=None):
+        """地域コードから名前を取得"""
+        i = self.index.get(code)
+        return default if i is None else self.names[i]
+
+    def items(self):
+        """(地域コード, 名前) を順に返す"""
+        return zip(self.codes, self.names)
+
+    def children_of(self, parent_position):
+        """親階層の parent_position 番目に属する地域の位置（array('i')）"""
+        if self._children is None:
+            self._build_children()
+        offsets, positions = self._children
+        if parent_position + 1 >= len(offsets):
+            return array('i')
+        return positions[offsets[parent_position]:offsets[parent_position + 1]]
+
+    def _build_children(self):
+        #親ごとに子の位置をまとめる（CSR形式: offsets[i]〜offsets[i+1] が i番目の親の子）
+        parent_count = max(self.parents, default=-1) + 1
+        counts = [0] * (parent_count + 1)
+        for parent in self.parents:
+            if parent >= 0:
+                counts[parent + 1] += 1
+
+        offsets = array('i', [0]) * (parent_count + 1)
+        for i in range(parent_count):
+            offsets[i + 1] = offsets[i] + counts[i + 1]
+
+        positions = array('i', [0]) * offsets[parent_count]
+        cursor = array('i', offsets)
+        for i, parent in enumerate(self.parents):
+            if parent >= 0:
+                positions[cursor[parent]] = i
+                cursor[parent] += 1
+
+        self._children = (offsets, positions)
+
+
+class AreaCatalog:
+    """
+    area.json を階層（centers / offices / class10s ...）ごとに必要になった時だけ解析する
+    使わない class15s / class20s（数千件の市区町村）は解析もメモリ確保もしない
+    """
+
+    def __init__(self, raw):
+        if isinstance(raw, bytes):
+            raw = raw.decode('utf-8')
+        self._text = raw
+        self._sections = {}
+
+    def section(self, name):
+        """階層を取得（初回のみ解析）"""
+        section = self._sections.get(name)
+        if section is None:
+            section = self._load_section(name)
+            self._sections[name] = section
+        return section
+
+    def loaded_sections(self):
+        """解析済みの階層名"""
+        return tuple(name for name in SECTIONS if name in self._sections)
+
+    def children(self, section_name, code):
+        """指定した地域に属する下位の地域を (地域コード, 名前) のリストで返す"""
+        parent = self.section(section_name)
+        position = parent.index.get(code)
+        child_name = SECTIONS[SECTIONS.index(section_name) + 1]
+        child = self.section(child_name)
+        if position is None:
+            return []
+        return [(child.codes[i], child.names[i]) for i in child.children_of(position)]
+
+    def _load_section(self, name):
+        if name not in SECTIONS:
+            raise KeyError(name)
+
+        data = self._decode_section(name)
+
+        parent_name = PARENT_SECTION.get(name)
+        parent_index = self.section(parent_name).index if parent_name else {}
+
+        codes = list(data)
+        names = [data[code].get('name', '') for code in codes]
+        parents = array('i', (parent_index.get(data[code].get('parent'), -1) for code in codes))
+        return AreaSection(name, codes, names, parents)
+
+    def _decode_section(self, name):
+        #"name": { ... } の部分だけを解析する
+        text = self._text
+        key = f'"{name}"'
+        start = text.find(key)
+
+        while start != -1:
+            # キーの位置か（直前が { か ,、直後が :）を確認
+            # area.jsonでは階層名が入れ子の中にキーとして現れることはない
+            before = start - 1
+            while before >= 0 and text[before] in ' \t\r\n':
+                before -= 1
+            after = self._skip_space(start + len(key))
+            if before >= 0 and text[before] in '{,' and text[after:after + 1] == ':':
+                value, _ = _decoder.raw_decode(text, self._skip_space(after + 1))
+                if isinstance(value, dict):
+                    return value
+            start = text.find(key, start + 1)
+
+        # 見つからない場合は全体を解析する
+        return json.loads(text).get(name, {})
+
+    def _skip_space(self, position):
+        text = self._text
+        while position < len(text) and text[position] in ' \t\r\n':
+            position += 1
+        return position
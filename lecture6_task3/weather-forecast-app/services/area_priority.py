@@ -0,0 +1,61 @@
+# 画面で開かれた回数に応じた、自動更新で取得する地域の優先順位
+
+from datetime import datetime, timedelta
+
+from .publication import JST
+
+
+# この日数以内に開かれた地域は hot（毎回最初に取得する）
+HOT_DAYS = 7
+
+# この日数以内に開かれた地域は warm（hot の次に、前回の取得が古い順に取得する）
+WARM_DAYS = 30
+
+TIERS = ('hot', 'warm', 'cold')
+
+
+def tier_of(last_viewed_at, now):
+    """最後に開かれた時刻（datetime。なければ None）から優先度の段階を返す"""
+    if last_viewed_at is None:
+        return 'cold'
+    age = now - last_viewed_at
+    if age <= timedelta(days=HOT_DAYS):
+        return 'hot'
+    if age <= timedelta(days=WARM_DAYS):
+        return 'warm'
+    return 'cold'
+
+
+def prioritize(codes, view_stats, now=None, budget=None, skip_cold=False):
+    """
+    取得する地域コードを優先順に並べ、(取得する地域コード, {段階: 地域数}, {段階: 省略した地域数}) を返す
+    - view_stats: {地域コード: (開かれた回数, 最後に開かれた時刻, 最後に取得した時刻)}
+    - hot は開かれた回数の多い順、warm・cold は前回の取得が古い順（予算で省略された地域が次回先になる）
+    - skip_cold: cold の地域は取得しない（画面で開いたときに取得する）
+    - budget: 1回に取得する地域の上限（None・0なら上限なし）。超えた分は優先度の低い方から省略する
+    """
+    now = now or datetime.now(JST)
+    oldest = datetime.min.replace(tzinfo=JST)
+    tiers = {tier: [] for tier in TIERS}
+    for code in codes:
+        views, last_viewed_at, refreshed_at = view_stats.get(code, (0, None, None))
+        tiers[tier_of(last_viewed_at, now)].append((code, views, refreshed_at or oldest))
+
+    tiers['hot'].sort(key=lambda area: -area[1])
+    for tier in ('warm', 'cold'):
+        tiers[tier].sort(key=lambda area: (area[2], -area[1]))
+
+    counts = {tier: len(areas) for tier, areas in tiers.items()}
+    skipped = dict.fromkeys(TIERS, 0)
+    if skip_cold:
+        skipped['cold'] = counts['cold']
+        tiers['cold'] = []
+
+    selected = []
+    for tier in TIERS:
+        for code, _, _ in tiers[tier]:
+            if budget and len(selected) >= budget:
+                skipped[tier] += 1
+            else:
+                selected.append(code)
+    return selected, counts, skipped
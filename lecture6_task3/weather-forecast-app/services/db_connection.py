@@ -0,0 +1,153 @@
+# SQLiteの接続管理（書き込み用1本 + スレッドごとの読み込み用、WALモード）
+
+import atexit
+import contextlib
+import os
+import sqlite3
+import threading
+
+
+# ロック待ちの上限（ミリ秒）。WALでは読み込みは書き込みを待たないが、書き込み同士は待つ
+DEFAULT_BUSY_TIMEOUT = 5000
+
+# WALではチェックポイント時以外にfsyncしないNORMALで十分（電源断で直近のコミットが失われるだけ）
+DEFAULT_SYNCHRONOUS = 'NORMAL'
+
+# DBファイルをメモリにマップして読み込む上限（バイト）
+DEFAULT_MMAP_SIZE = 64 * 1024 * 1024
+
+
+class ConnectionManager:
+    """
+    1つのDBファイルへの接続を使い回す
+    - 書き込み: 接続1本をロックで順番に使う（SQLiteの書き込みは同時に1つだけのため）
+    - 読み込み: スレッドごとに1本（WALなので書き込み中でも待たずに読める）
+    close() で閉じても、次に使うときに開き直す
+    """
+
+    def __init__(self, db_path, busy_timeout=DEFAULT_BUSY_TIMEOUT,
+                 synchronous=DEFAULT_SYNCHRONOUS, mmap_size=DEFAULT_MMAP_SIZE):
+        self.db_path = db_path
+        self.busy_timeout = busy_timeout
+        self.synchronous = synchronous
+        self.mmap_size = mmap_size
+
+        self._writer = None
+        self._write_lock = threading.RLock()
+        self._write_depth = 0
+        # スレッドID -> 読み込み用接続
+        self._readers = {}
+        self._readers_lock = threading.Lock()
+        # マイグレーション済みのスキーマのバージョン（DatabaseService が設定する）
+        self.schema_version = None
+
+    def _connect(self):
+        # 閉じるときは別スレッドから close() するため check_same_thread=False にする
+        # （読み込み用は作ったスレッドでしか使わない）
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout / 1000,
+            check_same_thread=False,
+        )
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout)}")
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute(f"PRAGMA synchronous = {self.synchronous}")
+        conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        return conn
+
+    @contextlib.contextmanager
+    def write(self):
+        """
+        書き込み用の接続を取得（ブロックを抜けるとコミット、例外ならロールバック）
+        同じスレッドからの入れ子は外側のトランザクションにまとめる
+        """
+        with self._write_lock:
+            if self._writer is None:
+                self._writer = self._connect()
+            conn = self._writer
+
+            if self._write_depth > 0:
+                # 入れ子: コミットは外側に任せる
+                yield conn
+                return
+
+            self._write_depth += 1
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                self._write_depth -= 1
+
+    @contextlib.contextmanager
+    def read(self):
+        """このスレッドの読み込み用の接続を取得"""
+        conn = self._reader()
+        try:
+            yield conn
+        finally:
+            # 読み込みのトランザクションを残すとWALのチェックポイントが進まない
+            if conn.in_transaction:
+                conn.rollback()
+
+    def _reader(self):
+        thread_id = threading.get_ident()
+        with self._readers_lock:
+            conn = self._readers.get(thread_id)
+            if conn is not None:
+                return conn
+
+            # 終了したスレッドの接続を片付ける
+            alive = {thread.ident for thread in threading.enumerate()}
+            for dead_id in [key for key in self._readers if key not in alive]:
+                self._readers.pop(dead_id).close()
+
+            conn = self._connect()
+            conn.execute("PRAGMA query_only = ON")
+            self._readers[thread_id] = conn
+            return conn
+
+    def reader_count(self):
+        with self._readers_lock:
+            return len(self._readers)
+
+    def close(self):
+        """すべての接続を閉じる（WALの内容はDB本体に書き戻される）"""
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+        with self._readers_lock:
+            readers = list(self._readers.values())
+            self._readers.clear()
+        for conn in readers:
+            conn.close()
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_manager(db_path):
+    """DBファイルごとに共有する ConnectionManager を取得"""
+    key = os.path.abspath(db_path)
+    with _managers_lock:
+        manager = _managers.get(key)
+        if manager is None:
+            manager = ConnectionManager(key)
+            _managers[key] = manager
+        return manager
+
+
+def close_all():
+    """すべての ConnectionManager の接続を閉じる（終了時に自動で呼ばれる）"""
+    with _managers_lock:
+        managers = list(_managers.values())
+    for manager in managers:
+        manager.close()
+
+
+atexit.register(close_all)
@@ -0,0 +1,136 @@
+# weather.db の保守（古い行の削除と空き領域の返却）
+
+import os
+import time
+from datetime import datetime, timedelta
+
+from . import weather_rollup
+from .db_migrations import _begin
+from .publication import JST
+
+
+# 元の行（weather_info）を残す日数。それより古い日は日別・月別の集計だけ残す
+DEFAULT_RETENTION_DAYS = 365
+
+# 1回のトランザクションで削除する行数（その間は他の書き込みを待たせる）
+DEFAULT_DELETE_BATCH = 2000
+
+# 1回のトランザクションで返却するページ数
+DEFAULT_VACUUM_PAGES = 1000
+
+
+def _file_size(path):
+    # WALの内容もまだDB本体に書き戻されていないため合わせて数える
+    return sum(
+        os.path.getsize(name) for name in (path, path + '-wal') if os.path.exists(name)
+    )
+
+
+def _page_bytes(conn):
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    return page_size, page_count * page_size
+
+
+def purge_old_rows(manager, retention_days, batch_size=DEFAULT_DELETE_BATCH, now=None):
+    """
+    retention_days 日より前（日本時間の日付）の weather_info を batch_size 行ずつ削除する
+    削除する日の集計がなければ、消す前に日別・月別に集計する
+    古い予報の指紋・検証子も消す（残すと、同じ予報を受け取っても行を保存し直さないため）
+    自動更新の古い発表時刻・終わった回の記録も消す
+    (削除した行数, 集計した日数, 削除した指紋・検証子・記録の数) を返す
+    """
+    if retention_days < 1:
+        raise ValueError(f"retention_days は1以上: {retention_days}")
+
+    now = now.astimezone(JST) if now else datetime.now(JST)
+    cutoff = (now - timedelta(days=retention_days)).date().isoformat()
+
+    deleted = 0
+    rolled_up = 0
+    while True:
+        # 1回分ずつコミットして、その間も画面や自動更新が書き込めるようにする
+        with manager.write() as conn:
+            _begin(conn)
+            rows = conn.execute("""
+                SELECT id, area_id, time FROM weather_info
+                WHERE time < ?
+                ORDER BY time, id
+                LIMIT ?
+            """, (cutoff, batch_size)).fetchall()
+            if not rows:
+                break
+
+            rolled_up += weather_rollup.fill_missing(conn, [(area_db_id, time) for _, area_db_id, time in rows])
+            conn.executemany("DELETE FROM weather_info WHERE id = ?", [(row[0],) for row in rows])
+            deleted += len(rows)
+
+    with manager.write() as conn:
+        _begin(conn)
+        changes_before = conn.total_changes
+        conn.execute("DELETE FROM forecast_fingerprint WHERE report_datetime < ?", (cutoff,))
+        conn.execute("DELETE FROM forecast_validator WHERE updated_at < ?", (cutoff,))
+        # 最後に取得を終えた発表は残す（消すと次の起動で取り直す発表が分からなくなる）
+        conn.execute("""
+            DELETE FROM update_slot
+            WHERE slot < ? AND slot < (SELECT MAX(slot) FROM update_slot WHERE completed_at IS NOT NULL)
+        """, (cutoff,))
+        old_runs = "SELECT id FROM update_run WHERE started_at < ? AND completed_at IS NOT NULL"
+        conn.execute(f"DELETE FROM update_run_area WHERE run_id IN ({old_runs})", (cutoff,))
+        conn.execute(f"DELETE FROM update_run WHERE id IN ({old_runs})", (cutoff,))
+        cleared = conn.total_changes - changes_before
+
+    return deleted, rolled_up, cleared
+
+
+def reclaim_space(manager, pages=DEFAULT_VACUUM_PAGES):
+    """
+    空きページを pages ページずつDBファイルから返却し、返却したバイト数を返す
+    （auto_vacuum=INCREMENTAL のDBのみ。それ以外では何もしない）
+    """
+    with manager.write() as conn:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return 0
+        _, before = _page_bytes(conn)
+
+    while True:
+        with manager.write() as conn:
+            if conn.execute("PRAGMA freelist_count").fetchone()[0] == 0:
+                break
+            # 結果を読み切らないと1ページずつしか進まない
+            conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+
+    with manager.write() as conn:
+        _, after = _page_bytes(conn)
+        # WALの内容をDB本体に書き戻してファイルを縮める（読み込み中なら次回に持ち越す）
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+    return before - after
+
+
+def run_maintenance(manager, retention_days=DEFAULT_RETENTION_DAYS,
+                    batch_size=DEFAULT_DELETE_BATCH, vacuum_pages=DEFAULT_VACUUM_PAGES, now=None):
+    """
+    古い行の削除と空き領域の返却を行い、結果を辞書で返す
+    retention_days が None（または0）なら行は削除せず、空き領域の返却だけ行う
+    - deleted_rows / rolled_up_days / cleared_fingerprints
+    - reclaimed_bytes: DBのページ数の減少分
+    - size_before / size_after: DBファイル（WALを含む）のサイズ
+    - elapsed: 所要時間（秒）
+    """
+    start = time.perf_counter()
+    size_before = _file_size(manager.db_path)
+
+    deleted, rolled_up, cleared = 0, 0, 0
+    if retention_days:
+        deleted, rolled_up, cleared = purge_old_rows(manager, retention_days, batch_size, now)
+    reclaimed = reclaim_space(manager, vacuum_pages)
+
+    return {
+        'deleted_rows': deleted,
+        'rolled_up_days': rolled_up,
+        'cleared_fingerprints': cleared,
+        'reclaimed_bytes': reclaimed,
+        'size_before': size_before,
+        'size_after': _file_size(manager.db_path),
+        'elapsed': time.perf_counter() - start,
+    }
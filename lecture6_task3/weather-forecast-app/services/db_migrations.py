@@ -0,0 +1,480 @@
+# weather.db のスキーマのバージョン管理（PRAGMA user_version）
+
+import time
+
+from . import weather_rollup
+
+
+# 表の書き換えで1回のトランザクションにコピーする行数
+DEFAULT_BATCH_SIZE = 5000
+
+# backfill=False（画面）でも行う、表の書き換えの行数の上限（この程度なら一瞬で終わる）
+QUICK_BACKFILL_ROWS = 10000
+
+
+class Migration:
+    """
+    1つのバージョンへの変更
+    - apply(conn): 1つのトランザクションで行う変更（列・インデックス・表の追加など）
+    - backfill(manager, batch_size, progress): 小分けにコミットしながら行う表の書き換え
+      途中で止まっても、次回は続きから再開できるように書く
+    - estimate(conn): backfill で処理する行数の見積もり（書き換えが不要なら 0）
+    """
+
+    __slots__ = ('version', 'description', 'apply', 'backfill', 'estimate')
+
+    def __init__(self, version, description, apply=None, backfill=None, estimate=None):
+        self.version = version
+        self.description = description
+        self.apply = apply
+        self.backfill = backfill
+        self.estimate = estimate
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def table_columns(conn, table):
+    """表の列名（表がなければ空）"""
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def add_column(conn, table, column, definition):
+    """列がなければ追加する（ALTER TABLE ... ADD COLUMN は表を書き換えないので速い）"""
+    if column not in table_columns(conn, table):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def _begin(conn):
+    # sqlite3モジュールはDDLの前にトランザクションを始めないため明示的に始める
+    # IMMEDIATE: 途中で他の書き込みに割り込まれないよう最初に書き込みロックを取る
+    if not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE")
+
+
+# ---- v1: 基本の表 ----
+
+def _create_base_tables(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS area (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            area_name TEXT NOT NULL,
+            area_id TEXT NOT NULL UNIQUE
+        )
+    """)
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS weather_info (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            time TEXT NOT NULL,
+            min_temperature REAL,
+            max_temperature REAL,
+            wind TEXT,
+            wave TEXT,
+            rain_proba INTEGER,
+            weather TEXT NOT NULL,
+            area_id INTEGER NOT NULL,
+            FOREIGN KEY (area_id) REFERENCES area(id)
+        )
+    """)
+
+    # 条件付きGET用の検証子（ETag / Last-Modified）
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS forecast_validator (
+            area_id TEXT PRIMARY KEY,
+            etag TEXT,
+            last_modified TEXT,
+            content_length INTEGER,
+            updated_at TEXT NOT NULL
+        )
+    """)
+
+    # 小分けの書き換えの進み具合（再開用）
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_backfill (
+            version INTEGER PRIMARY KEY,
+            last_id INTEGER NOT NULL,
+            copied INTEGER NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    """)
+
+
+# ---- v2: temperature 列だけの古い weather_info を min/max の表に書き換える ----
+
+_WEATHER_INFO_V2 = """
+    CREATE TABLE IF NOT EXISTS weather_info_v2 (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        time TEXT NOT NULL,
+        min_temperature REAL,
+        max_temperature REAL,
+        wind TEXT,
+        wave TEXT,
+        rain_proba INTEGER,
+        weather TEXT NOT NULL,
+        area_id INTEGER NOT NULL,
+        FOREIGN KEY (area_id) REFERENCES area(id)
+    )
+"""
+
+# 書き換え中に古い表へ書き込まれた行も新しい表に反映する
+_WEATHER_INFO_V2_TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS weather_info_v2_insert AFTER INSERT ON weather_info BEGIN
+        INSERT OR REPLACE INTO weather_info_v2
+        (id, time, min_temperature, max_temperature, wind, wave, rain_proba, weather, area_id)
+        VALUES (NEW.id, NEW.time, NEW.temperature, NEW.temperature, NEW.wind, NEW.wave,
+                NEW.rain_proba, NEW.weather, NEW.area_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS weather_info_v2_update AFTER UPDATE ON weather_info BEGIN
+        INSERT OR REPLACE INTO weather_info_v2
+        (id, time, min_temperature, max_temperature, wind, wave, rain_proba, weather, area_id)
+        VALUES (NEW.id, NEW.time, NEW.temperature, NEW.temperature, NEW.wind, NEW.wave,
+                NEW.rain_proba, NEW.weather, NEW.area_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS weather_info_v2_delete AFTER DELETE ON weather_info BEGIN
+        DELETE FROM weather_info_v2 WHERE id = OLD.id;
+    END
+    """,
+)
+
+
+def _needs_rewrite(columns):
+    # 新しい表のまま（または書き換え済み）なら False
+    return 'temperature' in columns and 'min_temperature' not in columns
+
+
+def _estimate_rewrite(conn):
+    if not _needs_rewrite(table_columns(conn, 'weather_info')):
+        return 0
+    return conn.execute("SELECT COUNT(*) FROM weather_info").fetchone()[0]
+
+
+def _rewrite_weather_info(manager, batch_size, progress):
+    """
+    temperature 列の weather_info を新しい表へ batch_size 行ずつコピーして置き換える
+    古い temperature は1日の最低・最高の区別がないため、両方に同じ値を入れる
+    """
+    with manager.write() as conn:
+        if not _needs_rewrite(table_columns(conn, 'weather_info')):
+            return
+
+        _begin(conn)
+        conn.execute(_WEATHER_INFO_V2)
+        for trigger in _WEATHER_INFO_V2_TRIGGERS:
+            conn.execute(trigger)
+        conn.execute(
+            "INSERT OR IGNORE INTO schema_backfill (version, last_id, copied, updated_at) VALUES (2, 0, 0, ?)",
+            (time.time(),),
+        )
+        total = conn.execute("SELECT COUNT(*) FROM weather_info").fetchone()[0]
+
+    while True:
+        # 1回分ずつコミットして、その間は他の書き込みを待たせない
+        with manager.write() as conn:
+            _begin(conn)
+            last_id, copied = conn.execute(
+                "SELECT last_id, copied FROM schema_backfill WHERE version = 2"
+            ).fetchone()
+            batch_last_id, count = conn.execute("""
+                SELECT MAX(id), COUNT(*) FROM (
+                    SELECT id FROM weather_info WHERE id > ? ORDER BY id LIMIT ?
+                )
+            """, (last_id, batch_size)).fetchone()
+            if count == 0:
+                break
+
+            # トリガーで先に入った行の方が新しいので上書きしない
+            conn.execute("""
+                INSERT OR IGNORE INTO weather_info_v2
+                (id, time, min_temperature, max_temperature, wind, wave, rain_proba, weather, area_id)
+                SELECT id, time, temperature, temperature, wind, wave, rain_proba, weather, area_id
+                FROM weather_info
+                WHERE id > ? AND id <= ?
+            """, (last_id, batch_last_id))
+            copied += count
+            conn.execute(
+                "UPDATE schema_backfill SET last_id = ?, copied = ?, updated_at = ? WHERE version = 2",
+                (batch_last_id, copied, time.time()),
+            )
+
+        if progress:
+            progress(copied, total)
+
+    # 最後に短いトランザクションで表を入れ替える
+    with manager.write() as conn:
+        _begin(conn)
+        for name in ('insert', 'update', 'delete'):
+            conn.execute(f"DROP TRIGGER IF EXISTS weather_info_v2_{name}")
+        conn.execute("DROP TABLE weather_info")
+        conn.execute("ALTER TABLE weather_info_v2 RENAME TO weather_info")
+        conn.execute("DELETE FROM schema_backfill WHERE version = 2")
+
+
+# ---- v3: (area_id, time) の一意インデックス ----
+
+def _create_weather_unique_index(conn):
+    if conn.execute("""
+        SELECT 1 FROM sqlite_master
+        WHERE type = 'index' AND name = 'idx_weather_info_area_time'
+    """).fetchone():
+        return
+
+    # 重複があれば、最後に保存した行（idが最大）を残す
+    conn.execute("""
+        DELETE FROM weather_info
+        WHERE id NOT IN (
+            SELECT MAX(id) FROM weather_info GROUP BY area_id, time
+        )
+    """)
+    conn.execute("""
+        CREATE UNIQUE INDEX idx_weather_info_area_time
+        ON weather_info (area_id, time)
+    """)
+
+
+# ---- v4: 全地域の履歴表示用のカバリングインデックス ----
+
+def _create_history_indexes(conn):
+    # 表を読まずにインデックスだけで取得できるよう、表示する列も含める
+    # 地域ごとの履歴は (area_id, time) の一意インデックスで足りる（全列を持つインデックスは保存のたびに同じだけ書き込む）
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_weather_info_history
+        ON weather_info (time, id, area_id, weather, min_temperature, max_temperature, wind, wave, rain_proba)
+    """)
+
+
+# ---- v5: 地域ごとに前回保存した予報の指紋 ----
+
+def _create_forecast_fingerprint(conn):
+    # 同じ reportDatetime・同じ内容の予報は保存を省略する
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS forecast_fingerprint (
+            area_id INTEGER PRIMARY KEY,
+            report_datetime TEXT,
+            content_hash TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            FOREIGN KEY (area_id) REFERENCES area(id)
+        )
+    """)
+
+
+# ---- v6: 日別・月別の集計表 ----
+
+def _estimate_rollups(conn):
+    # 集計は weather_info の行をすべて読む
+    return conn.execute("SELECT COUNT(*) FROM weather_info").fetchone()[0]
+
+
+def _build_rollups(manager, batch_size, progress):
+    """
+    既存の weather_info から地域ごとに集計表を作る（1地域ずつコミット）
+    以降は upsert のたびに保存した日・月だけ集計し直す
+    """
+    with manager.write() as conn:
+        _begin(conn)
+        weather_rollup.create_tables(conn)
+        conn.execute(
+            "INSERT OR IGNORE INTO schema_backfill (version, last_id, copied, updated_at) VALUES (6, 0, 0, ?)",
+            (time.time(),),
+        )
+        total = conn.execute("SELECT COUNT(DISTINCT area_id) FROM weather_info").fetchone()[0]
+
+    while True:
+        with manager.write() as conn:
+            _begin(conn)
+            last_id, copied = conn.execute(
+                "SELECT last_id, copied FROM schema_backfill WHERE version = 6"
+            ).fetchone()
+            row = conn.execute(
+                "SELECT MIN(area_id) FROM weather_info WHERE area_id > ?", (last_id,)
+            ).fetchone()
+            if row[0] is None:
+                conn.execute("DELETE FROM schema_backfill WHERE version = 6")
+                break
+
+            weather_rollup.refresh_area(conn, row[0])
+            copied += 1
+            conn.execute(
+                "UPDATE schema_backfill SET last_id = ?, copied = ?, updated_at = ? WHERE version = 6",
+                (row[0], copied, time.time()),
+            )
+
+        if progress:
+            progress(copied, total)
+
+
+# ---- v7: 削除した行の領域を少しずつ返せるようにする ----
+
+def _estimate_vacuum(conn):
+    # VACUUM はDB全体を書き直す。大半は weather_info なので、その行数で見積もる
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return 0
+    return conn.execute("SELECT COUNT(*) FROM weather_info").fetchone()[0]
+
+
+def _enable_incremental_vacuum(manager, batch_size, progress):
+    """
+    auto_vacuum=INCREMENTAL に切り替える（既存のDBでは VACUUM で作り直す必要がある）
+    VACUUM はトランザクションの外でしか実行できないため、ここで行う
+    """
+    with manager.write() as conn:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+
+
+# ---- v8: 自動更新で取得を終えた発表時刻 ----
+
+def _create_update_slot(conn):
+    # 止まっていた間に過ぎた発表を、起動時に取り直すために使う
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS update_slot (
+            slot TEXT PRIMARY KEY,
+            started_at TEXT NOT NULL,
+            completed_at TEXT,
+            areas INTEGER NOT NULL DEFAULT 0,
+            errors INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+
+
+# ---- v9: 地域ごとの画面で開かれた回数（自動更新の優先順位に使う） ----
+
+def _create_area_view_stats(conn):
+    # area_id は地域コード（area.id ではない。まだ保存していない地域も開かれうるため）
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS area_view_stats (
+            area_id TEXT PRIMARY KEY,
+            view_count INTEGER NOT NULL DEFAULT 0,
+            last_viewed_at TEXT,
+            refreshed_at TEXT
+        )
+    """)
+
+
+# ---- v10: 自動更新の1回分の記録（中断した回の再開用） ----
+
+def _create_update_run(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS update_run (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            slot TEXT,
+            started_at TEXT NOT NULL,
+            completed_at TEXT,
+            areas INTEGER NOT NULL
+        )
+    """)
+    # area_id は地域コード、position は取得する順番
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS update_run_area (
+            run_id INTEGER NOT NULL,
+            area_id TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            updated_at TEXT,
+            PRIMARY KEY (run_id, area_id),
+            FOREIGN KEY (run_id) REFERENCES update_run(id)
+        ) WITHOUT ROWID
+    """)
+
+
+# ---- v11: 自動更新の回・地域ごとの計測値 ----
+
+_UPDATE_RUN_AREA_METRICS = (
+    ('fetch_seconds', 'REAL NOT NULL DEFAULT 0'),
+    ('bytes', 'INTEGER NOT NULL DEFAULT 0'),
+    ('http_retries', 'INTEGER NOT NULL DEFAULT 0'),
+    ('status_code', 'INTEGER'),
+    ('parse_seconds', 'REAL NOT NULL DEFAULT 0'),
+    ('write_seconds', 'REAL NOT NULL DEFAULT 0'),
+    ('rows_inserted', 'INTEGER NOT NULL DEFAULT 0'),
+    ('rows_updated', 'INTEGER NOT NULL DEFAULT 0'),
+    ('rows_unchanged', 'INTEGER NOT NULL DEFAULT 0'),
+)
+
+
+def _add_update_run_metrics(conn):
+    # 中断して再開した回は、それぞれの実行の時間を足す
+    add_column(conn, 'update_run', 'elapsed', 'REAL NOT NULL DEFAULT 0')
+    for column, definition in _UPDATE_RUN_AREA_METRICS:
+        add_column(conn, 'update_run_area', column, definition)
+
+
+# 追加するときは末尾に、次の番号で足す（既存のものは変更しない）
+MIGRATIONS = (
+    Migration(1, "基本の表を作成", apply=_create_base_tables),
+    Migration(2, "weather_info の temperature を min/max_temperature に置き換え", backfill=_rewrite_weather_info,
+              estimate=_estimate_rewrite),
+    Migration(3, "weather_info に (area_id, time) の一意インデックスを追加", apply=_create_weather_unique_index),
+    Migration(4, "履歴表示用のインデックスを追加", apply=_create_history_indexes),
+    Migration(5, "前回保存した予報の指紋の表を追加", apply=_create_forecast_fingerprint),
+    Migration(6, "日別・月別の集計表を追加", apply=weather_rollup.create_tables, backfill=_build_rollups,
+              estimate=_estimate_rollups),
+    Migration(7, "auto_vacuum を INCREMENTAL に変更", backfill=_enable_incremental_vacuum, estimate=_estimate_vacuum),
+    Migration(8, "自動更新の発表時刻ごとの記録の表を追加", apply=_create_update_slot),
+    Migration(9, "地域ごとの閲覧回数の表を追加", apply=_create_area_view_stats),
+    Migration(10, "自動更新の回ごとの記録の表を追加", apply=_create_update_run),
+    Migration(11, "自動更新の計測値の列を追加", apply=_add_update_run_metrics),
+)
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def migrate(manager, migrations=MIGRATIONS, batch_size=DEFAULT_BATCH_SIZE, progress=None, backfill=True):
+    """
+    未適用のマイグレーションを順に適用し、適用後のバージョンを返す
+    progress(migration, copied, total) は表の書き換え中に呼ばれる
+    backfill=False なら、表の書き換え（backfill）が QUICK_BACKFILL_ROWS 行を超えるマイグレーションの手前で止める
+    （画面から使う場合。見積もりのない backfill は常に止める）
+    """
+    with manager.write() as conn:
+        current = schema_version(conn)
+
+    latest = migrations[-1].version if migrations else 0
+    if current > latest:
+        print(f"DBのスキーマ（v{current}）がこのアプリ（v{latest}）より新しいため、そのまま使います")
+        return current
+
+    for migration in migrations:
+        if migration.version <= current:
+            continue
+
+        if migration.backfill and not backfill and not _is_quick(manager, migration):
+            print(f"DBのマイグレーション v{migration.version}（{migration.description}）は時間がかかるため、"
+                  f"auto_update.py で行ってください")
+            break
+
+        print(f"DBのマイグレーション v{migration.version}: {migration.description}")
+        if migration.backfill:
+            callback = None
+            if progress:
+                callback = lambda copied, total, migration=migration: progress(migration, copied, total)
+            migration.backfill(manager, batch_size, callback)
+
+        # 変更とバージョンの更新は同じトランザクションで行う（途中で失敗したら何も変わらない）
+        with manager.write() as conn:
+            _begin(conn)
+            if migration.apply:
+                migration.apply(conn)
+            conn.execute(f"PRAGMA user_version = {int(migration.version)}")
+        current = migration.version
+
+    return current
+
+
+def _is_quick(manager, migration):
+    #backfill がすぐ終わる（書き換えがない・行が少ない）か
+    if migration.estimate is None:
+        return False
+    # 読み込み用の接続は VACUUM の前の auto_vacuum を覚えてしまうため、書き込み用で確かめる
+    with manager.write() as conn:
+        return migration.estimate(conn) <= QUICK_BACKFILL_ROWS
@@ -1,221 +1,478 @@
+import itertools
 import sqlite3
 import os
+import threading
+from datetime import datetime, timedelta
+
+from . import db_maintenance, weather_archive, weather_rollup
+from .db_connection import get_manager
+from .db_migrations import LATEST_VERSION, migrate, schema_version
+from .forecast_model import ForecastBundle, parse_forecast, rows_hash
+from .publication import JST
+
+
+# 履歴として返す列（area.id・時刻以外）
+HISTORY_COLUMNS = 'weather, min_temperature, max_temperature, wind, wave, rain_proba'
+
+DEFAULT_PAGE_SIZE = 100
+
+# マイグレーションを同時に1つだけ行う（各マイグレーションは自分でコミットするため書き込みのロックとは別）
+_schema_lock = threading.Lock()
 
 
 class DatabaseService:
     def __init__(self, db_path='../weather.db'):
         self.db_path = os.path.join(os.path.dirname(__file__), db_path)
+        # 同じDBファイルのサービス同士で接続を共有する（WALモード）
+        self.connections = get_manager(self.db_path)
+        # init_database を呼ばずに使う場合（画面）に備え、最初に使うときに軽いマイグレーションだけ行う
+        self._ensure_schema()
+    
+    @property
+    def schema_current(self):
+        """スキーマが最新なら True（False なら auto_update.py で init_database を行うまで保存・履歴は使えない）"""
+        # 別のプロセス（auto_update.py）がマイグレーションを済ませた場合に備え、毎回DBから読む
+        try:
+            with self.connections.read() as conn:
+                version = schema_version(conn)
+        except sqlite3.Error as e:
+            print(f"DBのスキーマの確認エラー: {e}")
+            return False
+        return version >= LATEST_VERSION
+    
+    def close(self):
+        """接続を閉じる（次に使うときは開き直す）"""
+        self.connections.close()
     
-    def get_connection(self):
-        return sqlite3.connect(self.db_path)
+    def _ensure_schema(self):
+        #このDBファイルに対して初めて使うときだけマイグレーションを確認する
+        #行数の多い表の書き換え・VACUUM（auto_vacuum の変更）は時間がかかり、その間DBを占有するため行わない
+        #失敗しても例外は出さず、schema_current が False のままになる
+        manager = self.connections
+        if manager.schema_version is not None:
+            return
+        with _schema_lock:
+            if manager.schema_version is not None:
+                return
+            try:
+                manager.schema_version = migrate(manager, backfill=False)
+            except sqlite3.Error as e:
+                # 更新中でDBがロックされているときなど。画面は開けるようにし、次に開くときに確かめ直す
+                print(f"DBのスキーマの確認エラー: {e}")
     
     def init_database(self):
-        conn = self.get_connection()
-        cur = conn.cursor()
-        
+        """スキーマを最新にする（未適用のマイグレーションを適用）"""
         try:
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS area (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    area_name TEXT NOT NULL,
-                    area_id TEXT NOT NULL UNIQUE
-                )
-            """)
-            
-            # weather_infoテーブルを作成
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS weather_info (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    time TEXT NOT NULL,
-                    temperature REAL,
-                    wind TEXT,
-                    wave TEXT,
-                    rain_proba INTEGER,
-                    weather TEXT NOT NULL,
-                    area_id INTEGER NOT NULL,
-                    FOREIGN KEY (area_id) REFERENCES area(id)
-                )
-            """)
-            
-            conn.commit()
+            self.connections.schema_version = migrate(
+                self.connections,
+                progress=lambda migration, copied, total: print(f"  {copied:,} / {total:,}件"),
+            )
             print("データベースを初期化しました")
             
         except Exception as e:
             print(f"データベース初期化エラー: {e}")
-        finally:
-            conn.close()
+    
+    def run_maintenance(self, retention_days=db_maintenance.DEFAULT_RETENTION_DAYS, **options):
+        """古い行の削除と空き領域の返却（db_maintenance.run_maintenance を参照）"""
+        return db_maintenance.run_maintenance(self.connections, retention_days, **options)
+    
+    def export_archive(self, directory, **options):
+        """過去の月の天気情報を列ごとのバイナリに書き出す（weather_archive.export_archive を参照）"""
+        return weather_archive.export_archive(self.connections, directory, **options)
     
     def insert_area(self, area_name, area_id):
-        conn = self.get_connection()
-        cur = conn.cursor()
-        
         try:
-            # 既に存在するか確認
-            cur.execute("SELECT id FROM area WHERE area_id = ?", (area_id,))
-            result = cur.fetchone()
-            
-            if result:
-                return result[0]
-            
-            # 新規登録
-            cur.execute(
-                "INSERT INTO area (area_name, area_id) VALUES (?, ?)",
-                (area_name, area_id)
-            )
-            conn.commit()
-            return cur.lastrowid
-            
+            with self.connections.write() as conn:
+                cur = conn.cursor()
+                
+                # 既に存在するか確認
+                cur.execute("SELECT id FROM area WHERE area_id = ?", (area_id,))
+                result = cur.fetchone()
+                
+                if result:
+                    return result[0]
+                
+                # 新規登録
+                cur.execute(
+                    "INSERT INTO area (area_name, area_id) VALUES (?, ?)",
+                    (area_name, area_id)
+                )
+                return cur.lastrowid
+        
         except sqlite3.Error as e:
             print(f"エリア登録エラー: {e}")
             return None
-        finally:
-            conn.close()
     
-    def insert_or_update_weather_data(self, area_db_id, weather_json):
-        conn = self.get_connection()
-        cur = conn.cursor()
+    def get_forecast_validators(self, area_id):
+        """前回取得時の (etag, last_modified, content_length) を取得"""
+        try:
+            with self.connections.read() as conn:
+                cur = conn.cursor()
+                cur.execute("""
+                    SELECT etag, last_modified, content_length
+                    FROM forecast_validator
+                    WHERE area_id = ?
+                """, (area_id,))
+                return cur.fetchone()
+        
+        except sqlite3.Error as e:
+            print(f"検証子取得エラー: {e}")
+            return None
+    
+    def save_forecast_validators(self, area_id, etag, last_modified, content_length):
+        """天気予報の検証子を保存（どちらもなければ削除）"""
+        if not etag and not last_modified:
+            self.delete_forecast_validators(area_id)
+            return
         
         try:
-            # 天気予報データを解析
-            time_series = weather_json[0]['timeSeries']
-            
-            # 天気・風・波のデータ（timeSeries[0]）
-            weather_data = time_series[0]
-            time_defines = weather_data['timeDefines']
-            area_data = weather_data['areas'][0]
+            with self.connections.write() as conn:
+                conn.execute("""
+                    INSERT INTO forecast_validator
+                    (area_id, etag, last_modified, content_length, updated_at)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(area_id) DO UPDATE SET
+                        etag = excluded.etag,
+                        last_modified = excluded.last_modified,
+                        content_length = excluded.content_length,
+                        updated_at = excluded.updated_at
+                """, (area_id, etag, last_modified, content_length, datetime.now().isoformat()))
+        
+        except sqlite3.Error as e:
+            print(f"検証子保存エラー: {e}")
+    
+    def delete_forecast_validators(self, area_id):
+        """検証子を削除（次回は必ず全件取得する）"""
+        try:
+            with self.connections.write() as conn:
+                conn.execute("DELETE FROM forecast_validator WHERE area_id = ?", (area_id,))
+        
+        except sqlite3.Error as e:
+            print(f"検証子削除エラー: {e}")
+    
+    def get_last_update_slot(self):
+        """自動更新で最後に取得を終えた発表時刻（日本時間のdatetime。なければ None）"""
+        with self.connections.read() as conn:
+            row = conn.execute(
+                "SELECT MAX(slot) FROM update_slot WHERE completed_at IS NOT NULL"
+            ).fetchone()
+        return datetime.fromisoformat(row[0]) if row[0] else None
+    
+    def start_update_slot(self, slot, started_at):
+        """発表時刻の取得を始めたことを記録（取り直す場合は前回の終了を消す）"""
+        with self.connections.write() as conn:
+            conn.execute("""
+                INSERT INTO update_slot (slot, started_at) VALUES (?, ?)
+                ON CONFLICT(slot) DO UPDATE SET
+                    started_at = excluded.started_at,
+                    completed_at = NULL
+            """, (slot.isoformat(), started_at.isoformat()))
+    
+    def complete_update_slot(self, slot, completed_at, areas, errors):
+        """発表時刻の取得を終えたことを記録"""
+        with self.connections.write() as conn:
+            conn.execute("""
+                INSERT INTO update_slot (slot, started_at, completed_at, areas, errors) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(slot) DO UPDATE SET
+                    completed_at = excluded.completed_at,
+                    areas = excluded.areas,
+                    errors = excluded.errors
+            """, (slot.isoformat(), completed_at.isoformat(), completed_at.isoformat(), areas, errors))
+    
+    def record_area_views(self, views, viewed_at=None):
+        """画面で開かれた回数を足す（views は {地域コード: 回数}）"""
+        viewed_at = (viewed_at or datetime.now(JST)).isoformat()
+        with self.connections.write() as conn:
+            conn.executemany("""
+                INSERT INTO area_view_stats (area_id, view_count, last_viewed_at) VALUES (?, ?, ?)
+                ON CONFLICT(area_id) DO UPDATE SET
+                    view_count = view_count + excluded.view_count,
+                    last_viewed_at = excluded.last_viewed_at
+            """, [(area_id, count, viewed_at) for area_id, count in views.items()])
+    
+    def mark_areas_refreshed(self, area_ids, refreshed_at=None):
+        """自動更新で取得した地域の取得時刻を記録する"""
+        refreshed_at = (refreshed_at or datetime.now(JST)).isoformat()
+        with self.connections.write() as conn:
+            conn.executemany("""
+                INSERT INTO area_view_stats (area_id, refreshed_at) VALUES (?, ?)
+                ON CONFLICT(area_id) DO UPDATE SET refreshed_at = excluded.refreshed_at
+            """, [(area_id, refreshed_at) for area_id in area_ids])
+    
+    def get_area_view_stats(self):
+        """{地域コード: (開かれた回数, 最後に開かれた時刻, 最後に取得した時刻)}（時刻は datetime または None）"""
+        def parse(value):
+            return datetime.fromisoformat(value) if value else None
+        
+        with self.connections.read() as conn:
+            return {
+                area_id: (count, parse(viewed_at), parse(refreshed_at))
+                for area_id, count, viewed_at, refreshed_at in conn.execute(
+                    "SELECT area_id, view_count, last_viewed_at, refreshed_at FROM area_view_stats"
+                )
+            }
+    
+    def insert_or_update_weather_data(self, area_db_id, forecast):
+        """
+        天気予報をDBに保存（同じ地域・時刻の行は更新）し、書き込んだ行数を返す
+        forecast は ForecastBundle か、天気予報JSONそのもの
+        前回と同じ内容の予報、値の変わらない行は書き込まない（0件になることもある）
+        """
+        try:
+            inserted_count, updated_count, _ = self.upsert_weather_data([(area_db_id, forecast)])
+            return inserted_count + updated_count
             
-            # 降水確率データを辞書形式で保存（timeSeries[1]）
-            rain_dict = {}
-            if len(time_series) > 1 and 'pops' in time_series[1]['areas'][0]:
-                rain_data = time_series[1]
-                rain_time_defines = rain_data.get('timeDefines', [])
-                rain_area = rain_data['areas'][0]
-                
-                for i, rain_time in enumerate(rain_time_defines):
-                    if 'pops' in rain_area and i < len(rain_area['pops']):
-                        rain_proba_str = rain_area['pops'][i]
-                        if rain_proba_str and rain_proba_str != '':
-                            rain_dict[rain_time] = int(rain_proba_str)
+        except Exception as e:
+            print(f"天気情報挿入エラー: {e}")
+            return 0
+    
+    def upsert_weather_data(self, forecasts):
+        """
+        複数の天気予報を1つのトランザクションでまとめて保存し、(挿入件数, 更新件数, 変更なしの件数) を返す
+        forecasts は (area.id, ForecastBundle または天気予報JSON) の並び
+        - 前回保存した予報と reportDatetime・内容のハッシュが同じ地域は何も書き込まない
+        - それ以外も、値が変わった行だけを更新する
+        失敗した場合は例外を送出し、何も保存しない
+        """
+        forecasts = [
+            # 天気予報データを解析（解析済みならそのまま使う）
+            (area_db_id, forecast if isinstance(forecast, ForecastBundle) else parse_forecast(forecast))
+            for area_db_id, forecast in forecasts
+        ]
+        if not forecasts:
+            return 0, 0, 0
+        
+        with self.connections.write() as conn:
+            cur = conn.cursor()
+            fingerprints = self._load_fingerprints(cur, {area_db_id for area_db_id, _ in forecasts})
             
-            # 気温データを日付ベースで辞書に保存（timeSeries[2]）
-            temp_dict = {}
-            if len(time_series) > 2 and 'temps' in time_series[2]['areas'][0]:
-                temp_data = time_series[2]
-                temp_time_defines = temp_data.get('timeDefines', [])
-                temp_area = temp_data['areas'][0]
+            rows = []
+            unchanged_count = 0
+            changed_fingerprints = {}
+            for area_db_id, forecast in forecasts:
+                forecast_rows = forecast.rows()
+                fingerprint = (forecast.report_datetime, rows_hash(forecast_rows))
+                if fingerprints.get(area_db_id) == fingerprint:
+                    unchanged_count += len(forecast_rows)
+                    continue
                 
-                for i, temp_time in enumerate(temp_time_defines):
-                    # 日付部分を抽出
-                    date_part = temp_time.split('T')[0]
-                    
-                    if 'temps' in temp_area and i < len(temp_area['temps']):
-                        temp_str = temp_area['temps'][i]
-                        if temp_str and temp_str != '':
-                            if date_part not in temp_dict:
-                                temp_dict[date_part] = []
-                            temp_dict[date_part].append(float(temp_str))
-            
-            # 最低気温と最高気温を計算
-            min_max_temp_dict = {}
-            for date, temps in temp_dict.items():
-                min_max_temp_dict[date] = {
-                    'min': min(temps) if temps else None,
-                    'max': max(temps) if temps else None
-                }
+                fingerprints[area_db_id] = fingerprint
+                changed_fingerprints[area_db_id] = fingerprint
+                rows.extend(row + (area_db_id,) for row in forecast_rows)
             
             inserted_count = 0
-            updated_count = 0
-            
-            # 各時間帯のデータを挿入または更新
-            for i, time_define in enumerate(time_defines):
-                # 天気
-                weather = None
-                if 'weathers' in area_data and i < len(area_data['weathers']):
-                    weather = area_data['weathers'][i]
-                
-                # 風
-                wind = None
-                if 'winds' in area_data and i < len(area_data['winds']):
-                    wind = area_data['winds'][i]
-                
-                # 波
-                wave = None
-                if 'waves' in area_data and i < len(area_data['waves']):
-                    wave = area_data['waves'][i]
+            changed_count = 0
+            # 値が同じ行は書き込まず、集計し直す日・月にも含めない
+            changed_rows, inserted_count = self._changed_rows(cur, rows)
+            if changed_rows:
+                # 同じ地域・時刻があれば値が変わったときだけ更新、なければ挿入（1回の executemany）
+                changes_before = conn.total_changes
+                cur.executemany("""
+                    INSERT INTO weather_info
+                    (time, min_temperature, max_temperature, wind, wave, rain_proba, weather, area_id)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(area_id, time) DO UPDATE SET
+                        min_temperature = excluded.min_temperature,
+                        max_temperature = excluded.max_temperature,
+                        wind = excluded.wind,
+                        wave = excluded.wave,
+                        rain_proba = excluded.rain_proba,
+                        weather = excluded.weather
+                    WHERE (min_temperature, max_temperature, wind, wave, rain_proba, weather)
+                        IS NOT (excluded.min_temperature, excluded.max_temperature, excluded.wind,
+                                excluded.wave, excluded.rain_proba, excluded.weather)
+                """, changed_rows)
+                changed_count = conn.total_changes - changes_before
                 
-                # 降水確率を取得
-                rain_proba = rain_dict.get(time_define)
-                
-                # 日付部分を抽出して気温を取得
-                date_part = time_define.split('T')[0]
-                min_temp = min_max_temp_dict.get(date_part, {}).get('min')
-                max_temp = min_max_temp_dict.get(date_part, {}).get('max')
-                
-                # データベースに挿入または更新（天気情報がある場合のみ）
-                if weather:
-                    # 既存のデータを確認
-                    cur.execute("""
-                        SELECT id FROM weather_info 
-                        WHERE area_id = ? AND time = ?
-                    """, (area_db_id, time_define))
-                    
-                    existing = cur.fetchone()
-                    
-                    if existing:
-                        # 更新
-                        cur.execute("""
-                            UPDATE weather_info 
-                            SET min_temperature = ?, max_temperature = ?, wind = ?, wave = ?, rain_proba = ?, weather = ?
-                            WHERE id = ?
-                        """, (min_temp, max_temp, wind, wave, rain_proba, weather, existing[0]))
-                        updated_count += 1
-                    else:
-                        # 新規挿入
-                        cur.execute("""
-                            INSERT INTO weather_info 
-                            (time, min_temperature, max_temperature, wind, wave, rain_proba, weather, area_id)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                        """, (time_define, min_temp, max_temp, wind, wave, rain_proba, weather, area_db_id))
-                        inserted_count += 1
+                # 変わった行の日・月の集計も同じトランザクションで更新する
+                weather_rollup.refresh(conn, {(row[-1], row[0]) for row in changed_rows})
             
-            conn.commit()
-            return inserted_count + updated_count
-            
-        except Exception as e:
-            print(f"天気情報挿入エラー: {e}")
-            return 0
-        finally:
-            conn.close()
+            if changed_fingerprints:
+                now = datetime.now().isoformat()
+                cur.executemany("""
+                    INSERT INTO forecast_fingerprint (area_id, report_datetime, content_hash, updated_at)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT(area_id) DO UPDATE SET
+                        report_datetime = excluded.report_datetime,
+                        content_hash = excluded.content_hash,
+                        updated_at = excluded.updated_at
+                """, [
+                    (area_db_id, report_datetime, content_hash, now)
+                    for area_db_id, (report_datetime, content_hash) in changed_fingerprints.items()
+                ])
+        
+        unchanged_count += len(rows) - changed_count
+        return inserted_count, changed_count - inserted_count, unchanged_count
     
-    def get_weather_history(self, area_id=None, limit=100):
-        conn = self.get_connection()
-        cur = conn.cursor()
+    def _load_fingerprints(self, cur, area_db_ids):
+        #地域ごとに前回保存した予報の (reportDatetime, 内容のハッシュ)
+        placeholders = ', '.join('?' * len(area_db_ids))
+        cur.execute(f"""
+            SELECT area_id, report_datetime, content_hash
+            FROM forecast_fingerprint
+            WHERE area_id IN ({placeholders})
+        """, tuple(area_db_ids))
+        return {area_db_id: (report_datetime, content_hash) for area_db_id, report_datetime, content_hash in cur}
+    
+    def _changed_rows(self, cur, rows):
+        #まだない行と値の変わった行、まだない (地域, 時刻) の数（挿入件数）を返す
+        #既にある行は地域ごとにまとめて読む
+        times_by_area = {}
+        for row in rows:
+            times_by_area.setdefault(row[-1], set()).add(row[0])
+        
+        existing = {}
+        for area_db_id, times in times_by_area.items():
+            placeholders = ', '.join('?' * len(times))
+            cur.execute(f"""
+                SELECT time, min_temperature, max_temperature, wind, wave, rain_proba, weather
+                FROM weather_info
+                WHERE area_id = ? AND time IN ({placeholders})
+            """, (area_db_id, *times))
+            for time, *values in cur:
+                existing[(area_db_id, time)] = tuple(values)
         
+        new_keys = sum(len(times) for times in times_by_area.values()) - len(existing)
+        changed = [row for row in rows if existing.get((row[-1], row[0])) != row[1:-1]]
+        return changed, new_keys
+    
+    def get_weather_history(self, area_id=None, limit=100):
+        """新しい順に最大 limit 件の履歴をリストで返す（limit が負なら上限なし。iter_weather_history を参照）"""
+        if limit < 0:
+            # SQLite の LIMIT -1 と同じく上限なしにする
+            limit = None
+        page_size = DEFAULT_PAGE_SIZE if limit is None else max(1, min(limit, DEFAULT_PAGE_SIZE))
+        return list(itertools.islice(self.iter_weather_history(area_id, page_size=page_size), limit))
+    
+    def iter_weather_history(self, area_id=None, page_size=DEFAULT_PAGE_SIZE, after=None):
+        """
+        履歴を新しい順（time, id の降順）に1行ずつ返すジェネレーター
+        page_size 件ずつ取得し、続きは最後の行の (time, id) より前から読む（キーセット方式）
+        after=(time, id) を渡すとその行の次から返す
+        行は (id, area_name, time, weather, min_temperature, max_temperature, wind, wave, rain_proba)
+        """
+        if page_size < 1:
+            raise ValueError(f"page_size は1以上を指定してください: {page_size}")
+        return self._iter_weather_history(area_id, page_size, after)
+    
+    def _iter_weather_history(self, area_id, page_size, after):
+        #iter_weather_history の本体（引数の確認を最初の next() まで遅らせないため分ける）
         try:
             if area_id:
-                cur.execute("""
-                    SELECT w.id, a.area_name, w.time, w.weather, w.min_temperature, 
-                           w.max_temperature, w.wind, w.wave, w.rain_proba
-                    FROM weather_info w
-                    JOIN area a ON w.area_id = a.id
-                    WHERE a.area_id = ?
-                    ORDER BY w.time DESC
-                    LIMIT ?
-                """, (area_id, limit))
+                # 地域コードから area.id を先に引き、weather_info は (area_id, time) のインデックスで読む
+                with self.connections.read() as conn:
+                    area = conn.execute(
+                        "SELECT id, area_name FROM area WHERE area_id = ?", (area_id,)
+                    ).fetchone()
+                if area is None:
+                    return
+                fetch_page = lambda conn, key: self._area_history_page(conn, area, key, page_size)
             else:
-                cur.execute("""
-                    SELECT w.id, a.area_name, w.time, w.weather, w.min_temperature, 
-                           w.max_temperature, w.wind, w.wave, w.rain_proba
-                    FROM weather_info w
-                    JOIN area a ON w.area_id = a.id
-                    ORDER BY w.time DESC
-                    LIMIT ?
-                """, (limit,))
+                fetch_page = lambda conn, key: self._history_page(conn, key, page_size)
             
-            return cur.fetchall()
+            key = tuple(after) if after else None
+            while True:
+                # ページごとに読み込みのトランザクションを終えて、書き込みを妨げない
+                with self.connections.read() as conn:
+                    rows = fetch_page(conn, key)
+                
+                yield from rows
+                if len(rows) < page_size:
+                    return
+                key = (rows[-1][2], rows[-1][0])
             
-        except Exception as e:
+        except sqlite3.Error as e:
+            print(f"天気情報取得エラー: {e}")
+    
+    def _area_history_page(self, conn, area, key, page_size):
+        #同じ地域では時刻が一意なので、続きの位置は time だけで決まる
+        area_db_id, area_name = area
+        if key is None:
+            return conn.execute(f"""
+                SELECT id, ?, time, {HISTORY_COLUMNS}
+                FROM weather_info
+                WHERE area_id = ?
+                ORDER BY time DESC
+                LIMIT ?
+            """, (area_name, area_db_id, page_size)).fetchall()
+        
+        return conn.execute(f"""
+            SELECT id, ?, time, {HISTORY_COLUMNS}
+            FROM weather_info
+            WHERE area_id = ? AND time < ?
+            ORDER BY time DESC
+            LIMIT ?
+        """, (area_name, area_db_id, key[0], page_size)).fetchall()
+    
+    def _history_page(self, conn, key, page_size):
+        columns = """
+            w.id, a.area_name, w.time, w.weather, w.min_temperature,
+            w.max_temperature, w.wind, w.wave, w.rain_proba
+        """
+        if key is None:
+            return conn.execute(f"""
+                SELECT {columns}
+                FROM weather_info w
+                JOIN area a ON w.area_id = a.id
+                ORDER BY w.time DESC, w.id DESC
+                LIMIT ?
+            """, (page_size,)).fetchall()
+        
+        return conn.execute(f"""
+            SELECT {columns}
+            FROM weather_info w
+            JOIN area a ON w.area_id = a.id
+            WHERE (w.time, w.id) < (?, ?)
+            ORDER BY w.time DESC, w.id DESC
+            LIMIT ?
+        """, (*key, page_size)).fetchall()
+    
+    def get_weather_series(self, area_id, start, end, resolution=None):
+        """
+        地域の start〜end（日付、両端を含む）の天気を (resolution, 行のリスト) で返す
+        resolution を省略すると期間の長さから 'raw' / 'daily' / 'monthly' を選ぶ
+        行は (期間, weather, min_temperature, max_temperature, 最大降水確率, 平均降水確率)
+        期間は raw なら時刻、daily なら 'YYYY-MM-DD'、monthly なら 'YYYY-MM'
+        """
+        start = weather_rollup.to_date(start)
+        end = weather_rollup.to_date(end)
+        if resolution is None:
+            resolution = weather_rollup.choose_resolution(start, end)
+        if resolution not in weather_rollup.RESOLUTIONS:
+            raise ValueError(f"resolution は {', '.join(weather_rollup.RESOLUTIONS)} のいずれか: {resolution}")
+        
+        last = (end + timedelta(days=1)).isoformat()
+        try:
+            with self.connections.read() as conn:
+                area = conn.execute("SELECT id FROM area WHERE area_id = ?", (area_id,)).fetchone()
+                if area is None:
+                    return resolution, []
+                
+                if resolution == 'raw':
+                    rows = conn.execute("""
+                        SELECT time, weather, min_temperature, max_temperature, rain_proba, rain_proba
+                        FROM weather_info
+                        WHERE area_id = ? AND time >= ? AND time < ?
+                        ORDER BY time
+                    """, (area[0], start.isoformat(), last)).fetchall()
+                elif resolution == 'daily':
+                    rows = conn.execute("""
+                        SELECT day, weather, min_temperature, max_temperature, pop_max,
+                               CAST(pop_sum AS REAL) / NULLIF(pop_count, 0)
+                        FROM weather_daily
+                        WHERE area_id = ? AND day >= ? AND day < ?
+                        ORDER BY day
+                    """, (area[0], start.isoformat(), last)).fetchall()
+                else:
+                    rows = conn.execute("""
+                        SELECT month, weather, min_temperature, max_temperature, pop_max,
+                               CAST(pop_sum AS REAL) / NULLIF(pop_count, 0)
+                        FROM weather_monthly
+                        WHERE area_id = ? AND month >= ? AND month <= ?
+                        ORDER BY month
+                    """, (area[0], start.isoformat()[:7], end.isoformat()[:7])).fetchall()
+            return resolution, rows
+        
+        except sqlite3.Error as e:
             print(f"天気情報取得エラー: {e}")
-            return []
-        finally:
-            conn.close()
+            return resolution, []
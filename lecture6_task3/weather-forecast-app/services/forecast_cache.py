@@ -0,0 +1,163 @@
+# 天気予報のメモリキャッシュ（LRU + 発表時刻に合わせたTTL）
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from .publication import next_publication
+
+
+# 発表時刻ちょうどには新しい予報がまだ出ていないことがあるため少し待つ
+PUBLICATION_DELAY = timedelta(minutes=10)
+
+# 鮮度切れ後もこの間はキャッシュを返しつつ裏で取り直す
+DEFAULT_STALE_SECONDS = 60 * 60
+
+DEFAULT_MAX_ENTRIES = 64
+DEFAULT_MAX_BYTES = 8 * 1024 * 1024
+
+
+class _Entry:
+    __slots__ = ('value', 'size', 'fresh_until', 'stale_until')
+
+    def __init__(self, value, size, fresh_until, stale_until):
+        self.value = value
+        self.size = size
+        self.fresh_until = fresh_until
+        self.stale_until = stale_until
+
+
+def estimate_size(value):
+    """キャッシュする値のおおよそのサイズ（JSON文字列の長さ）"""
+    return len(json.dumps(value, ensure_ascii=False))
+
+
+class ForecastCache:
+    """
+    地域コードごとの天気予報を保持するLRUキャッシュ
+    - 次の発表時刻（+少し）までは新鮮として返す
+    - その後 stale_seconds の間は古い値をすぐ返し、裏で取り直す
+    - 件数と合計サイズの上限を超えたら古いものから捨てる
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES,
+                 stale_seconds=DEFAULT_STALE_SECONDS, clock=time.time):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.stale_seconds = stale_seconds
+        self.clock = clock
+
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+    def _fresh_until(self, fetched_at):
+        # 発表時刻から PUBLICATION_DELAY の間に取得した値は、まだ前の発表の予報なので
+        # その発表の PUBLICATION_DELAY 後までしか新鮮としない
+        delay = PUBLICATION_DELAY.total_seconds()
+        return (next_publication(fetched_at - delay) + PUBLICATION_DELAY).timestamp()
+
+    def get(self, key, loader):
+        """
+        キャッシュから取得し、なければ loader() で取得して保存する
+        loader が例外を送出した場合はそのまま送出し、キャッシュには入れない
+        """
+        now = self.clock()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now < entry.stale_until:
+                self._entries.move_to_end(key)
+                if now < entry.fresh_until:
+                    self.hits += 1
+                    return entry.value
+
+                # 鮮度切れ: 古い値を返しつつ裏で取り直す
+                self.stale_hits += 1
+                self._start_refresh(key, loader)
+                return entry.value
+
+            self.misses += 1
+
+        value = loader()
+        self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        """値を保存し、上限を超えた分を古い順に捨てる"""
+        size = estimate_size(value)
+        fresh_until = self._fresh_until(self.clock())
+        entry = _Entry(value, size, fresh_until, fresh_until + self.stale_seconds)
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._total_bytes -= old.size
+
+            # 1件で上限を超える値は保存しない
+            if size > self.max_bytes:
+                return
+
+            self._entries[key] = entry
+            self._total_bytes += size
+
+            while len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._total_bytes -= evicted.size
+                self.evictions += 1
+
+    def _start_refresh(self, key, loader):
+        #ロック取得中に呼ぶ。同じキーの取り直しは1つだけ走らせる
+        if key in self._refreshing:
+            return
+        self._refreshing.add(key)
+
+        def run():
+            try:
+                self.put(key, loader())
+                with self._lock:
+                    self.refreshes += 1
+            except Exception as e:
+                print(f"天気予報の再取得に失敗: {e}")
+                with self._lock:
+                    self.refresh_errors += 1
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def invalidate(self, key=None):
+        """指定したキー（省略時はすべて）を削除"""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self._total_bytes = 0
+            else:
+                entry = self._entries.pop(key, None)
+                if entry is not None:
+                    self._total_bytes -= entry.size
+
+    def stats(self):
+        """ヒット・ミス・追い出しなどの件数"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'refreshes': self.refreshes,
+                'refresh_errors': self.refresh_errors,
+            }
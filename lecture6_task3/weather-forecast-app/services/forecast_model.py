@@ -0,0 +1,222 @@
+# 天気予報JSONを一度だけ解析してまとめたデータ構造
+
+import hashlib
+import math
+from array import array
+
+
+# 降水確率が空欄のときの値（array('b')に入れるため整数で表す）
+NO_POP = -1
+
+
+def _to_pop(value):
+    if value is None or value == '':
+        return NO_POP
+    return int(value)
+
+
+def _to_temp(value):
+    if value is None or value == '':
+        return math.nan
+    return float(value)
+
+
+def rows_hash(rows):
+    """DBに保存する行の内容のハッシュ（前回と同じ内容なら保存を省略するため）"""
+    digest = hashlib.blake2b(digest_size=16)
+    for row in rows:
+        digest.update(repr(row).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def format_temp(value):
+    """気温を表示用の文字列にする（23.0 -> '23'）"""
+    return f"{value:g}"
+
+
+class SubAreaForecast:
+    """1つの細分区域（class10）の天気・風・波"""
+
+    __slots__ = ('code', 'name', 'weathers', 'winds', 'waves')
+
+    def __init__(self, code, name, weathers, winds, waves):
+        self.code = code
+        self.name = name
+        self.weathers = weathers
+        self.winds = winds
+        self.waves = waves
+
+
+class ForecastBundle:
+    """
+    forecast/{area_code}.json の短期予報部分（timeSeries[0]〜[2]）をまとめたもの
+    - time_defines / areas: 天気・風・波（timeSeries[0]）
+    - pop_times / pops:     降水確率（timeSeries[1]）。区域ごとの array('b')、空欄は NO_POP
+    - temp_times / temps:   気温（timeSeries[2]）。地点ごとの array('d')、空欄は NaN
+    """
+
+    __slots__ = (
+        'publishing_office', 'report_datetime',
+        'time_defines', 'areas',
+        'pop_times', 'pop_area_codes', 'pops',
+        'temp_times', 'temp_area_names', 'temps',
+    )
+
+    def __init__(self, publishing_office, report_datetime, time_defines, areas,
+                 pop_times, pop_area_codes, pops, temp_times, temp_area_names, temps):
+        self.publishing_office = publishing_office
+        self.report_datetime = report_datetime
+        self.time_defines = time_defines
+        self.areas = areas
+        self.pop_times = pop_times
+        self.pop_area_codes = pop_area_codes
+        self.pops = pops
+        self.temp_times = temp_times
+        self.temp_area_names = temp_area_names
+        self.temps = temps
+
+    @property
+    def area_name(self):
+        """代表する区域（最初の細分区域）の名前"""
+        if self.areas:
+            return self.areas[0].name
+        return None
+
+    def pop_at(self, area_index, i):
+        """降水確率（空欄や範囲外はNone）"""
+        if area_index >= len(self.pops) or i >= len(self.pops[area_index]):
+            return None
+        value = self.pops[area_index][i]
+        return None if value == NO_POP else value
+
+    def temp_at(self, area_index, i):
+        """気温（空欄や範囲外はNone）"""
+        if area_index >= len(self.temps) or i >= len(self.temps[area_index]):
+            return None
+        value = self.temps[area_index][i]
+        return None if math.isnan(value) else value
+
+    def daily_min_max(self, area_index=0):
+        """日付ごとの (最低気温, 最高気温) の辞書"""
+        result = {}
+        if area_index >= len(self.temps):
+            return result
+
+        for temp_time, value in zip(self.temp_times, self.temps[area_index]):
+            if math.isnan(value):
+                continue
+            date_part = temp_time.split('T')[0]
+            current = result.get(date_part)
+            if current is None:
+                result[date_part] = (value, value)
+            else:
+                result[date_part] = (min(current[0], value), max(current[1], value))
+        return result
+
+    def temp_pairs(self, area_index=0):
+        """
+        気温を [最低, 最高, 最低, 最高, ...] の順に2つずつ組にしたリスト
+        空欄はNone、個数が奇数のときの最後の要素は長さ1のタプルになる
+        """
+        if area_index >= len(self.temps):
+            return []
+
+        values = [self.temp_at(area_index, i) for i in range(len(self.temps[area_index]))]
+        pairs = []
+        for i in range(0, len(values), 2):
+            if i + 1 < len(values):
+                pairs.append((values[i], values[i + 1]))
+            else:
+                pairs.append((values[i],))
+        return pairs
+
+    def rows(self):
+        """
+        DBに保存する行 (time, min_temperature, max_temperature, wind, wave, rain_proba, weather)
+        最初の細分区域の、天気がある時間帯のみ。降水確率は同じ時刻、気温は同じ日付の値を使う
+        """
+        if not self.areas:
+            return []
+
+        area = self.areas[0]
+
+        rain_dict = {}
+        if self.pops:
+            for pop_time, value in zip(self.pop_times, self.pops[0]):
+                if value != NO_POP:
+                    rain_dict[pop_time] = value
+
+        min_max = self.daily_min_max(0)
+
+        rows = []
+        for i, time_define in enumerate(self.time_defines):
+            weather = area.weathers[i] if i < len(area.weathers) else None
+            if not weather:
+                continue
+
+            wind = area.winds[i] if i < len(area.winds) else None
+            wave = area.waves[i] if i < len(area.waves) else None
+            min_temp, max_temp = min_max.get(time_define.split('T')[0], (None, None))
+
+            rows.append((
+                time_define, min_temp, max_temp, wind, wave,
+                rain_dict.get(time_define), weather,
+            ))
+        return rows
+
+
+def parse_forecast(weather_json):
+    """天気予報JSON（forecast/{area_code}.json）を ForecastBundle に変換"""
+    first = weather_json[0]
+    time_series = first.get('timeSeries', [])
+
+    time_defines = ()
+    areas = ()
+    if time_series:
+        weather_data = time_series[0]
+        time_defines = tuple(weather_data.get('timeDefines', ()))
+        areas = tuple(
+            SubAreaForecast(
+                area.get('area', {}).get('code'),
+                area.get('area', {}).get('name'),
+                tuple(area.get('weathers', ())),
+                tuple(area.get('winds', ())),
+                tuple(area.get('waves', ())),
+            )
+            for area in weather_data.get('areas', ())
+        )
+
+    pop_times = ()
+    pop_area_codes = ()
+    pops = ()
+    if len(time_series) > 1:
+        pop_data = time_series[1]
+        pop_areas = [area for area in pop_data.get('areas', ()) if 'pops' in area]
+        if pop_areas:
+            pop_times = tuple(pop_data.get('timeDefines', ()))
+            pop_area_codes = tuple(area.get('area', {}).get('code') for area in pop_areas)
+            pops = tuple(array('b', map(_to_pop, area['pops'])) for area in pop_areas)
+
+    temp_times = ()
+    temp_area_names = ()
+    temps = ()
+    if len(time_series) > 2:
+        temp_data = time_series[2]
+        temp_areas = [area for area in temp_data.get('areas', ()) if 'temps' in area]
+        if temp_areas:
+            temp_times = tuple(temp_data.get('timeDefines', ()))
+            temp_area_names = tuple(area.get('area', {}).get('name') for area in temp_areas)
+            temps = tuple(array('d', map(_to_temp, area['temps'])) for area in temp_areas)
+
+    return ForecastBundle(
+        first.get('publishingOffice', ''),
+        first.get('reportDatetime'),
+        time_defines,
+        areas,
+        pop_times,
+        pop_area_codes,
+        pops,
+        temp_times,
+        temp_area_names,
+        temps,
+    )
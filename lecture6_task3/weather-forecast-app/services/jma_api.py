@@ -1,20 +1,149 @@
 # 気象庁APIとの通信
 
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
+from requests.adapters import HTTPAdapter
+
+from .area_catalog import AreaCatalog
+from .forecast_cache import ForecastCache
+from .rate_limit import RetryPolicy, TokenBucket, parse_retry_after
+from .single_flight import SingleFlight
+
+
+# 接続プールの既定値（同時に張るホストごとの接続数）
+DEFAULT_POOL_SIZE = 10
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class _NotModified:
+    #304 Not Modified（前回取得時から変更なし）を表す値
+    def __repr__(self):
+        return 'NOT_MODIFIED'
+    
+    def __reduce__(self):
+        # 別のプロセスに送っても同じ NOT_MODIFIED になるようにする
+        return 'NOT_MODIFIED'
+
+
+NOT_MODIFIED = _NotModified()
+
+
+def _build_session(pool_size, adapter=None):
+    #keep-alive・gzip対応の接続プール付きセッションを作成
+    session = requests.Session()
+    session.headers.update({
+        'Accept-Encoding': 'gzip, deflate',
+        'Connection': 'keep-alive',
+    })
+    
+    # pool_connections: プールを保持するホスト数
+    # pool_maxsize: ホストごとの最大接続数（pool_block=Trueで上限を超えない）
+    if adapter is None:
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            pool_block=True,
+        )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def configure_session(pool_size=DEFAULT_POOL_SIZE, adapter=None):
+    """
+    共有セッションを作り直す（プールサイズの変更用）
+    adapter を渡すとそれで通信する（記録・再生モード用、services.recorder を参照）
+    """
+    global _session
+    
+    with _session_lock:
+        old_session = _session
+        _session = _build_session(pool_size, adapter)
+    
+    if old_session is not None:
+        old_session.close()
+    return _session
+
+
+def get_session():
+    """モジュール共通のセッションを取得（スレッド間で共有可能）"""
+    global _session
+    
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session(DEFAULT_POOL_SIZE)
+    return _session
+
 
 class JmaApiService:
     
     AREA_LIST_URL = 'http://www.jma.go.jp/bosai/common/const/area.json'
     FORECAST_URL = 'https://www.jma.go.jp/bosai/forecast/data/forecast/{area_code}.json' 
     
+    # 画面表示用の天気予報キャッシュ（地域コードごと）
+    forecast_cache = ForecastCache()
+    
+    # 同じ地域への同時リクエストを1回にまとめる
+    forecast_flight = SingleFlight()
+    
+    # すべてのリクエストで共有するレート制限と再試行の方針
+    rate_limiter = TokenBucket()
+    retry_policy = RetryPolicy()
+    
+    @staticmethod
+    def configure_rate_limit(rate, burst):
+        """1秒あたりのリクエスト数と、まとめて送れる最大数を変更"""
+        JmaApiService.rate_limiter.configure(rate, burst)
+    
+    @staticmethod
+    def _get(url, headers=None):
+        """
+        レート制限に従ってGETする
+        タイムアウト・429・5xx は指数バックオフ（Retry-Afterがあればそれ以上）で再試行し、
+        Retry-After が再試行の方針の max_delay より長ければ再試行せずに返す
+        最終的なレスポンスの retry_count に再試行した回数を入れて返す
+        """
+        policy = JmaApiService.retry_policy
+        attempt = 0
+        
+        while True:
+            JmaApiService.rate_limiter.acquire()
+            
+            try:
+                response = get_session().get(url, headers=headers, timeout = 10)
+            except requests.exceptions.Timeout:
+                if attempt >= policy.max_retries:
+                    raise
+                delay = policy.delay(attempt)
+            else:
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                if (attempt >= policy.max_retries or not policy.is_retryable_status(response.status_code)
+                        or not policy.accepts_retry_after(retry_after)):
+                    # 何時間も先の Retry-After を待ち続けない（呼び出し側で失敗として扱う）
+                    response.retry_count = attempt
+                    return response
+                
+                if response.status_code == 429 and retry_after:
+                    # 混雑時は他のリクエストも含めて止める
+                    JmaApiService.rate_limiter.pause(retry_after)
+                delay = policy.delay(attempt, retry_after)
+                response.close()
+            
+            attempt += 1
+            policy.record_retry()
+            policy.sleep(delay)
+    
     @staticmethod
     def get_area_list():
         try:
             print("地域リストを取得中")
-            response = requests.get(
-                JmaApiService.AREA_LIST_URL,
-                timeout = 10
-            )
+            response = JmaApiService._get(JmaApiService.AREA_LIST_URL)
             
             response.raise_for_status()
             
@@ -38,16 +167,170 @@ class JmaApiService:
             return None
         
     @staticmethod
-    def get_weather_forecast(area_code):
+    def get_area_catalog():
+        """地域リストを AreaCatalog（必要な階層だけ解析する）として取得"""
+        try:
+            print("地域リストを取得中")
+            body, _, _ = JmaApiService.fetch_area_list_raw()
+            
+            print('地域リスト取得成功')
+            return AreaCatalog(body)
+        
+        except requests.exceptions.Timeout:
+            print('エラー：タイムアウト（10秒以上応答なし）')
+            return None
+        
+        except requests.exceptions.ConnectionError:
+            print('エラー：ネットワーク接続に失敗')
+            return None
+        
+        except requests.exceptions.HTTPError as e:
+            print(f'HTTPエラー：{e}')
+            return None
+        
+        except Exception as e:
+            print(f'エラー：予期しないエラー:{e}')
+            return None
+    
+    @staticmethod
+    def fetch_area_list_raw(etag=None, last_modified=None):
+        """
+        area.json を解析せずにバイト列のまま取得（失敗時は例外を送出）
+        戻り値は (本文, ETag, Last-Modified)、検証子が一致して変更がなければ NOT_MODIFIED
+        """
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        
+        response = JmaApiService._get(JmaApiService.AREA_LIST_URL, headers)
+        
+        if response.status_code == 304:
+            return NOT_MODIFIED
+        
+        response.raise_for_status()
+        return (
+            response.content,
+            response.headers.get('ETag'),
+            response.headers.get('Last-Modified'),
+        )
+    
+    @staticmethod
+    def _fetch_forecast(area_code, validator_store=None, info=None):
+        """
+        天気予報を取得（失敗時は例外をそのまま送出）
+        validator_store を渡すと ETag / Last-Modified による条件付きGETを行い、
+        変更がなければ JSON を解析せずに NOT_MODIFIED を返す
+        同じ地域への取得が実行中なら、新たに通信せずその結果を共有する
+        info（辞書）を渡すと、通信した場合は status_code・bytes（転送量）・retries（再試行回数）を入れる
+        （相乗りした場合も共有した取得の値を入れ、coalesced を True にする）
+        200 の場合は info['validators'] に (etag, last_modified, content_length) を入れる
+        検証子は保存しないため、呼び出し側が予報を保存できた後に save_forecast_validators で保存する
+        （先に保存すると、予報の保存に失敗しても次回は304になってしまう）
+        """
+        # 条件付きGETかどうかで結果が変わるため、検証子の保存先もキーに含める
+        key = (area_code, id(validator_store) if validator_store is not None else None)
+        executed = []
+        
+        def request():
+            # 相乗りした呼び出しにも info を渡せるよう、例外も値として返す
+            executed.append(True)
+            details = {}
+            try:
+                return JmaApiService._request_forecast(area_code, validator_store, details), None, details
+            except Exception as e:
+                return None, e, details
+        
+        result, error, details = JmaApiService.forecast_flight.do(key, request)
+        if info is not None:
+            info.update(details, coalesced=not executed)
+        if error is not None:
+            raise error
+        return result
+    
+    @staticmethod
+    def _request_forecast(area_code, validator_store=None, info=None):
+        #天気予報を1回取得する（_fetch_forecast から呼ぶ）
+        url = JmaApiService.FORECAST_URL.format(area_code = area_code)
+        
+        headers = {}
+        if validator_store is not None:
+            validators = validator_store.get_forecast_validators(area_code)
+            if validators:
+                etag, last_modified, _ = validators
+                if etag:
+                    headers['If-None-Match'] = etag
+                if last_modified:
+                    headers['If-Modified-Since'] = last_modified
+        
+        response = JmaApiService._get(url, headers)
+        
+        # 転送量（圧縮後のサイズ）
+        content_length = response.headers.get('Content-Length')
+        size = int(content_length) if content_length else len(response.content)
+        if info is not None:
+            info.update(status_code=response.status_code, bytes=size, retries=response.retry_count)
+        
+        if response.status_code == 304:
+            return NOT_MODIFIED
+        
+        response.raise_for_status()
+        weather_json = response.json()
+        
+        if info is not None:
+            # サイズは節約量の計算用
+            info['validators'] = (response.headers.get('ETag'), response.headers.get('Last-Modified'), size)
+        
+        return weather_json
+    
+    @staticmethod
+    def get_weather_forecast(area_code, validator_store=None, info=None):
+        """
+        天気予報を取得（失敗時は None）
+        validator_store・info は _fetch_forecast と同じ（検証子は予報を保存した後に info['validators'] から保存する）
+        """
         try:
-            url = JmaApiService.FORECAST_URL.format(area_code = area_code)
             print(f"天気予報を取得中（地域コード:{area_code}）")
             
-            response = requests.get(url,timeout = 10)
-            response.raise_for_status()
+            weather_json = JmaApiService._fetch_forecast(area_code, validator_store, info)
             
-            print("天気予報取得成功")
-            return response.json()
+            if weather_json is NOT_MODIFIED:
+                print("天気予報は前回から更新されていません")
+            else:
+                print("天気予報取得成功")
+            return weather_json
+        
+        except requests.exceptions.Timeout:
+            print('エラー：タイムアウト（10秒以上応答なし）')
+            return None
+        
+        except requests.exceptions.ConnectionError:
+            print('エラー：ネットワーク接続に失敗')
+            return None
+        
+        except requests.exceptions.HTTPError as e:
+            print(f'HTTPエラー：{e}')
+            return None
+        
+        except Exception as e:
+            print(f'エラー：予期しないエラー:{e}')
+            return None
+    
+    @staticmethod
+    def get_cached_weather_forecast(area_code, refresh=False):
+        """
+        キャッシュ経由で天気予報を取得（画面表示用）
+        次の発表時刻までは通信せずに返し、その後しばらくは古い値を返しつつ裏で取り直す
+        refresh なら（更新ボタン）キャッシュを捨てて取得し直す
+        """
+        if refresh:
+            JmaApiService.forecast_cache.invalidate(area_code)
+        try:
+            return JmaApiService.forecast_cache.get(
+                area_code,
+                lambda: JmaApiService._fetch_forecast(area_code),
+            )
         
         except requests.exceptions.Timeout:
             print('エラー：タイムアウト（10秒以上応答なし）')
@@ -65,7 +348,57 @@ class JmaApiService:
             print(f'エラー：予期しないエラー:{e}')
             return None
     
+    @staticmethod
+    async def iter_weather_forecasts(area_codes, concurrency=DEFAULT_POOL_SIZE, validator_store=None):
+        """
+        複数地域の天気予報を並行して取得し、取得できた順に (地域コード, 結果) を返す
+        結果は予報JSON（条件付きGETで変更なしなら NOT_MODIFIED）、失敗した場合はその例外オブジェクト
+        validator_store は前回の検証子を読むだけで、新しい検証子は保存しない
+        """
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        # 同時実行数に合わせたスレッドで共有セッションを使う
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+        
+        async def fetch(area_code):
+            async with semaphore:
+                try:
+                    result = await loop.run_in_executor(
+                        executor, JmaApiService._fetch_forecast, area_code, validator_store
+                    )
+                except Exception as e:
+                    result = e
+            return area_code, result
+        
+        tasks = [asyncio.ensure_future(fetch(area_code)) for area_code in area_codes]
+        try:
+            for future in asyncio.as_completed(tasks):
+                yield await future
+        finally:
+            # 途中で打ち切られた場合は残りをキャンセル
+            for task in tasks:
+                task.cancel()
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    @staticmethod
+    async def fetch_weather_forecasts(area_codes, concurrency=DEFAULT_POOL_SIZE, validator_store=None):
+        """複数地域の天気予報を並行取得し {地域コード: 予報JSON または 例外} を返す"""
+        results = {}
+        forecasts = JmaApiService.iter_weather_forecasts(area_codes, concurrency, validator_store)
+        async for area_code, result in forecasts:
+            results[area_code] = result
+        return results
+    
+    @staticmethod
+    def get_weather_forecasts(area_codes, concurrency=DEFAULT_POOL_SIZE, validator_store=None):
+        """fetch_weather_forecasts の同期版（イベントループの外から呼ぶ）"""
+        return asyncio.run(
+            JmaApiService.fetch_weather_forecasts(area_codes, concurrency, validator_store)
+        )
+    
 #テストコード1地域リスト取得
+#相対インポートを使うため、weather-forecast-app で python -m services.jma_api として実行する
 if __name__ == "__main__":
     print("=" * 60)
     print("気象庁API 動作確認テスト")
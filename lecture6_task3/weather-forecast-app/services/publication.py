@@ -0,0 +1,42 @@
+# 気象庁の天気予報の発表時刻
+
+from datetime import datetime, timedelta, timezone
+
+
+JST = timezone(timedelta(hours=9))
+
+# 府県天気予報は毎日 5時・11時・17時（日本時間）に発表される
+PUBLICATION_HOURS = (5, 11, 17)
+
+
+def _to_jst(now):
+    if now is None:
+        return datetime.now(JST)
+    if isinstance(now, (int, float)):
+        return datetime.fromtimestamp(now, JST)
+    # タイムゾーンなしの場合はローカル時刻として扱う
+    return now.astimezone(JST)
+
+
+def previous_publication(now=None):
+    """now 以前で直近の発表時刻（日本時間のdatetime）"""
+    now = _to_jst(now)
+    day = now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    for hour in reversed(PUBLICATION_HOURS):
+        candidate = day.replace(hour=hour)
+        if candidate <= now:
+            return candidate
+    return (day - timedelta(days=1)).replace(hour=PUBLICATION_HOURS[-1])
+
+
+def next_publication(now=None):
+    """now より後で最初の発表時刻（日本時間のdatetime）"""
+    now = _to_jst(now)
+    day = now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    for hour in PUBLICATION_HOURS:
+        candidate = day.replace(hour=hour)
+        if candidate > now:
+            return candidate
+    return (day + timedelta(days=1)).replace(hour=PUBLICATION_HOURS[0])
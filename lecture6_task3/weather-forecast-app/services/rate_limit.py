@@ -0,0 +1,137 @@
+# 気象庁APIへのリクエスト間隔の制御（トークンバケット）と再試行の方針
+
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+
+# 既定では毎秒5リクエスト、最大10リクエストまでまとめて送れる
+DEFAULT_RATE = 5.0
+DEFAULT_BURST = 10
+
+
+class TokenBucket:
+    """
+    トークンバケット方式のレート制限（スレッド間で共有可能）
+    rate: 1秒あたりに補充するトークン数、burst: 貯められる最大数
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST, clock=time.monotonic, sleep=time.sleep):
+        self.clock = clock
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        self.configure(rate, burst)
+
+        # 待たされた回数と合計時間（秒）
+        self.waits = 0
+        self.waited = 0.0
+
+    def configure(self, rate, burst):
+        """レートとバーストを変更（貯まっているトークンは満タンに戻す）"""
+        if rate <= 0 or burst < 1:
+            raise ValueError("rate は正の値、burst は1以上を指定してください")
+
+        with self._lock:
+            self.rate = float(rate)
+            self.burst = float(burst)
+            self._tokens = self.burst
+            self._updated = self.clock()
+            self._paused_until = 0.0
+
+    def _refill(self, now):
+        #ロック取得中に呼ぶ
+        elapsed = max(0.0, now - self._updated)
+        self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+        self._updated = now
+
+    def _reserve(self):
+        #トークンを1つ予約し、使えるようになるまでの待ち時間を返す
+        with self._lock:
+            now = self.clock()
+            self._refill(now)
+            self._tokens -= 1
+
+            wait = 0.0
+            if self._tokens < 0:
+                wait = -self._tokens / self.rate
+            return max(wait, self._paused_until - now)
+
+    def acquire(self):
+        """トークンを1つ取得（足りなければ補充されるまで待つ）"""
+        wait = self._reserve()
+        if wait > 0:
+            with self._lock:
+                self.waits += 1
+                self.waited += wait
+            self.sleep(wait)
+        return wait
+
+    def pause(self, seconds):
+        """429などで指定された時間、全体のリクエストを止める"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, self.clock() + seconds)
+
+
+def parse_retry_after(value, now=None):
+    """Retry-After ヘッダー（秒数またはHTTP日付）を秒数に変換（解釈できなければNone）"""
+    if not value:
+        return None
+
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    if now is None:
+        now = datetime.now(timezone.utc)
+    return max(0.0, (retry_at - now).total_seconds())
+
+
+class RetryPolicy:
+    """
+    再試行の方針（指数バックオフ + ジッター）
+    タイムアウト、429、5xx のときに max_retries 回まで再試行する
+    Retry-After が max_delay より長い場合は再試行しない
+    """
+
+    RETRY_STATUS = frozenset({429, 500, 502, 503, 504})
+
+    def __init__(self, max_retries=3, base_delay=0.5, max_delay=30.0,
+                 random_func=random.random, sleep=time.sleep):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.random_func = random_func
+        self.sleep = sleep
+
+        # 再試行した回数
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def is_retryable_status(self, status_code):
+        return status_code in self.RETRY_STATUS
+
+    def delay(self, attempt, retry_after=None):
+        """attempt 回目（0始まり）の失敗後に待つ秒数"""
+        # full jitter: 0〜上限の一様乱数にして、同時に失敗したリクエストが揃って再送しないようにする
+        ceiling = min(self.max_delay, self.base_delay * (2 ** attempt))
+        delay = ceiling * self.random_func()
+
+        # サーバーから待ち時間を指定された場合はそれより早く再送しない（ただし max_delay まで）
+        if retry_after is not None:
+            delay = min(max(delay, retry_after), self.max_delay)
+        return delay
+
+    def accepts_retry_after(self, retry_after):
+        """Retry-After が max_delay 以内なら True（長すぎる場合は待たずに諦める）"""
+        return retry_after is None or retry_after <= self.max_delay
+
+    def record_retry(self):
+        with self._lock:
+            self.retries += 1
@@ -0,0 +1,248 @@
+# 気象庁APIのレスポンスの記録と再生（オフラインでの開発・テスト・ベンチマーク用）
+
+import json
+import os
+import random
+import threading
+import time
+from http import HTTPStatus
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from .jma_api import DEFAULT_POOL_SIZE, configure_session
+
+
+# 記録するヘッダー（再生時の条件付きGETに必要なもの）
+RECORDED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified')
+
+# 環境変数で記録・再生を切り替える（main.py から configure_from_env を呼ぶ）
+ENV_RECORD_DIR = 'JMA_RECORD_DIR'
+ENV_REPLAY_DIR = 'JMA_REPLAY_DIR'
+ENV_REPLAY_LATENCY = 'JMA_REPLAY_LATENCY'
+ENV_REPLAY_FAILURE_RATE = 'JMA_REPLAY_FAILURE_RATE'
+
+
+def fixture_name(url):
+    """
+    URLに対応するフィクスチャのファイル名
+    .../forecast/130000.json -> forecast/130000.json、.../area.json -> area.json
+    """
+    parts = urlsplit(url).path.rstrip('/').split('/')
+    if len(parts) >= 2 and parts[-2] == 'forecast':
+        return f"forecast/{parts[-1]}"
+    return parts[-1]
+
+
+def _write_atomic(path, data):
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+class FixtureStore:
+    """
+    フィクスチャディレクトリの読み書き
+    本文は {name}、ステータスとヘッダーは {name}.headers.json に保存する
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _paths(self, name):
+        body_path = os.path.join(self.directory, *name.split('/'))
+        return body_path, body_path + '.headers.json'
+
+    def save(self, url, status_code, headers, body):
+        body_path, meta_path = self._paths(fixture_name(url))
+        os.makedirs(os.path.dirname(body_path), exist_ok=True)
+
+        meta = {
+            'url': url,
+            'status': status_code,
+            'headers': {key: headers[key] for key in RECORDED_HEADERS if key in headers},
+            'recorded_at': time.time(),
+        }
+        _write_atomic(body_path, body)
+        _write_atomic(meta_path, json.dumps(meta, ensure_ascii=False, indent=2).encode('utf-8'))
+
+    def load(self, url):
+        """(ステータス, ヘッダー, 本文) を返す（記録がなければNone）"""
+        body_path, meta_path = self._paths(fixture_name(url))
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            with open(body_path, 'rb') as f:
+                body = f.read()
+        except (OSError, ValueError):
+            return None
+        return meta.get('status', 200), meta.get('headers', {}), body
+
+    def names(self):
+        """記録済みのフィクスチャ名の一覧"""
+        names = []
+        for root, _, files in os.walk(self.directory):
+            for file_name in files:
+                if file_name.endswith('.headers.json'):
+                    path = os.path.join(root, file_name[:-len('.headers.json')])
+                    names.append(os.path.relpath(path, self.directory).replace(os.sep, '/'))
+        return sorted(names)
+
+
+class RecordingAdapter(HTTPAdapter):
+    """通常どおり通信し、成功したレスポンス（200）をフィクスチャとして保存する"""
+
+    def __init__(self, directory, pool_size=DEFAULT_POOL_SIZE):
+        super().__init__(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True)
+        self.store = FixtureStore(directory)
+        self.recorded = 0
+        self._lock = threading.Lock()
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        if response.status_code == 200:
+            # response.content は展開済み（gzipではない）本文。読み込んだ後も呼び出し側で使える
+            self.store.save(request.url, response.status_code, response.headers, response.content)
+            with self._lock:
+                self.recorded += 1
+        return response
+
+
+class ReplayAdapter(BaseAdapter):
+    """
+    記録したフィクスチャからレスポンスを返す（ネットワークには接続しない）
+    - If-None-Match / If-Modified-Since が記録と一致すれば 304 を返す
+    - latency + 0〜jitter 秒の遅延を入れる
+    - failure_rate の割合で 503、timeout_rate の割合でタイムアウトを起こす
+    - 記録がないURLは 404
+    """
+
+    def __init__(self, directory, latency=0.0, jitter=0.0, failure_rate=0.0,
+                 timeout_rate=0.0, seed=None, sleep=time.sleep):
+        super().__init__()
+        self.store = FixtureStore(directory)
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.timeout_rate = timeout_rate
+        self.sleep = sleep
+        # seed を指定すると遅延と失敗の発生が毎回同じになる
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+        self.request_count = 0
+        self.not_modified_count = 0
+        self.failure_count = 0
+        self.missing_count = 0
+
+    def _draw(self):
+        #(遅延秒数, 乱数) を1回のロックで引く
+        with self._lock:
+            self.request_count += 1
+            delay = self.latency + self.jitter * self._random.random()
+            return delay, self._random.random()
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        delay, roll = self._draw()
+        if delay > 0:
+            self.sleep(delay)
+
+        if roll < self.timeout_rate:
+            with self._lock:
+                self.failure_count += 1
+            raise requests.exceptions.ReadTimeout(f"replay: injected timeout ({request.url})", request=request)
+        if roll < self.timeout_rate + self.failure_rate:
+            with self._lock:
+                self.failure_count += 1
+            return self._build_response(request, 503, {}, b'')
+
+        recorded = self.store.load(request.url)
+        if recorded is None:
+            with self._lock:
+                self.missing_count += 1
+            return self._build_response(request, 404, {}, b'')
+
+        status_code, headers, body = recorded
+        if status_code == 200 and self._not_modified(request, headers):
+            with self._lock:
+                self.not_modified_count += 1
+            return self._build_response(request, 304, headers, b'')
+        return self._build_response(request, status_code, headers, body)
+
+    def _not_modified(self, request, headers):
+        etag = headers.get('ETag')
+        last_modified = headers.get('Last-Modified')
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match is not None:
+            return etag is not None and if_none_match == etag
+        if_modified_since = request.headers.get('If-Modified-Since')
+        return last_modified is not None and if_modified_since == last_modified
+
+    def _build_response(self, request, status_code, headers, body):
+        response = requests.Response()
+        response.status_code = status_code
+        response.reason = HTTPStatus(status_code).phrase
+        response.headers = CaseInsensitiveDict(headers)
+        response.headers['Content-Length'] = str(len(body))
+        response._content = body
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                'requests': self.request_count,
+                'not_modified': self.not_modified_count,
+                'failures': self.failure_count,
+                'missing': self.missing_count,
+            }
+
+
+def enable_recording(directory, pool_size=DEFAULT_POOL_SIZE):
+    """共有セッションを記録モードにする（実際に通信しつつフィクスチャを保存）"""
+    adapter = RecordingAdapter(directory, pool_size)
+    configure_session(pool_size, adapter)
+    return adapter
+
+
+def enable_replay(directory, latency=0.0, jitter=0.0, failure_rate=0.0, timeout_rate=0.0, seed=None):
+    """共有セッションを再生モードにする（フィクスチャから応答し、通信しない）"""
+    if not os.path.isdir(directory):
+        raise FileNotFoundError(f"フィクスチャのディレクトリがありません: {directory}")
+    adapter = ReplayAdapter(directory, latency, jitter, failure_rate, timeout_rate, seed)
+    configure_session(adapter=adapter)
+    return adapter
+
+
+def disable(pool_size=DEFAULT_POOL_SIZE):
+    """通常の通信に戻す"""
+    configure_session(pool_size)
+
+
+def configure_from_env():
+    """
+    環境変数 JMA_RECORD_DIR / JMA_REPLAY_DIR が設定されていれば記録・再生モードにする
+    再生時は JMA_REPLAY_LATENCY（秒）と JMA_REPLAY_FAILURE_RATE（0〜1）も使う
+    """
+    replay_dir = os.environ.get(ENV_REPLAY_DIR)
+    if replay_dir:
+        print(f"再生モード: {replay_dir}")
+        return enable_replay(
+            replay_dir,
+            latency=float(os.environ.get(ENV_REPLAY_LATENCY, 0)),
+            failure_rate=float(os.environ.get(ENV_REPLAY_FAILURE_RATE, 0)),
+        )
+
+    record_dir = os.environ.get(ENV_RECORD_DIR)
+    if record_dir:
+        print(f"記録モード: {record_dir}")
+        return enable_recording(record_dir)
+    return None
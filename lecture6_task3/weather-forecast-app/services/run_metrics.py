@@ -0,0 +1,156 @@
+# 自動更新の回ごとの計測値の集計と、Prometheus のテキストファイル・JSON への書き出し
+
+import json
+import os
+from datetime import datetime
+
+
+PROM_FILE = 'weather_update.prom'
+JSON_FILE = 'weather_update.json'
+
+# JSON に載せる過去の回の数（所要時間の推移を見る用）
+HISTORY_RUNS = 20
+
+
+def _quantile(values, q):
+    #昇順の values の q 分位（最近傍）
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def run_summary(db_service, run_id, history=HISTORY_RUNS):
+    """
+    update_run・update_run_area から1回分の計測値を集計して辞書で返す（回がなければ None）
+    - elapsed: 所要時間（秒。再開した回は各実行の合計）
+    - statuses: {状態: 地域数}
+    - fetch_seconds: 取得した地域ごとの待ち時間の count・sum・p50・p95・max
+    - parse_seconds / write_seconds / bytes / rows / retries: 全地域の合計
+    - areas: 地域ごとの計測値、history: 最近の終わった回の所要時間
+    """
+    with db_service.connections.read() as conn:
+        run = conn.execute(
+            "SELECT id, slot, started_at, completed_at, areas, elapsed FROM update_run WHERE id = ?", (run_id,)
+        ).fetchone()
+        if run is None:
+            return None
+        cur = conn.execute("""
+            SELECT area_id, status, attempts, fetch_seconds, bytes, http_retries, status_code,
+                   parse_seconds, write_seconds, rows_inserted, rows_updated, rows_unchanged
+            FROM update_run_area
+            WHERE run_id = ?
+            ORDER BY position
+        """, (run_id,))
+        names = [column[0] for column in cur.description]
+        areas = [dict(zip(names, row)) for row in cur]
+        recent = conn.execute("""
+            SELECT r.id, r.started_at, r.elapsed, r.areas,
+                   (SELECT COUNT(*) FROM update_run_area a WHERE a.run_id = r.id AND a.status = 'error')
+            FROM update_run r
+            WHERE r.completed_at IS NOT NULL AND r.id <= ?
+            ORDER BY r.id DESC
+            LIMIT ?
+        """, (run_id, history)).fetchall()
+
+    statuses = {}
+    for area in areas:
+        statuses[area['status']] = statuses.get(area['status'], 0) + 1
+    # 取得しなかった地域（再開前に終わっていた地域を含む）は待ち時間に数えない
+    fetch_times = sorted(area['fetch_seconds'] for area in areas if area['status_code'] is not None)
+
+    return {
+        'run_id': run[0],
+        'slot': run[1],
+        'started_at': run[2],
+        'completed_at': run[3],
+        'areas_total': run[4],
+        'elapsed': run[5],
+        'statuses': statuses,
+        'fetch_seconds': {
+            'count': len(fetch_times),
+            'sum': sum(fetch_times),
+            'p50': _quantile(fetch_times, 0.5),
+            'p95': _quantile(fetch_times, 0.95),
+            'max': fetch_times[-1] if fetch_times else 0.0,
+        },
+        'parse_seconds': sum(area['parse_seconds'] for area in areas),
+        'write_seconds': sum(area['write_seconds'] for area in areas),
+        'bytes': sum(area['bytes'] for area in areas),
+        'rows': {
+            'inserted': sum(area['rows_inserted'] for area in areas),
+            'updated': sum(area['rows_updated'] for area in areas),
+            'unchanged': sum(area['rows_unchanged'] for area in areas),
+        },
+        'retries': {
+            'http': sum(area['http_retries'] for area in areas),
+            'area': sum(area['attempts'] for area in areas),
+        },
+        'areas': areas,
+        'history': [
+            {'run_id': row[0], 'started_at': row[1], 'elapsed': row[2], 'areas': row[3], 'errors': row[4]}
+            for row in recent
+        ],
+    }
+
+
+def _timestamp(value):
+    return datetime.fromisoformat(value).timestamp() if value else 0
+
+
+def format_textfile(summary):
+    """Prometheus のテキスト形式（node_exporter の textfile collector 用）"""
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP weather_update_{name} {help_text}")
+        lines.append(f"# TYPE weather_update_{name} {kind}")
+        for labels, value in samples:
+            label_text = ','.join(f'{key}="{val}"' for key, val in labels.items())
+            lines.append(f"weather_update_{name}{{{label_text}}} {value}" if label_text
+                         else f"weather_update_{name} {value}")
+
+    fetch = summary['fetch_seconds']
+    metric('last_run_id', 'gauge', "最後に終わった自動更新の回の番号", [({}, summary['run_id'])])
+    metric('last_run_timestamp_seconds', 'gauge', "最後に終わった自動更新の終了時刻（UNIX時間）",
+           [({}, _timestamp(summary['completed_at']))])
+    metric('duration_seconds', 'gauge', "自動更新1回の所要時間", [({}, summary['elapsed'])])
+    metric('areas', 'gauge', "地域の数（状態ごと）",
+           [({'status': status}, count) for status, count in sorted(summary['statuses'].items())])
+    metric('fetch_seconds', 'summary', "地域ごとの天気予報の取得の待ち時間",
+           [({'quantile': '0.5'}, fetch['p50']), ({'quantile': '0.95'}, fetch['p95'])])
+    lines.append(f"weather_update_fetch_seconds_sum {fetch['sum']}")
+    lines.append(f"weather_update_fetch_seconds_count {fetch['count']}")
+    metric('fetch_seconds_max', 'gauge', "地域ごとの取得の待ち時間の最大", [({}, fetch['max'])])
+    metric('parse_seconds', 'gauge', "天気予報の解析にかかった時間の合計", [({}, summary['parse_seconds'])])
+    metric('write_seconds', 'gauge', "DBへの保存にかかった時間の合計（コミットを除く）",
+           [({}, summary['write_seconds'])])
+    metric('bytes', 'gauge', "天気予報の転送量（圧縮後）", [({}, summary['bytes'])])
+    metric('rows', 'gauge', "weather_info の行数（操作ごと）",
+           [({'op': op}, count) for op, count in summary['rows'].items()])
+    metric('retries', 'gauge', "再試行の回数（http: リクエストの再送、area: 地域の取得し直し）",
+           [({'kind': kind}, count) for kind, count in summary['retries'].items()])
+    return '\n'.join(lines) + '\n'
+
+
+def _write_atomic(path, text):
+    # 書きかけのファイルを読まれないよう、別名で書いてから置き換える
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(path + '.tmp', path)
+
+
+def export(db_service, run_id, directory):
+    """
+    1回分の計測値を directory に weather_update.prom と weather_update.json として書き出す
+    (集計結果, prom のパス, json のパス) を返す
+    """
+    summary = run_summary(db_service, run_id)
+    if summary is None:
+        raise ValueError(f"自動更新の回がありません: {run_id}")
+
+    os.makedirs(directory, exist_ok=True)
+    prom_path = os.path.join(directory, PROM_FILE)
+    json_path = os.path.join(directory, JSON_FILE)
+    _write_atomic(prom_path, format_textfile(summary))
+    _write_atomic(json_path, json.dumps(summary, ensure_ascii=False, indent=1))
+    return summary, prom_path, json_path
@@ -0,0 +1,121 @@
+# 自動更新のスケジュール（発表時刻に合わせて起き、地域ごとの取得を時間をずらして行う）
+
+import random
+import time
+from datetime import datetime, timedelta
+
+from .publication import JST, next_publication, previous_publication
+
+
+# 発表時刻から取得を始めるまでの待ち時間（秒）。発表直後はまだファイルが更新されていないことがある
+DEFAULT_DELAY = 10 * 60
+
+# 全地域の取得をずらして行う時間の幅（秒）
+DEFAULT_WINDOW = 30 * 60
+
+# 1回にまとめて取得する間隔（秒）。幅をこの間隔で区切り、地域を振り分ける
+DEFAULT_WAVE_INTERVAL = 60
+
+# 各回の開始時刻をずらす割合（間隔に対する割合。0なら等間隔）
+DEFAULT_JITTER = 0.5
+
+# 1回に眠る最大の時間（秒）。スリープ中にPCが休止しても、復帰後この時間以内に時刻を確かめ直す
+DEFAULT_SLEEP_CHUNK = 60
+
+
+class UpdateScheduler:
+    """
+    発表時刻（5時・11時・17時）の delay 秒後に起き、全地域を window 秒の間に分けて取得する
+    - 最後に更新を終えた発表時刻はDB（update_slot）に残し、止まっていた間に過ぎた発表は起動・復帰時にすぐ取り直す
+      （気象庁は最新の予報しか返さないため、取り直すのは直近の発表の1回だけ）
+    - 眠るときは壁時計の時刻を見ながら sleep_chunk 秒ずつ眠る（休止・時刻の変更の後もずれない）
+    clock / sleep / rng はテスト用に差し替えられる
+    """
+
+    def __init__(self, db_service, delay=DEFAULT_DELAY, window=DEFAULT_WINDOW,
+                 wave_interval=DEFAULT_WAVE_INTERVAL, jitter=DEFAULT_JITTER,
+                 sleep_chunk=DEFAULT_SLEEP_CHUNK, clock=time.time, sleep=time.sleep, rng=None):
+        if delay < 0 or window < 0:
+            raise ValueError(f"delay・window は0以上: delay={delay}, window={window}")
+        if wave_interval <= 0 or sleep_chunk <= 0:
+            raise ValueError(f"wave_interval・sleep_chunk は正の数: {wave_interval}, {sleep_chunk}")
+        if not 0 <= jitter <= 1:
+            raise ValueError(f"jitter は0〜1: {jitter}")
+
+        self.db_service = db_service
+        self.delay = delay
+        self.window = window
+        self.wave_interval = wave_interval
+        self.jitter = jitter
+        self.sleep_chunk = sleep_chunk
+        self.clock = clock
+        self.sleep = sleep
+        self.rng = rng or random.Random()
+
+    def now(self):
+        return datetime.fromtimestamp(self.clock(), JST)
+
+    def due_slot(self, now=None):
+        """
+        取得すべき発表時刻（まだ更新を終えていない直近の発表。なければ None）
+        (発表時刻, 飛ばした発表の数) を返す
+        """
+        now = now or self.now()
+        slot = previous_publication(now - timedelta(seconds=self.delay))
+        last = self.db_service.get_last_update_slot()
+        if last is not None and slot <= last:
+            return None
+
+        # 止まっていた間に過ぎた、取り直さない発表の数
+        skipped = 0
+        if last is not None:
+            missed = next_publication(last)
+            while missed < slot:
+                skipped += 1
+                missed = next_publication(missed)
+        return slot, skipped
+
+    def next_wake(self, now=None):
+        """次の発表時刻 + delay（日本時間のdatetime）"""
+        now = now or self.now()
+        delay = timedelta(seconds=self.delay)
+        return next_publication(now - delay) + delay
+
+    def sleep_until(self, target):
+        """壁時計で target（datetime）になるまで sleep_chunk 秒ずつ眠る"""
+        deadline = target.timestamp()
+        while True:
+            remaining = deadline - self.clock()
+            if remaining <= 0:
+                return
+            self.sleep(min(remaining, self.sleep_chunk))
+
+    def plan(self, codes, slot, now=None, ordered=False):
+        """
+        地域コードを取得する回に振り分け、[(開始時刻, [地域コード])] を時刻順で返す
+        開始は発表時刻 + delay（過ぎていれば今）から window 秒の間で、各回の開始は jitter でずらす
+        ordered なら codes の順（優先順）に前の回から振り分け、そうでなければ順番を混ぜる
+        （いつも同じ地域が最後にならないように）
+        """
+        now = now or self.now()
+        start = max(slot + timedelta(seconds=self.delay), now)
+        codes = list(codes)
+        if not ordered:
+            self.rng.shuffle(codes)
+
+        waves = max(1, min(len(codes), int(self.window // self.wave_interval)))
+        spacing = self.window / waves
+        plan = []
+        for i in range(waves):
+            offset = i * spacing + self.rng.uniform(0, spacing * self.jitter)
+            wave = codes[len(codes) * i // waves:len(codes) * (i + 1) // waves]
+            plan.append((start + timedelta(seconds=offset), wave))
+        return [wave for wave in plan if wave[1]]
+
+    def start_slot(self, slot):
+        """発表時刻の更新を始めたことを記録する（終える前に止まったら次回また取り直す）"""
+        self.db_service.start_update_slot(slot, self.now())
+
+    def complete_slot(self, slot, areas, errors):
+        """発表時刻の更新を終えたことを記録する（次回以降はこの発表を取り直さない）"""
+        self.db_service.complete_update_slot(slot, self.now(), areas, errors)
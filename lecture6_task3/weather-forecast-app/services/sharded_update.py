@@ -0,0 +1,178 @@
+# 全地域の更新の取得・解析を複数のプロセスに分け、保存はこのプロセスの1本のスレッドで行う
+
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .forecast_model import parse_forecast
+from .jma_api import NOT_MODIFIED, JmaApiService, configure_session
+from .update_pipeline import UpdatePipeline, _Stage
+
+
+# プロセスが終わったか確かめる間隔（秒）
+_POLL_INTERVAL = 0.5
+
+
+class _ShardValidators:
+    #子プロセス用の前回の検証子（DBは開かない。新しい検証子は結果と一緒に親へ送る）
+
+    def __init__(self, validators):
+        self.validators = validators
+
+    def get_forecast_validators(self, area_code):
+        return self.validators.get(area_code)
+
+
+def _portable_error(error):
+    #例外は別のプロセスへ送れるとは限らないため、種類とメッセージだけにする
+    return RuntimeError(f"{type(error).__name__}: {error}")
+
+
+def _worker_main(shard_id, areas, validators, options, results):
+    #子プロセス: 受け持ちの地域を取得・解析し、1地域ずつ results に送る
+    JmaApiService.FORECAST_URL = options['forecast_url']
+    JmaApiService.configure_rate_limit(options['rate'], options['burst'])
+    JmaApiService.retry_policy.max_retries = options['max_retries']
+    configure_session(options['concurrency'])
+    store = _ShardValidators(validators)
+    fetch = options['fetch']
+
+    def work(area):
+        info = {}
+        start = time.perf_counter()
+        try:
+            result = fetch(area[0]) if fetch else JmaApiService._fetch_forecast(area[0], store, info)
+        except Exception as e:
+            result = _portable_error(e)
+        fetch_seconds = time.perf_counter() - start
+
+        parse_seconds = 0.0
+        if not isinstance(result, Exception) and result is not NOT_MODIFIED:
+            start = time.perf_counter()
+            try:
+                result = parse_forecast(result)
+            except Exception as e:
+                result = _portable_error(e)
+            parse_seconds = time.perf_counter() - start
+
+        metrics = {
+            'fetch_seconds': fetch_seconds, 'parse_seconds': parse_seconds, 'bytes': info.get('bytes', 0),
+            'http_retries': info.get('retries', 0), 'status_code': info.get('status_code'),
+        }
+        results.put((shard_id, area, result, metrics, info.get('validators')))
+
+    with ThreadPoolExecutor(options['concurrency']) as pool:
+        for _ in pool.map(work, areas):
+            pass
+    results.put((shard_id, None, None, None, None))
+
+
+class ShardedUpdatePipeline(UpdatePipeline):
+    """
+    UpdatePipeline の取得・解析を workers 個のプロセスに分ける（解析は CPU を使うため、1プロセスでは頭打ちになる）
+    - 地域（office）を順番に各プロセスへ振り分け、各プロセスは concurrency 本のスレッドで取得・解析する
+    - 解析した予報はキューでこのプロセスに送り、保存は今までどおり1本のスレッドが行う（DBに書くのはこのプロセスだけ）
+    - 失敗した地域の再試行は、このプロセスの取得スレッドで行う
+    - レート制限は各プロセスとこのプロセス（再試行）で rate / (workers + 1) ずつ分ける（全体で rate を超えない）
+    fetch を渡す場合は、別のプロセスに送れる（モジュールの関数など）ものにする
+    """
+
+    def __init__(self, db_service, workers=2, **options):
+        if workers < 1:
+            raise ValueError(f"workers は1以上: {workers}")
+        super().__init__(db_service, **options)
+        self.workers = workers
+        self._processes = []
+        self._receiver = None
+        # 実行中に変更したこのプロセスのレート制限の元の (rate, burst)
+        self._parent_limit = None
+
+    def _feed(self, areas, codes, parse_queue, stages):
+        # OS によらず同じ動きにするため、子プロセスは spawn で起動する（fork だとロック・接続を引き継ぐ）
+        context = multiprocessing.get_context('spawn')
+        results = context.Queue(self.queue_size)
+        limiter = JmaApiService.rate_limiter
+        shares = self.workers + 1
+        rate, burst = limiter.rate / shares, max(1, limiter.burst / shares)
+        self._parent_limit = (limiter.rate, limiter.burst)
+        JmaApiService.configure_rate_limit(rate, burst)
+        options = {
+            'forecast_url': JmaApiService.FORECAST_URL,
+            'rate': rate,
+            'burst': burst,
+            'max_retries': JmaApiService.retry_policy.max_retries,
+            'concurrency': self.concurrency,
+            'fetch': self.fetch,
+        }
+        shards = [areas[i::self.workers] for i in range(self.workers)]
+        stages['shard'] = _Stage('shard', self.workers * self.concurrency)
+
+        self._processes = []
+        for shard_id, shard in enumerate(shards):
+            # 前回の検証子は親が読んで渡す（子プロセスはDBを開かない）
+            validators = {}
+            for code, _ in shard:
+                found = self.db_service.get_forecast_validators(code)
+                if found:
+                    validators[code] = found
+            process = context.Process(
+                target=_worker_main, args=(shard_id, shard, validators, options, results),
+                name=f'update-shard-{shard_id}', daemon=True,
+            )
+            process.start()
+            self._processes.append(process)
+
+        self._receiver = threading.Thread(
+            target=self._receive, args=(results, shards, parse_queue, stages['shard']),
+            name='update-receive', daemon=True,
+        )
+        self._receiver.start()
+
+    def _finish_feed(self):
+        self._receiver.join()
+        for process in self._processes:
+            process.join()
+        self._processes = []
+        JmaApiService.configure_rate_limit(*self._parent_limit)
+
+    def _receive(self, results, shards, parse_queue, stage):
+        #子プロセスの結果を解析の段へ渡す（解析済みの予報は解析の段をそのまま通る）
+        pending = [{area[0]: area for area in shard} for shard in shards]
+        running = set(range(len(shards)))
+        while running:
+            # 待つ前に終了していたプロセスの結果は、待っている間にすべて受け取れる
+            exited = [i for i in running if not self._processes[i].is_alive()]
+            try:
+                shard_id, area, result, metrics, validators = results.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                # 終わりを送らずに終了したプロセスの残りの地域は失敗にする
+                for shard_id in exited:
+                    running.discard(shard_id)
+                    self._fail_shard(shard_id, pending[shard_id], parse_queue)
+                continue
+            if area is None:
+                running.discard(shard_id)
+                continue
+
+            pending[shard_id].pop(area[0], None)
+            stage.record(1, metrics['fetch_seconds'] + metrics['parse_seconds'])
+
+            area_metrics = self.area_metrics[area[0]]
+            area_metrics['attempts'] += 1
+            for key in ('fetch_seconds', 'parse_seconds', 'bytes', 'http_retries'):
+                area_metrics[key] += metrics[key]
+            area_metrics['status_code'] = metrics['status_code']
+            # 検証子は保存のスレッドが行と一緒に保存する
+            parse_queue.put((area, 0, result, validators))
+
+    def _fail_shard(self, shard_id, pending, parse_queue):
+        #途中で終了したプロセスの残りの地域（再試行するならこのプロセスの取得スレッドで取得し直す）
+        if not pending:
+            return
+        exitcode = self._processes[shard_id].exitcode
+        print(f"取得のプロセス {shard_id} が終了しました（終了コード {exitcode}、残り{len(pending)}地域）")
+        for area in pending.values():
+            parse_queue.put((area, 0, RuntimeError(f"取得のプロセスが終了しました（終了コード {exitcode}）"), None))
+        pending.clear()
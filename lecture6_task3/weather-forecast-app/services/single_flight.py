@@ -0,0 +1,76 @@
+# 同じキーへの同時リクエストを1回にまとめる（single-flight）
+
+import asyncio
+import threading
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    同じキーで同時に呼ばれた処理を1回だけ実行し、全員に同じ結果（または例外）を返す
+    スレッドからは do()、asyncioからは do_async() を使う
+    結果のオブジェクトは呼び出し元で共有されるため、変更しないこと
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+        # 実際に実行した回数と、相乗りして実行を省略した回数
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.executed += 1
+                leader = True
+
+        if not leader:
+            # 先に始めた呼び出しの完了を待って結果を共有する
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    async def do_async(self, key, func):
+        """do() をスレッドで実行し、イベントループを止めずに待つ"""
+        return await asyncio.to_thread(self.do, key, func)
+
+    def in_flight(self):
+        """実行中のキーの数"""
+        with self._lock:
+            return len(self._calls)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'executed': self.executed,
+                'coalesced': self.coalesced,
+                'in_flight': len(self._calls),
+            }
@@ -0,0 +1,351 @@
+# 全地域の更新を 取得 → 解析 → 保存 の段に分け、上限付きのキューでつなぐ
+
+import queue
+import threading
+import time
+
+from .forecast_model import ForecastBundle, parse_forecast
+from .jma_api import DEFAULT_POOL_SIZE, NOT_MODIFIED, JmaApiService
+
+
+# 解析のスレッド数（解析は短いので少なくてよい）
+DEFAULT_PARSE_WORKERS = 2
+
+# 段の間のキューの上限（保存が遅れたら取得を待たせる）
+DEFAULT_QUEUE_SIZE = 64
+
+# 1回のトランザクションで保存する地域の数と、まとまるのを待つ時間（秒）
+DEFAULT_WRITE_BATCH = 32
+DEFAULT_BATCH_WAIT = 0.05
+
+# 失敗した地域を取得し直す回数と、最初に待つ時間（秒）（自動更新で使う RetryPolicy の設定）
+DEFAULT_AREA_RETRIES = 2
+DEFAULT_AREA_RETRY_DELAY = 10.0
+DEFAULT_AREA_RETRY_MAX_DELAY = 120.0
+
+_DONE = object()
+
+
+def new_area_metrics():
+    """地域ごとの計測値（秒・バイト・行数・回数）"""
+    return {
+        'attempts': 0, 'fetch_seconds': 0.0, 'bytes': 0, 'http_retries': 0, 'status_code': None,
+        'parse_seconds': 0.0, 'write_seconds': 0.0, 'inserted': 0, 'updated': 0, 'unchanged': 0,
+    }
+
+
+class _MeteredQueue(queue.Queue):
+    #入れるたびに中身の数を記録する（平均・最大の占有率の報告用）
+
+    def __init__(self, name, maxsize=0):
+        super().__init__(maxsize)
+        self.name = name
+        self.samples = 0
+        self.occupancy_total = 0
+        self.occupancy_max = 0
+        # 満杯で待たされた時間（秒）
+        self.blocked = 0.0
+
+    def put(self, item, block=True, timeout=None):
+        start = time.perf_counter()
+        super().put(item, block, timeout)
+        blocked = time.perf_counter() - start
+        size = self.qsize()
+        with self.mutex:
+            self.blocked += blocked
+            self.samples += 1
+            self.occupancy_total += size
+            self.occupancy_max = max(self.occupancy_max, size)
+
+    def report(self):
+        return {
+            'capacity': self.maxsize,
+            'avg': self.occupancy_total / self.samples if self.samples else 0.0,
+            'max': self.occupancy_max,
+            'blocked': self.blocked,
+        }
+
+
+class _Stage:
+    #段ごとの処理件数・処理中の時間
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.busy = 0.0
+        self._lock = threading.Lock()
+        self._running = workers
+
+    def record(self, items, busy):
+        with self._lock:
+            self.items += items
+            self.busy += busy
+
+    def finish(self):
+        """スレッドが1本終わったことを記録し、最後の1本なら True"""
+        with self._lock:
+            self._running -= 1
+            return self._running == 0
+
+    def report(self, elapsed):
+        return {
+            'workers': self.workers,
+            'items': self.items,
+            'busy': self.busy,
+            'throughput': self.items / elapsed if elapsed else 0.0,
+            # 段のスレッドが処理していた時間の割合
+            'utilization': self.busy / (elapsed * self.workers) if elapsed else 0.0,
+        }
+
+
+class UpdatePipeline:
+    """
+    取得（concurrency 本のスレッド）→ 解析（parse_workers 本）→ 保存（1本）
+    保存は write_batch 地域ずつ1つのトランザクションで行い、地域ごとに SAVEPOINT を使うため
+    1地域の失敗で同じトランザクションの他の地域を失わない
+    retry_policy（RetryPolicy）を渡すと、失敗した地域をバックオフの後に取得の段へ戻す
+    （待っている間も他の地域の取得は続ける）
+    地域ごとの結果は on_result(area_code, status, detail) で保存用のスレッドから通知する
+    - status: 'saved'（detail は (挿入件数, 更新件数, 変更なしの件数)）、'not_modified'、'error'（detail は例外）
+    - 'retry'（detail は (何回目の再試行か, 待つ秒数, 例外)）の後、同じ地域の結果がもう一度通知される
+    """
+
+    def __init__(self, db_service, concurrency=DEFAULT_POOL_SIZE, parse_workers=DEFAULT_PARSE_WORKERS,
+                 queue_size=DEFAULT_QUEUE_SIZE, write_batch=DEFAULT_WRITE_BATCH,
+                 batch_wait=DEFAULT_BATCH_WAIT, fetch=None, on_result=None, retry_policy=None):
+        self.db_service = db_service
+        self.concurrency = concurrency
+        self.parse_workers = parse_workers
+        self.queue_size = queue_size
+        self.write_batch = write_batch
+        self.batch_wait = batch_wait
+        # 既定は条件付きGET（検証子はDBに保存）。fetch(area_code) を渡すと差し替える
+        self.fetch = fetch
+        self.on_result = on_result
+        self.retry_policy = retry_policy
+        self.batches = 0
+        self.retries = 0
+        self.area_metrics = {}
+        self._lock = threading.Lock()
+        self._remaining = 0
+
+    def run(self, areas):
+        """
+        areas の (地域コード, 地域名) をすべて更新し、段ごとの統計を返す
+        {'elapsed', 'batches', 'retries', 'stages': {段: {...}}, 'queues': {キュー: {...}}, 'areas': {地域コード: {...}}}
+        areas は地域ごとの計測値（new_area_metrics() のキー。再試行した場合は合計）
+        """
+        self.batches = 0
+        self.retries = 0
+        codes = queue.Queue()
+        areas = list(areas)
+        self.area_metrics = {area[0]: new_area_metrics() for area in areas}
+        # 再試行で戻ってくる地域があるため、すべての地域の結果が出てから取得の段を終える
+        self._remaining = len(areas)
+        if not areas:
+            self._stop_fetch(codes)
+
+        parse_queue = _MeteredQueue('parse', self.queue_size)
+        write_queue = _MeteredQueue('write', self.queue_size)
+        stages = {
+            'fetch': _Stage('fetch', self.concurrency),
+            'parse': _Stage('parse', self.parse_workers),
+            'write': _Stage('write', 1),
+        }
+
+        threads = [
+            threading.Thread(target=self._fetch_worker, args=(codes, parse_queue, stages['fetch']),
+                             name=f'update-fetch-{i}', daemon=True)
+            for i in range(self.concurrency)
+        ] + [
+            threading.Thread(target=self._parse_worker, args=(parse_queue, write_queue, stages['parse']),
+                             name=f'update-parse-{i}', daemon=True)
+            for i in range(self.parse_workers)
+        ] + [
+            threading.Thread(target=self._write_worker, args=(codes, write_queue, stages['write']),
+                             name='update-write', daemon=True),
+        ]
+
+        start = time.perf_counter()
+        self._feed(areas, codes, parse_queue, stages)
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self._finish_feed()
+        elapsed = time.perf_counter() - start
+
+        return {
+            'elapsed': elapsed,
+            'batches': self.batches,
+            'retries': self.retries,
+            'stages': {name: stage.report(elapsed) for name, stage in stages.items()},
+            'queues': {q.name: q.report() for q in (parse_queue, write_queue)},
+            'areas': self.area_metrics,
+        }
+
+    def _feed(self, areas, codes, parse_queue, stages):
+        #地域を取得の段に入れる（取得・解析を別のプロセスで行う場合は差し替える）
+        for area in areas:
+            codes.put((area, 0))
+
+    def _finish_feed(self):
+        pass
+
+    def _fetch_worker(self, codes, parse_queue, stage):
+        while True:
+            item = codes.get()
+            if item is _DONE:
+                break
+            area, attempt = item
+            metrics = self.area_metrics[area[0]]
+            info = {}
+            start = time.perf_counter()
+            try:
+                if self.fetch:
+                    result = self.fetch(area[0])
+                else:
+                    result = JmaApiService._fetch_forecast(area[0], self.db_service, info)
+            except Exception as e:
+                result = e
+            elapsed = time.perf_counter() - start
+            stage.record(1, elapsed)
+
+            metrics['attempts'] += 1
+            metrics['fetch_seconds'] += elapsed
+            metrics['bytes'] += info.get('bytes', 0)
+            metrics['http_retries'] += info.get('retries', 0)
+            metrics['status_code'] = info.get('status_code')
+            # 検証子は保存のスレッドが行と一緒に保存する
+            parse_queue.put((area, attempt, result, info.get('validators')))
+
+        # 最後の取得スレッドが解析の段に終わりを伝える
+        if stage.finish():
+            for _ in range(self.parse_workers):
+                parse_queue.put(_DONE)
+
+    def _parse_worker(self, parse_queue, write_queue, stage):
+        while True:
+            item = parse_queue.get()
+            if item is _DONE:
+                break
+            area, attempt, result, validators = item
+            if not isinstance(result, (Exception, ForecastBundle)) and result is not NOT_MODIFIED:
+                start = time.perf_counter()
+                try:
+                    result = parse_forecast(result)
+                except Exception as e:
+                    result = e
+                elapsed = time.perf_counter() - start
+                stage.record(1, elapsed)
+                self.area_metrics[area[0]]['parse_seconds'] += elapsed
+            write_queue.put((area, attempt, result, validators))
+
+        if stage.finish():
+            write_queue.put(_DONE)
+
+    def _stop_fetch(self, codes):
+        for _ in range(self.concurrency):
+            codes.put(_DONE)
+
+    def _notify(self, area_code, status, detail):
+        if not self.on_result:
+            return
+        try:
+            self.on_result(area_code, status, detail)
+        except Exception as e:
+            # 通知の失敗で保存を止めない（止めると前の段が待ち続ける）
+            print(f"結果の通知エラー ({area_code}): {e}")
+
+    def _write_worker(self, codes, write_queue, stage):
+        done = False
+        while not done:
+            item = write_queue.get()
+            if item is _DONE:
+                break
+
+            # 少し待って溜まった分をまとめる
+            batch = [item]
+            deadline = time.perf_counter() + self.batch_wait
+            while len(batch) < self.write_batch:
+                try:
+                    item = write_queue.get(timeout=max(0.0, deadline - time.perf_counter()))
+                except queue.Empty:
+                    break
+                if item is _DONE:
+                    done = True
+                    break
+                batch.append(item)
+
+            start = time.perf_counter()
+            results = self._write_batch(batch)
+            stage.record(len(batch), time.perf_counter() - start)
+            self.batches += 1
+
+            for (area, attempt, _, _), (status, detail) in zip(batch, results):
+                policy = self.retry_policy
+                if status == 'error' and policy and attempt < policy.max_retries:
+                    # バックオフの後で取得の段に戻す（その間も他の地域は進める）
+                    delay = policy.delay(attempt)
+                    self.retries += 1
+                    self._notify(area[0], 'retry', (attempt + 1, delay, detail))
+                    timer = threading.Timer(delay, codes.put, args=((area, attempt + 1),))
+                    timer.daemon = True
+                    timer.start()
+                    continue
+
+                self._notify(area[0], status, detail)
+                with self._lock:
+                    self._remaining -= 1
+                    finished = self._remaining == 0
+                if finished:
+                    self._stop_fetch(codes)
+
+    def _write_batch(self, batch):
+        #地域ごとに SAVEPOINT を使い、1つのトランザクションでまとめて保存する
+        db_service = self.db_service
+        results = []
+        try:
+            with db_service.connections.write() as conn:
+                if not conn.in_transaction:
+                    conn.execute("BEGIN IMMEDIATE")
+                for (area_code, area_name), _, result, validators in batch:
+                    if result is NOT_MODIFIED:
+                        results.append(('not_modified', None))
+                        continue
+                    if isinstance(result, Exception):
+                        results.append(('error', result))
+                        continue
+
+                    start = time.perf_counter()
+                    conn.execute("SAVEPOINT update_area")
+                    try:
+                        area_db_id = db_service.insert_area(area_name, area_code)
+                        if area_db_id is None:
+                            raise RuntimeError("エリアの登録に失敗")
+                        counts = db_service.upsert_weather_data([(area_db_id, result)])
+                        # 検証子は行と同じ SAVEPOINT で保存する（保存できなかった地域の検証子は捨てる）
+                        if validators:
+                            db_service.save_forecast_validators(area_code, *validators)
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO update_area")
+                        results.append(('error', e))
+                    else:
+                        results.append(('saved', counts))
+                        metrics = self.area_metrics[area_code]
+                        metrics['inserted'], metrics['updated'], metrics['unchanged'] = counts
+                    conn.execute("RELEASE update_area")
+                    # コミットの時間は含まない（段の統計の write に含まれる）
+                    self.area_metrics[area_code]['write_seconds'] += time.perf_counter() - start
+
+                # 保存できなかった地域は次回304にならないよう検証子を消しておく
+                for ((area_code, _), _, _, _), (status, _) in zip(batch, results):
+                    if status == 'error':
+                        db_service.delete_forecast_validators(area_code)
+        except Exception as e:
+            # コミットに失敗した場合はまとめて失敗にする
+            for (area_code, _), _, _, _ in batch:
+                db_service.delete_forecast_validators(area_code)
+            return [('error', e)] * len(batch)
+        return results
@@ -0,0 +1,122 @@
+# 自動更新の1回分の記録（地域ごとの状態）。途中で止まっても、残りの地域から再開できる
+
+from datetime import datetime
+
+from .publication import JST
+
+
+# 地域ごとの状態
+PENDING = 'pending'          # まだ取得していない
+RETRYING = 'retry'           # 失敗して再試行待ち
+DONE_STATUSES = ('saved', 'not_modified')
+
+# 再開するときに取得し直す状態（失敗して諦めた地域も含める）
+INCOMPLETE_STATUSES = (PENDING, RETRYING, 'error')
+
+
+def _now():
+    return datetime.now(JST).isoformat()
+
+
+class UpdateRun:
+    """
+    update_run・update_run_area 表に残す1回分の更新
+    start() で対象の地域を順番どおり pending として記録し、record() で地域ごとの結果を記録する
+    find_incomplete() で終わっていない最新の回を探し、pending() の地域から再開できる
+    """
+
+    def __init__(self, db_service, run_id, started_at, slot=None):
+        self.db_service = db_service
+        self.id = run_id
+        self.started_at = started_at
+        self.slot = slot
+
+    @classmethod
+    def start(cls, db_service, codes, slot=None):
+        """新しい回を始める（slot は発表時刻のdatetime。定期更新以外では None）"""
+        started_at = _now()
+        slot = slot.isoformat() if slot else None
+        with db_service.connections.write() as conn:
+            # 再開しなかった回は打ち切る（次に再開するのは新しい回）
+            conn.execute("UPDATE update_run SET completed_at = ? WHERE completed_at IS NULL", (started_at,))
+            cur = conn.execute(
+                "INSERT INTO update_run (slot, started_at, areas) VALUES (?, ?, ?)",
+                (slot, started_at, len(codes)),
+            )
+            run_id = cur.lastrowid
+            conn.executemany(
+                "INSERT INTO update_run_area (run_id, area_id, position, status) VALUES (?, ?, ?, ?)",
+                [(run_id, code, position, PENDING) for position, code in enumerate(codes)],
+            )
+        return cls(db_service, run_id, started_at, slot)
+
+    @classmethod
+    def find_incomplete(cls, db_service, slot=None):
+        """終わっていない最新の回（slot を指定するとその発表時刻の回だけ。なければ None）"""
+        sql = "SELECT id, started_at, slot FROM update_run WHERE completed_at IS NULL"
+        params = ()
+        if slot is not None:
+            sql += " AND slot = ?"
+            params = (slot.isoformat(),)
+        with db_service.connections.read() as conn:
+            row = conn.execute(sql + " ORDER BY id DESC LIMIT 1", params).fetchone()
+        if row is None:
+            return None
+        return cls(db_service, row[0], row[1], row[2])
+
+    def pending(self):
+        """まだ終わっていない地域コード（最初の順番どおり）"""
+        placeholders = ', '.join('?' * len(INCOMPLETE_STATUSES))
+        with self.db_service.connections.read() as conn:
+            return [code for (code,) in conn.execute(f"""
+                SELECT area_id FROM update_run_area
+                WHERE run_id = ? AND status IN ({placeholders})
+                ORDER BY position
+            """, (self.id, *INCOMPLETE_STATUSES))]
+
+    def record(self, area_code, status, error=None):
+        """地域の結果を記録する（'retry' は試行回数を1増やす）"""
+        with self.db_service.connections.write() as conn:
+            conn.execute("""
+                UPDATE update_run_area
+                SET status = ?, attempts = attempts + ?, error = ?, updated_at = ?
+                WHERE run_id = ? AND area_id = ?
+            """, (status, 1 if status == RETRYING else 0,
+                  None if error is None else str(error), _now(), self.id, area_code))
+
+    def record_metrics(self, area_metrics, elapsed):
+        """
+        地域ごとの計測値（UpdatePipeline.run() の 'areas'）と、この実行にかかった時間（秒）を足す
+        再開した回では前の実行の値に足される
+        """
+        with self.db_service.connections.write() as conn:
+            conn.executemany("""
+                UPDATE update_run_area SET
+                    fetch_seconds = fetch_seconds + ?,
+                    bytes = bytes + ?,
+                    http_retries = http_retries + ?,
+                    status_code = coalesce(?, status_code),
+                    parse_seconds = parse_seconds + ?,
+                    write_seconds = write_seconds + ?,
+                    rows_inserted = rows_inserted + ?,
+                    rows_updated = rows_updated + ?,
+                    rows_unchanged = rows_unchanged + ?
+                WHERE run_id = ? AND area_id = ?
+            """, [
+                (m['fetch_seconds'], m['bytes'], m['http_retries'], m['status_code'],
+                 m['parse_seconds'], m['write_seconds'], m['inserted'], m['updated'], m['unchanged'],
+                 self.id, code)
+                for code, m in area_metrics.items()
+            ])
+            conn.execute("UPDATE update_run SET elapsed = elapsed + ? WHERE id = ?", (elapsed, self.id))
+
+    def complete(self):
+        with self.db_service.connections.write() as conn:
+            conn.execute("UPDATE update_run SET completed_at = ? WHERE id = ?", (_now(), self.id))
+
+    def summary(self):
+        """{状態: 地域数}"""
+        with self.db_service.connections.read() as conn:
+            return dict(conn.execute(
+                "SELECT status, COUNT(*) FROM update_run_area WHERE run_id = ? GROUP BY status", (self.id,)
+            ))
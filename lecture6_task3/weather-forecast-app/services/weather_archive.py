@@ -0,0 +1,228 @@
+# weather_info の列ごとのバイナリ形式への書き出し（月ごとのパーティション）と、numpy.memmap での読み込み
+
+import json
+import os
+import shutil
+import sys
+from array import array
+from datetime import datetime
+
+from .publication import JST
+
+
+MANIFEST_NAME = 'manifest.json'
+FORMAT_VERSION = 1
+
+# 列名 -> (array の型, numpy の dtype, 欠損値)
+# 文字列の列は辞書（manifest の dictionaries）の番号で持つ
+COLUMNS = {
+    'time': ('q', '<i8', None),             # UNIX時間（秒）
+    'min_temperature': ('f', '<f4', float('nan')),
+    'max_temperature': ('f', '<f4', float('nan')),
+    'rain_proba': ('b', 'i1', -1),
+    'area': ('i', '<i4', -1),               # 地域コード
+    'weather': ('i', '<i4', -1),
+    'wind': ('i', '<i4', -1),
+    'wave': ('i', '<i4', -1),
+}
+
+DICTIONARY_COLUMNS = ('area', 'weather', 'wind', 'wave')
+
+# 1回に SQLite から読む行数
+DEFAULT_FETCH_SIZE = 10000
+
+
+def _month_range(month):
+    year, number = int(month[:4]), int(month[5:7])
+    end = f"{year + 1:04d}-01" if number == 12 else f"{year:04d}-{number + 1:02d}"
+    return month, end
+
+
+def load_manifest(directory):
+    """manifest.json を読む（なければ空の manifest）"""
+    path = os.path.join(directory, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {
+            'version': FORMAT_VERSION,
+            'columns': {name: dtype for name, (_, dtype, _) in COLUMNS.items()},
+            'dictionaries': {name: [] for name in DICTIONARY_COLUMNS},
+            'partitions': {},
+        }
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _save_manifest(directory, manifest):
+    # 書きかけの manifest を読まれないよう、別名で書いてから置き換える
+    path = os.path.join(directory, MANIFEST_NAME)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(path + '.tmp', path)
+
+
+class _Encoder:
+    #文字列 -> 辞書の番号（既存の番号は変えず、新しい値は末尾に追加）
+
+    def __init__(self, values):
+        self.values = values
+        self.codes = {value: code for code, value in enumerate(values)}
+
+    def encode(self, value):
+        if value is None:
+            return -1
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.values.append(value)
+            self.codes[value] = code
+        return code
+
+
+def _write_partition(conn, directory, month, encoders, fetch_size):
+    #1か月分の行を列ごとの配列にして、一時ディレクトリに書いてから置き換える
+    start, end = _month_range(month)
+    columns = {name: array(typecode) for name, (typecode, _, _) in COLUMNS.items()}
+    # 時刻順に読むので、読み込み側は searchsorted で期間を切り出せる
+    cur = conn.execute("""
+        SELECT w.time, w.min_temperature, w.max_temperature, w.rain_proba,
+               a.area_id, w.weather, w.wind, w.wave
+        FROM weather_info w
+        JOIN area a ON w.area_id = a.id
+        WHERE w.time >= ? AND w.time < ?
+        ORDER BY w.time, w.id
+    """, (start, end))
+
+    nan = float('nan')
+    while True:
+        rows = cur.fetchmany(fetch_size)
+        if not rows:
+            break
+        for time, low, high, pop, area, weather, wind, wave in rows:
+            columns['time'].append(int(datetime.fromisoformat(time).timestamp()))
+            columns['min_temperature'].append(nan if low is None else low)
+            columns['max_temperature'].append(nan if high is None else high)
+            columns['rain_proba'].append(-1 if pop is None else pop)
+            columns['area'].append(encoders['area'].encode(area))
+            columns['weather'].append(encoders['weather'].encode(weather))
+            columns['wind'].append(encoders['wind'].encode(wind))
+            columns['wave'].append(encoders['wave'].encode(wave))
+
+    temp_dir = os.path.join(directory, month + '.tmp')
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    os.makedirs(temp_dir)
+    for name, values in columns.items():
+        if sys.byteorder == 'big':
+            values.byteswap()
+        with open(os.path.join(temp_dir, f"{name}.bin"), 'wb') as f:
+            values.tofile(f)
+
+    target = os.path.join(directory, month)
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(temp_dir, target)
+    return len(columns['time'])
+
+
+def export_archive(manager, directory, now=None, fetch_size=DEFAULT_FETCH_SIZE):
+    """
+    weather_info を月ごとに列ごとのバイナリファイルへ書き出す（差分のみ）
+    - 書き出すのは今月（日本時間）より前の、まだ書き出していない月だけ（過去の月の行は増えないため）
+    - 文字列の辞書は追記のみなので、書き出し済みの月の番号は変わらない
+    書き出した月のリストと行数を (months, rows) で返す
+    """
+    now = now.astimezone(JST) if now else datetime.now(JST)
+    current_month = now.strftime('%Y-%m')
+
+    os.makedirs(directory, exist_ok=True)
+    manifest = load_manifest(directory)
+    encoders = {name: _Encoder(manifest['dictionaries'][name]) for name in DICTIONARY_COLUMNS}
+
+    with manager.read() as conn:
+        months = [
+            month for (month,) in conn.execute("""
+                SELECT DISTINCT substr(time, 1, 7) FROM weather_info
+                WHERE time < ?
+                ORDER BY 1
+            """, (current_month,))
+            if month not in manifest['partitions']
+        ]
+
+        exported = []
+        total = 0
+        for month in months:
+            count = _write_partition(conn, directory, month, encoders, fetch_size)
+            manifest['partitions'][month] = {'rows': count}
+            # 1か月ごとに manifest を更新する（途中で止まっても書き出し済みの月はそのまま）
+            _save_manifest(directory, manifest)
+            exported.append(month)
+            total += count
+
+    return exported, total
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("アーカイブの読み込みには numpy が必要です（pip install numpy）") from None
+    return numpy
+
+
+class WeatherArchive:
+    """
+    export_archive で書き出したアーカイブを numpy.memmap で読む
+    配列はファイルをそのままメモリにマップするため、行ごとのPythonオブジェクトを作らない
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.manifest = load_manifest(directory)
+        self._np = _numpy()
+
+    def months(self):
+        return sorted(self.manifest['partitions'])
+
+    def partition(self, month, columns=None):
+        """1か月分の {列名: numpy.memmap}（行のない月は空の配列）"""
+        rows = self.manifest['partitions'][month]['rows']
+        result = {}
+        for name in columns or COLUMNS:
+            dtype = self.manifest['columns'][name]
+            if rows == 0:
+                result[name] = self._np.empty(0, dtype=dtype)
+            else:
+                path = os.path.join(self.directory, month, f"{name}.bin")
+                result[name] = self._np.memmap(path, dtype=dtype, mode='r', shape=(rows,))
+        return result
+
+    def iter_partitions(self, start=None, end=None, columns=None):
+        """
+        start <= 時刻 < end（datetime）の行を月ごとに (month, {列名: 配列}) で返す
+        月の中は時刻順なので、範囲の切り出しはコピーしないスライスになる
+        """
+        start_month = start.astimezone(JST).strftime('%Y-%m') if start else None
+        end_month = end.astimezone(JST).strftime('%Y-%m') if end else None
+        names = list(columns or COLUMNS)
+        if (start or end) and 'time' not in names:
+            names.append('time')
+
+        for month in self.months():
+            if (start_month and month < start_month) or (end_month and month > end_month):
+                continue
+            arrays = self.partition(month, names)
+            rows = self.manifest['partitions'][month]['rows']
+            lo = int(arrays['time'].searchsorted(int(start.timestamp()))) if start else 0
+            hi = int(arrays['time'].searchsorted(int(end.timestamp()))) if end else rows
+            if lo < hi:
+                yield month, {name: arrays[name][lo:hi] for name in names}
+
+    def code_of(self, column, value):
+        """文字列の値の辞書の番号（なければ None）"""
+        try:
+            return self.manifest['dictionaries'][column].index(value)
+        except ValueError:
+            return None
+
+    def decode(self, column, codes):
+        """辞書の番号の配列を文字列のリストに戻す（欠損は None）"""
+        values = self.manifest['dictionaries'][column]
+        return [values[code] if code >= 0 else None for code in codes.tolist()]
@@ -0,0 +1,201 @@
+# 天気情報の日別・月別の集計表（weather_daily / weather_monthly）
+
+from datetime import date, datetime, timedelta
+
+
+# 期間がこれ以下なら元の行、次の値以下なら日別、それより長ければ月別で返す
+RAW_MAX_DAYS = 14
+DAILY_MAX_DAYS = 400
+
+RESOLUTIONS = ('raw', 'daily', 'monthly')
+
+# 元の行から日ごとに集計する（同じ日の行がなければ何もしない）
+# 最も多い天気が並んだ場合は、時刻の新しい方を選ぶ
+_REFRESH_DAILY = """
+    WITH days AS (
+        SELECT area_id, substr(time, 1, 10) AS day,
+               MIN(min_temperature) AS min_temperature,
+               MAX(max_temperature) AS max_temperature,
+               MAX(rain_proba) AS pop_max,
+               SUM(rain_proba) AS pop_sum,
+               COUNT(rain_proba) AS pop_count,
+               COUNT(*) AS row_count
+        FROM weather_info
+        WHERE area_id = :area_id AND time >= :start AND time < :end
+        GROUP BY day
+    )
+    INSERT INTO weather_daily
+    (area_id, day, min_temperature, max_temperature, pop_max, pop_sum, pop_count, weather, row_count)
+    SELECT area_id, day, min_temperature, max_temperature, pop_max, pop_sum, pop_count, (
+               SELECT weather FROM weather_info w
+               WHERE w.area_id = days.area_id AND w.time >= days.day AND w.time < date(days.day, '+1 day')
+               GROUP BY weather
+               ORDER BY COUNT(*) DESC, MAX(time) DESC
+               LIMIT 1
+           ), row_count
+    FROM days
+    WHERE true
+    ON CONFLICT(area_id, day) DO UPDATE SET
+        min_temperature = excluded.min_temperature,
+        max_temperature = excluded.max_temperature,
+        pop_max = excluded.pop_max,
+        pop_sum = excluded.pop_sum,
+        pop_count = excluded.pop_count,
+        weather = excluded.weather,
+        row_count = excluded.row_count
+"""
+
+# 日別から月ごとに集計する（古い元の行を消した後も日別は残るため）
+# 月の天気は、その天気が最も多かった日の行数の合計が最大のもの
+_REFRESH_MONTHLY = """
+    WITH months AS (
+        SELECT area_id, substr(day, 1, 7) AS month,
+               MIN(min_temperature) AS min_temperature,
+               MAX(max_temperature) AS max_temperature,
+               MAX(pop_max) AS pop_max,
+               SUM(pop_sum) AS pop_sum,
+               SUM(pop_count) AS pop_count,
+               SUM(row_count) AS row_count
+        FROM weather_daily
+        WHERE area_id = :area_id AND day >= :start AND day < :end
+        GROUP BY month
+    )
+    INSERT INTO weather_monthly
+    (area_id, month, min_temperature, max_temperature, pop_max, pop_sum, pop_count, weather, row_count)
+    SELECT area_id, month, min_temperature, max_temperature, pop_max, pop_sum, pop_count, (
+               SELECT weather FROM weather_daily d
+               WHERE d.area_id = months.area_id AND d.day >= months.month AND d.day < months.month || '~'
+                 AND weather IS NOT NULL
+               GROUP BY weather
+               ORDER BY SUM(row_count) DESC, MAX(day) DESC
+               LIMIT 1
+           ), row_count
+    FROM months
+    WHERE true
+    ON CONFLICT(area_id, month) DO UPDATE SET
+        min_temperature = excluded.min_temperature,
+        max_temperature = excluded.max_temperature,
+        pop_max = excluded.pop_max,
+        pop_sum = excluded.pop_sum,
+        pop_count = excluded.pop_count,
+        weather = excluded.weather,
+        row_count = excluded.row_count
+"""
+
+
+def create_tables(conn):
+    """日別・月別の集計表を作成（降水確率の平均は pop_sum / pop_count）"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS weather_daily (
+            area_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            min_temperature REAL,
+            max_temperature REAL,
+            pop_max INTEGER,
+            pop_sum INTEGER,
+            pop_count INTEGER NOT NULL,
+            weather TEXT,
+            row_count INTEGER NOT NULL,
+            PRIMARY KEY (area_id, day)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS weather_monthly (
+            area_id INTEGER NOT NULL,
+            month TEXT NOT NULL,
+            min_temperature REAL,
+            max_temperature REAL,
+            pop_max INTEGER,
+            pop_sum INTEGER,
+            pop_count INTEGER NOT NULL,
+            weather TEXT,
+            row_count INTEGER NOT NULL,
+            PRIMARY KEY (area_id, month)
+        ) WITHOUT ROWID
+    """)
+
+
+def _next_day(day):
+    return (date.fromisoformat(day) + timedelta(days=1)).isoformat()
+
+
+def _next_month(month):
+    year, number = int(month[:4]), int(month[5:7])
+    if number == 12:
+        return f"{year + 1:04d}-01"
+    return f"{year:04d}-{number + 1:02d}"
+
+
+def refresh_area(conn, area_db_id):
+    """1つの地域の集計をすべて作り直す（マイグレーション時など）"""
+    conn.execute(_REFRESH_DAILY, {'area_id': area_db_id, 'start': '', 'end': '~'})
+    conn.execute(_REFRESH_MONTHLY, {'area_id': area_db_id, 'start': '', 'end': '~'})
+
+
+def refresh(conn, keys):
+    """
+    保存した (area.id, 時刻) の日・月だけ集計し直す
+    upsert と同じトランザクションの中で呼ぶ
+    """
+    days = {(area_db_id, time[:10]) for area_db_id, time in keys}
+    if not days:
+        return
+
+    # 続いた日・月は1回の集計（GROUP BY）にまとめる（予報の日は続いているため、ほとんどの地域は1回で済む）
+    conn.executemany(_REFRESH_DAILY, [
+        {'area_id': area_db_id, 'start': start, 'end': _next_day(end)}
+        for area_db_id, start, end in _runs(days, _next_day)
+    ])
+    months = {(area_db_id, day[:7]) for area_db_id, day in days}
+    conn.executemany(_REFRESH_MONTHLY, [
+        {'area_id': area_db_id, 'start': start, 'end': _next_month(end)}
+        for area_db_id, start, end in _runs(months, _next_month)
+    ])
+
+
+def _runs(keys, next_key):
+    #(area.id, 日または月) を、地域ごとに続いた範囲 (area.id, 最初, 最後) にまとめる
+    runs = []
+    for area_db_id, key in sorted(keys):
+        if runs and runs[-1][0] == area_db_id and next_key(runs[-1][2]) == key:
+            runs[-1][2] = key
+        else:
+            runs.append([area_db_id, key, key])
+    return runs
+
+
+def fill_missing(conn, keys):
+    """
+    (area.id, 時刻) の日のうち、まだ日別の集計がない日だけ元の行から集計する
+    古い行を消す前に呼ぶ（集計済みの日は upsert のたびに更新されているため作り直さない）
+    集計した日数を返す
+    """
+    days = {(area_db_id, time[:10]) for area_db_id, time in keys}
+    missing = [
+        (area_db_id, day) for area_db_id, day in sorted(days)
+        if conn.execute(
+            "SELECT 1 FROM weather_daily WHERE area_id = ? AND day = ?", (area_db_id, day)
+        ).fetchone() is None
+    ]
+    if missing:
+        refresh(conn, [(area_db_id, day) for area_db_id, day in missing])
+    return len(missing)
+
+
+def to_date(value):
+    """date / datetime / 'YYYY-MM-DD...' の文字列を date にする"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def choose_resolution(start, end):
+    """期間（両端を含む）の日数から 'raw' / 'daily' / 'monthly' を選ぶ"""
+    days = (to_date(end) - to_date(start)).days + 1
+    if days <= RAW_MAX_DAYS:
+        return 'raw'
+    if days <= DAILY_MAX_DAYS:
+        return 'daily'
+    return 'monthly'
@@ -0,0 +1,230 @@
+# 画面から保存する天気予報を裏のスレッドでまとめてDBに書き込む（write-behind）
+
+import atexit
+import os
+import queue
+import threading
+import time
+
+# 先に読み込んでおき、終了時（atexit は登録と逆順）に接続を閉じる前に書き込めるようにする
+from . import db_connection  # noqa: F401
+
+
+# 保存待ちの上限（これを超えた分は保存しない。予報はキャッシュから取り直せる）
+DEFAULT_MAX_PENDING = 256
+
+# 1回のトランザクションにまとめる予報の数
+DEFAULT_MAX_BATCH = 32
+
+# 終了時に保存待ちの書き込みを待つ上限（秒）
+DEFAULT_CLOSE_TIMEOUT = 10.0
+
+_STOP = object()
+
+
+class WriteBehindQueue:
+    """
+    submit() は予報をキューに入れるだけですぐに戻り、書き込み用のスレッド1本が
+    溜まっている予報をまとめて1つのトランザクションで保存する
+    flush() で保存待ちがなくなるまで待ち、close() でスレッドを止める
+    """
+
+    def __init__(self, db_service, max_pending=DEFAULT_MAX_PENDING, max_batch=DEFAULT_MAX_BATCH):
+        self.db_service = db_service
+        self.max_batch = max_batch
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self._lock = threading.Lock()
+        # 保存待ち（キューの中と書き込み中）の数。flush() はこれが0になるのを待つ
+        self._pending = 0
+        self._idle = threading.Condition(self._lock)
+        self._closed = False
+
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+        self.batches = 0
+        self.rows_written = 0
+        self.max_depth = 0
+        # キューに入れてからコミットするまでの時間（秒）
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def submit(self, area_code, area_name, forecast):
+        """
+        予報を保存待ちに入れる（待たずに戻る）
+        保存待ちが上限に達している場合は保存せず False を返す
+        """
+        return self._put((area_code, area_name, forecast, time.perf_counter()))
+
+    def record_view(self, area_code):
+        """画面で地域を開いたことを、次の書き込みでまとめて記録する（上限に達していれば False）"""
+        return self._put((area_code, None, None, time.perf_counter()))
+
+    def _put(self, item):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("WriteBehindQueue は閉じられています")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+                self._thread.start()
+
+            try:
+                self._queue.put_nowait(item)
+            except queue.Full:
+                self.dropped += 1
+                return False
+
+            self._pending += 1
+            self.submitted += 1
+            self.max_depth = max(self.max_depth, self._queue.qsize())
+            return True
+
+    def flush(self, timeout=None):
+        """保存待ちがなくなるまで待つ（timeout 秒で諦めたら False）"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._idle:
+            while self._pending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+            return True
+
+    def close(self, timeout=DEFAULT_CLOSE_TIMEOUT):
+        """保存待ちを書き込んでからスレッドを止める（終了時に自動で呼ばれる）"""
+        with self._lock:
+            if self._closed:
+                return True
+            self._closed = True
+            thread = self._thread
+
+        if thread is None:
+            return True
+        flushed = self.flush(timeout)
+        self._queue.put(_STOP)
+        thread.join(timeout)
+        return flushed
+
+    def stats(self):
+        """キューの深さ・書き込み件数・遅延（秒）"""
+        with self._lock:
+            return {
+                'depth': self._queue.qsize(),
+                'pending': self._pending,
+                'max_depth': self.max_depth,
+                'submitted': self.submitted,
+                'written': self.written,
+                'dropped': self.dropped,
+                'errors': self.errors,
+                'batches': self.batches,
+                'rows_written': self.rows_written,
+                'latency_avg': self.latency_total / self.written if self.written else 0.0,
+                'latency_max': self.latency_max,
+            }
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+
+            # 溜まっている分をまとめて取り出す
+            batch = [item]
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    self._queue.put(_STOP)
+                    break
+                batch.append(item)
+
+            self._write(batch)
+
+    def _write(self, batch):
+        #まとめて1トランザクションで保存し、失敗したら1件ずつ保存し直す（1件の失敗で他を失わない）
+        try:
+            results = [self._write_items(batch)]
+        except Exception as e:
+            print(f"保存待ちの書き込みエラー（1件ずつ保存し直します）: {e}")
+            results = []
+            for item in batch:
+                try:
+                    results.append(self._write_items([item]))
+                except Exception as e:
+                    print(f"天気情報の保存エラー ({item[0]}): {e}")
+                    results.append(None)
+
+        with self._lock:
+            self.batches += 1
+            for result in results:
+                if result is None:
+                    self.errors += 1
+                    continue
+                count, rows, latencies = result
+                self.written += count
+                self.rows_written += rows
+                for latency in latencies:
+                    self.latency_total += latency
+                    self.latency_max = max(self.latency_max, latency)
+            self._pending -= len(batch)
+            if not self._pending:
+                self._idle.notify_all()
+
+        saved = sum(result[0] for result in results if result)
+        if saved:
+            print(f"💾 データベースに{saved}地域の天気予報を保存しました（待ち時間 最大{self.latency_max * 1000:.0f}ms）")
+
+    def _write_items(self, items):
+        db_service = self.db_service
+        # 入れ子の write() は外側のトランザクションにまとまる
+        with db_service.connections.write():
+            forecasts = []
+            views = {}
+            for area_code, area_name, forecast, _ in items:
+                if forecast is None:
+                    # record_view() で入れた閲覧の記録
+                    views[area_code] = views.get(area_code, 0) + 1
+                    continue
+                area_db_id = db_service.insert_area(area_name, area_code)
+                if area_db_id is None:
+                    raise RuntimeError(f"エリアの登録に失敗しました: {area_code}")
+                forecasts.append((area_db_id, forecast))
+            if views:
+                db_service.record_area_views(views)
+            inserted, updated = 0, 0
+            if forecasts:
+                inserted, updated, _ = db_service.upsert_weather_data(forecasts)
+
+        committed = time.perf_counter()
+        return len(forecasts), inserted + updated, [committed - item[3] for item in items if item[2] is not None]
+
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+
+def get_queue(db_service):
+    """DBファイルごとに共有する WriteBehindQueue を取得"""
+    key = os.path.abspath(db_service.db_path)
+    with _queues_lock:
+        writer = _queues.get(key)
+        if writer is None or writer._closed:
+            writer = WriteBehindQueue(db_service)
+            _queues[key] = writer
+        return writer
+
+
+def close_all(timeout=DEFAULT_CLOSE_TIMEOUT):
+    """すべての保存待ちを書き込んでスレッドを止める（終了時に自動で呼ばれる）"""
+    with _queues_lock:
+        writers = list(_queues.values())
+        _queues.clear()
+    for writer in writers:
+        writer.close(timeout)
+
+
+atexit.register(close_all)
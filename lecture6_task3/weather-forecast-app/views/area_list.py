@@ -10,7 +10,10 @@ if __name__ == "__main__":
     sys.path.insert(0, str(project_root))
 
 import flet as ft
-from services.jma_api import JmaApiService
+from services.area_cache import AreaCache
+
+# 地域リストのディスクキャッシュ（画面を作り直しても共有する）
+area_cache = AreaCache()
 
 class AreaListView(ft.Column):
     #地域選択画面のクラス
@@ -27,7 +30,7 @@ class AreaListView(ft.Column):
         self._page = page
         self.on_area_selected = on_area_selected
         
-        #地域データ
+        #地域データ（AreaCatalog、centersとofficesだけを解析する）
         self.areas_data = None
         
         #検索用
@@ -98,8 +101,8 @@ class AreaListView(ft.Column):
         self.padding = 0
         
     def _load_areas (self):
-        #地域データの読み込み（FROM　API）
-        self.areas_data = JmaApiService.get_area_list()
+        #地域データの読み込み（ディスクキャッシュ、なければAPI）
+        self.areas_data = area_cache.get_catalog(on_updated=self._on_areas_updated)
         
         if self.areas_data:
             
@@ -113,51 +116,52 @@ class AreaListView(ft.Column):
             ]
             self._safe_update()
             
+    def _on_areas_updated(self, areas_data):
+        #裏で再検証した地域リストが変わっていたら表示し直す
+        print("📍 地域リストを更新しました")
+        self.areas_data = areas_data
+        self._display_areas()
+            
     def _display_areas(self):
         #地域リストを表示（ExpansionTileでグループ化）
         
         self.area_list_column.controls.clear()
         
         # centersから地方情報を取得
-        centers = self.areas_data.get('centers', {})
-        
-        # officesから地域を取得
-        offices = self.areas_data.get('offices', {})
+        centers = self.areas_data.section('centers')
         
         # 地方ごとにExpansionTileを作成
-        for center_code, center_info in centers.items():
-            center_name = center_info.get('name', '不明な地方')
-            children_codes = center_info.get('children', [])
+        for center_code, center_name in centers.items():
+            center_name = center_name or '不明な地方'
             
             # この地方に属する地域のリストを作成
             region_tiles = []
             
-            for area_code in children_codes:
-                if area_code in offices:
-                    area_info = offices[area_code]
-                    area_name = area_info.get('name', '不明')
-                    
-                    # 検索フィルターを適用
-                    if self.search_query and self.search_query.lower() not in area_name.lower():
-                        continue
-                    
-                    
-                    # 地域のListTile（白背景のカード風）
-                    area_tile = ft.Container(
-                        content=ft.ListTile(
-                            title=ft.Text(area_name, size=14, weight=ft.FontWeight.W_500),
-                            subtitle=ft.Text(f"コード: {area_code}", size=11, color=ft.Colors.GREY_700),
-                            leading=ft.Icon(ft.Icons.LOCATION_ON, size=20, color=ft.Colors.BLUE),
-                            on_click=lambda e, code=area_code: self._on_area_clicked(code),
-                            dense=True,
-                        ),
-                        bgcolor=ft.Colors.WHITE,
-                        border_radius=8,
-                        margin=ft.margin.only(bottom=5),
-                        padding=ft.padding.all(5),
-                    )
-                    
-                    region_tiles.append(area_tile)
+            # officesから地域を取得
+            for area_code, area_name in self.areas_data.children('centers', center_code):
+                area_name = area_name or '不明'
+                
+                # 検索フィルターを適用
+                if self.search_query and self.search_query.lower() not in area_name.lower():
+                    continue
+                
+                
+                # 地域のListTile（白背景のカード風）
+                area_tile = ft.Container(
+                    content=ft.ListTile(
+                        title=ft.Text(area_name, size=14, weight=ft.FontWeight.W_500),
+                        subtitle=ft.Text(f"コード: {area_code}", size=11, color=ft.Colors.GREY_700),
+                        leading=ft.Icon(ft.Icons.LOCATION_ON, size=20, color=ft.Colors.BLUE),
+                        on_click=lambda e, code=area_code: self._on_area_clicked(code),
+                        dense=True,
+                    ),
+                    bgcolor=ft.Colors.WHITE,
+                    border_radius=8,
+                    margin=ft.margin.only(bottom=5),
+                    padding=ft.padding.all(5),
+                )
+                
+                region_tiles.append(area_tile)
             
             # 地域が見つからない場合はスキップ
             if not region_tiles:
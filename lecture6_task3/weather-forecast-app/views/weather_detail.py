@@ -10,6 +10,8 @@ if __name__ == "__main__":
 import flet as ft
 from services.jma_api import JmaApiService
 from services.db_service import DatabaseService
+from services import write_behind
+from services.forecast_model import format_temp, parse_forecast
 from datetime import datetime
 
 
@@ -29,11 +31,18 @@ class WeatherDetailView(ft.Column):
         self.area_code = area_code
         self.on_back = on_back
         
-        #天気予報データ
+        #天気予報データ（解析済み）
         self.weather_data = None
         
         # データベースサービス
         self.db_service = DatabaseService(db_path='../weather.db')
+        # DBへの保存は裏のスレッドでまとめて行い、表示を待たせない
+        self.db_writer = write_behind.get_queue(self.db_service)
+        # DBのスキーマが古い間（auto_update.py でのマイグレーション待ち）は保存・履歴を使わない
+        self.db_ready = self.db_service.schema_current
+        # 開いた回数を記録し、自動更新でよく開かれる地域を優先して取得する
+        if self.db_ready:
+            self.db_writer.record_view(area_code)
         
         # 現在のタブ（0: 現在の予報, 1: 過去の履歴）
         self.current_tab = 0
@@ -164,6 +173,27 @@ class WeatherDetailView(ft.Column):
         """過去の天気情報を表示"""
         self.content_column.controls.clear()
         
+        if not self.db_ready:
+            self.content_column.controls.append(
+                ft.Container(
+                    content=ft.Column(
+                        controls=[
+                            ft.Icon(ft.Icons.HISTORY, size=64, color=ft.Colors.GREY),
+                            ft.Text(
+                                "データベースの更新が必要です（auto_update.py を実行してください）",
+                                size=16,
+                                color=ft.Colors.GREY_700,
+                            ),
+                        ],
+                        horizontal_alignment=ft.CrossAxisAlignment.CENTER,
+                        spacing=10,
+                    ),
+                    padding=50,
+                )
+            )
+            self._safe_update()
+            return
+        
         # ローディング表示
         self.content_column.controls.append(
             ft.ProgressRing(color=ft.Colors.BLUE)
@@ -173,6 +203,9 @@ class WeatherDetailView(ft.Column):
         )
         self._safe_update()
         
+        # 保存待ちの予報を書き込んでから履歴を読む
+        self.db_writer.flush(timeout=2.0)
+        
         # データベースから履歴を取得
         history = self.db_service.get_weather_history(area_id=self.area_code, limit=50)
         
@@ -314,40 +347,28 @@ class WeatherDetailView(ft.Column):
         
         return card
         
-    def _load_weather(self):
-        #天気予報データを読み込む
+    def _load_weather(self, refresh=False):
+        #天気予報データを読み込む（refresh なら キャッシュを使わず取得し直す）
         print(f"🌤️ 天気予報を取得中: {self.area_code}")
-        self.weather_data = JmaApiService().get_weather_forecast(self.area_code)
+        weather_json = JmaApiService.get_cached_weather_forecast(self.area_code, refresh=refresh)
+        
+        # 一度だけ解析し、DB保存と画面表示の両方で使う
+        self.weather_data = None
+        if weather_json:
+            try:
+                self.weather_data = parse_forecast(weather_json)
+            except Exception as e:
+                print(f"天気予報解析エラー: {e}")
         
         if self.weather_data:
             print(" 天気予報取得成功")
             
-            # データベースに保存
-            try:
-                # エリア名を取得
-                area_name = "不明な地域"
-                if self.weather_data and len(self.weather_data) > 0:
-                    time_series = self.weather_data[0].get('timeSeries', [])
-                    if time_series and len(time_series) > 0:
-                        areas = time_series[0].get('areas', [])
-                        if areas and len(areas) > 0:
-                            area_name = areas[0].get('area', {}).get('name', area_name)
-                
-                # エリアをDBに登録
-                area_db_id = self.db_service.insert_area(area_name, self.area_code)
-                
-                if area_db_id:
-                    # 天気情報をDBに保存
-                    saved_count = self.db_service.insert_or_update_weather_data(
-                        area_db_id, 
-                        self.weather_data
-                    )
-                    print(f"💾 データベースに{saved_count}件保存しました")
-                else:
-                    print("⚠️ エリアの登録に失敗しました")
-                    
-            except Exception as e:
-                print(f"⚠️ データベース保存エラー: {e}")
+            # データベースへの保存を依頼（書き込みは裏のスレッドで行うので待たない）
+            area_name = self.weather_data.area_name or "不明な地域"
+            if not self.db_ready:
+                print("⚠️ DBの更新が済んでいないため、今回の天気予報は保存しません")
+            elif not self.db_writer.submit(self.area_code, area_name, self.weather_data):
+                print("⚠️ 保存待ちがいっぱいのため、今回の天気予報は保存しません")
             
             # 画面に表示
             self._display_weather()
@@ -374,22 +395,13 @@ class WeatherDetailView(ft.Column):
         self.content_column.controls.clear()
         
         #地域名を取得
+        forecast = self.weather_data
         area_name = "不明な地域"
         publishing_office = ""
         
-        if self.weather_data and len(self.weather_data) > 0:
-            first_forecast = self.weather_data[0]
-            publishing_office = first_forecast.get('publishingOffice', '')
-            
-            # timeSeries[0]のareasから地域名を取得
-            try:
-                time_series = first_forecast.get('timeSeries', [])
-                if time_series and len(time_series) > 0:
-                    areas = time_series[0].get('areas', [])
-                    if areas and len(areas) > 0:
-                        area_name = areas[0].get('area', {}).get('name', area_name)
-            except Exception as e:
-                print(f"地域名取得エラー: {e}")
+        if forecast:
+            publishing_office = forecast.publishing_office
+            area_name = forecast.area_name or area_name
         
         # 地域名表示
         self.content_column.controls.append(
@@ -413,91 +425,64 @@ class WeatherDetailView(ft.Column):
         self.content_column.controls.append(ft.Divider())
         
         # 天気予報がない場合
-        if not self.weather_data or len(self.weather_data) == 0:
+        if not forecast or not forecast.areas:
             self.content_column.controls.append(
                 ft.Text("この地域の天気予報は利用できません")
             )
             self._safe_update()
             return
         
-        # timeSeriesから天気予報データを取得(気温降水量、天気、風、波)
+        # 天気予報データを表示(気温、降水確率、天気、風、波)
         try:
-            first_forecast = self.weather_data[0]
-            time_series = first_forecast.get('timeSeries', [])
-            
-            # 降水確率のデータを取得
-            pops = []
-            
-            # 降水確率（timeSeries[1]）
-            if len(time_series) > 1:
-                pop_data = time_series[1].get('areas', [])
-                if pop_data and len(pop_data) > 0:
-                    pops = pop_data[0].get('pops', [])
-            
-            # 気温データを取得（timeSeries[2]）
-            temp_min_max = []  # 最低気温と最高気温のペア
+            # 気温データは通常、[最低, 最高, 最低, 最高, ...] の順
+            # 各日の最低気温と最高気温をペアにする
+            temp_min_max = []
             
-            if len(time_series) > 2:
-                temp_series = time_series[2]
-                temp_time_defines = temp_series.get('timeDefines', [])
-                temp_areas = temp_series.get('areas', [])
+            for pair in forecast.temp_pairs():
+                if len(pair) == 1:
+                    # 1つだけの場合
+                    if pair[0] is not None:
+                        temp_min_max.append(f"{format_temp(pair[0])}℃")
+                    else:
+                        temp_min_max.append("気温情報なし")
+                    continue
                 
-                if temp_areas and len(temp_areas) > 0:
-                    temps = temp_areas[0].get('temps', [])
-                    
-                    # 気温データは通常、[最低, 最高, 最低, 最高, ...] の順
-                    # 各日の最低気温と最高気温をペアにする
-                    for i in range(0, len(temps), 2):
-                        if i + 1 < len(temps):
-                            min_temp = temps[i] if temps[i] != '' else None
-                            max_temp = temps[i + 1] if temps[i + 1] != '' else None
-                            
-                            # 両方のデータがある場合
-                            if min_temp and max_temp:
-                                # 最低と最高が同じ場合（お昼以降など）
-                                if min_temp == max_temp:
-                                    temp_min_max.append(f"最高: {max_temp}℃")
-                                else:
-                                    temp_min_max.append(f"{min_temp}℃ / {max_temp}℃")
-                            # 最高気温のみの場合
-                            elif max_temp and not min_temp:
-                                temp_min_max.append(f"最高: {max_temp}℃")
-                            # 最低気温のみの場合
-                            elif min_temp and not max_temp:
-                                temp_min_max.append(f"最低: {min_temp}℃")
-                            # 両方ともない場合
-                            else:
-                                temp_min_max.append("気温情報なし")
-                        elif i < len(temps):
-                            # 1つだけの場合
-                            if temps[i] != '':
-                                temp_min_max.append(f"{temps[i]}℃")
-                            else:
-                                temp_min_max.append("気温情報なし")
+                min_temp, max_temp = pair
+                
+                # 両方のデータがある場合
+                if min_temp is not None and max_temp is not None:
+                    # 最低と最高が同じ場合（お昼以降など）
+                    if min_temp == max_temp:
+                        temp_min_max.append(f"最高: {format_temp(max_temp)}℃")
+                    else:
+                        temp_min_max.append(f"{format_temp(min_temp)}℃ / {format_temp(max_temp)}℃")
+                # 最高気温のみの場合
+                elif max_temp is not None:
+                    temp_min_max.append(f"最高: {format_temp(max_temp)}℃")
+                # 最低気温のみの場合
+                elif min_temp is not None:
+                    temp_min_max.append(f"最低: {format_temp(min_temp)}℃")
+                # 両方ともない場合
+                else:
+                    temp_min_max.append("気温情報なし")
+            
+            # 最初の細分区域の天気情報を表示
+            area_data = forecast.areas[0]
+            time_defines = forecast.time_defines
             
-            if time_series and len(time_series) > 0:
-                # 最初のtimeSeriesから天気情報を取得
-                ts_data = time_series[0]
-                time_defines = ts_data.get('timeDefines', [])
-                areas = ts_data.get('areas', []) 
+            # 各時間帯の予報を表示（最大3件）
+            for i in range(min(3, len(time_defines))):
+                pop = forecast.pop_at(0, i)
                 
-                if areas and len(areas) > 0:
-                    area_data = areas[0]
-                    weathers = area_data.get('weathers', [])
-                    winds = area_data.get('winds', [])
-                    waves = area_data.get('waves', [])
-                    
-                    # 各時間帯の予報を表示（最大3件）
-                    for i in range(min(3, len(time_defines))):
-                        forecast_card = self._create_forecast_card(
-                            time_defines[i] if i < len(time_defines) else None,
-                            weathers[i] if i < len(weathers) else '情報なし',
-                            winds[i] if i < len(winds) else '情報なし',
-                            waves[i] if i < len(waves) else '情報なし',
-                            temp_min_max[i] if i < len(temp_min_max) else '情報なし',
-                            pops[i] if i < len(pops) else '情報なし'
-                        )
-                        self.content_column.controls.append(forecast_card)
+                forecast_card = self._create_forecast_card(
+                    time_defines[i],
+                    area_data.weathers[i] if i < len(area_data.weathers) else '情報なし',
+                    area_data.winds[i] if i < len(area_data.winds) else '情報なし',
+                    area_data.waves[i] if i < len(area_data.waves) else '情報なし',
+                    temp_min_max[i] if i < len(temp_min_max) else '情報なし',
+                    pop if pop is not None else '情報なし'
+                )
+                self.content_column.controls.append(forecast_card)
                 
         except Exception as e:
             print(f"天気予報表示エラー: {e}")
@@ -527,8 +512,8 @@ class WeatherDetailView(ft.Column):
         ]
         self._safe_update()
     
-        # 天気予報を再取得
-        self._load_weather()
+        # 天気予報を再取得（キャッシュが新鮮でも気象庁から取り直す）
+        self._load_weather(refresh=True)
         
     def _create_forecast_card(self, time_define, weather_text, wind_text, wave_text, temp_text, pop_text):
         """予報カードを作成（ExpansionTileで詳細表示）"""